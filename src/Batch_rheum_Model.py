@@ -10,23 +10,164 @@ try something more like https://qualitysafety.bmj.com/content/qhc/23/5/373.full.
 
 Time unit: day"""
 
+import os
+import random
+import time
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import simpy
 
-from src.helpers import mean_confidence_interval
+from src.helpers import Trial_Results_initiate
+from src.kpis import QUANTILES, confidence_intervals, group_kpis, relative_precision
 from src.initialisers import g
-#from src.patient import FOPA_Patient
+from src.logsinks import LOGS, LogReader, read_dataset, write_dataset
 from src.rheum_Model import rheum_Model
 
+
+def rep_seeds(reps, seed=None):
+    """ Derive one independent seed per replication from a batch seed (numpy SeedSequence spawning).
+
+    Args:
+        reps (_integer_): Number of replications
+        seed (_integer_, optional): Batch seed. If None, drawn from the global random module (so random.seed() upstream still applies). Defaults to None.
+
+    Returns:
+        _list_: One integer seed per replication
+    """
+    if seed is None:
+        seed = random.getrandbits(63)
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(reps)]
+
+
+def run_rep_worker(run, model_kwargs, savepath, seed, debug=False, debuglevel=0, keep_outputs=False, snapshot=None):
+    """ Run a single replication, in its own (worker) process, output folder and seeded RNG stream.
+
+    Module-level so that it can be pickled and sent to a ProcessPoolExecutor.
+
+    Args:
+        run (_integer_): Replication id (within batch)
+        model_kwargs (_dict_): Keyword arguments for rheum_Model (see Batch_rheum_model.model_kwargs)
+        savepath (_string_): Batch save path. The replication logs go to a 'rep<run>/' subfolder of it.
+        seed (_integer_): Seed for the replication RNG stream
+        debug (bool, optional): Value of g.debug in the worker (class attributes are not shared with child processes). Defaults to False.
+        debuglevel (int, optional): Value of g.debuglevel in the worker. Defaults to 0.
+        keep_outputs (bool, optional): Whether to return the streamlit outputs (chart, text, quant) of the replication. Defaults to False.
+        snapshot (_WarmSnapshot_, optional): End of warm-up state to start the replication from (see Batch_rheum_model.warm_up_reps). Defaults to None.
+
+    Returns:
+        _dict_: Replication id, audit log, appointment log, patient log, streaming KPIs, time-weighted KPIs, instrumentation summary and (optional) streamlit outputs
+    """
+    g.debug = debug
+    g.debuglevel = debuglevel
+    random.seed(seed)
+
+    reppath = savepath + f"rep{run}/"
+    os.makedirs(reppath, exist_ok=True)
+    if model_kwargs['loglinesave']:
+        Trial_Results_initiate(reppath + "patient_result2.csv", reppath + "appt_result.csv", reppath + "batch_mon_audit_ls.csv",
+                               model_kwargs['log_format'])
+
+    my_ed_model = rheum_Model(run, repid=run, savepath=reppath, snapshot=snapshot, **model_kwargs)
+    outputs = my_ed_model.run(chart=keep_outputs and my_ed_model.g.figures) # chart only if returned
+    if not keep_outputs:
+        outputs = None
+
+    return {'rep': run,
+            'audit': my_ed_model.g.results,
+            'appointments': my_ed_model.g.appt_queuing_results,
+            'patients': my_ed_model.results_df,
+            'stream': None if my_ed_model.stream_kpis is None else (my_ed_model.stream_kpis.interval_kpis(), my_ed_model.stream_kpis.headline_kpis()),
+            'time_weighted': my_ed_model.time_weighted.headline_kpis(),
+            'instrument': None if my_ed_model.instruments is None else my_ed_model.instrument_summary(),
+            'outputs': outputs}
+
+def warm_up_worker(run, model_kwargs, seed):
+    """ Simulate the warm-up of a single replication, in its own (worker) process and seeded RNG stream.
+
+    Args:
+        run (_integer_): Replication id (within batch)
+        model_kwargs (_dict_): Keyword arguments for rheum_Model (see Batch_rheum_model.model_kwargs)
+        seed (_integer_): Seed for the replication RNG stream (None: global random stream as is)
+
+    Returns:
+        _WarmSnapshot_: System state at the end of warm-up
+    """
+    if seed is not None:
+        random.seed(seed)
+    model_kwargs = {**model_kwargs, 'loglinesave': False, 'stream_stats': False, 'raw_logs': False} # warm-up rows are not kept
+    return rheum_Model(run, repid=run, **model_kwargs).warm_up()
+
+class BatchFigures:
+    """ Figures of a batch, each built on first access (and kept), optionally from downsampled data.
+
+    Headless runs (g.figures off) never touch them, so matplotlib and seaborn are not used.
+    """
+
+    def __init__(self, batch, step=365/4, max_rows=None, max_timepoints=None):
+        """Initialise lazy figures of a batch.
+
+        Args:
+            batch (_Batch_rheum_model_): Batch, with the replications run
+            step (_double_, optional): The timestep in days by which to aggregate temporal KPIs by. Defaults to 365/4.
+            max_rows (int, optional): Maximum number of appointments in violin plots (see plot_audit_reps). Defaults to None, i.e. all.
+            max_timepoints (int, optional): Maximum number of audit timepoints in boxplots (see plot_audit_reps). Defaults to None, i.e. all.
+        """
+        self.batch = batch
+        self.step = step
+        self.max_rows = max_rows
+        self.max_timepoints = max_timepoints
+        self.built = {}
+
+    def downsample(self, max_rows=None, max_timepoints=None):
+        """Lazy figures of the same batch from downsampled data (figures built so far are not reused)"""
+        return BatchFigures(self.batch, self.step, max_rows, max_timepoints)
+
+    def get(self, name):
+        """Build (once) and return the figure pair 'audit' (audit, queueing time) or 'monappKPI' (KPI over time, patients seen)"""
+        if name not in self.built:
+            if name == 'audit':
+                self.built[name] = self.batch.plot_audit_reps(self.max_rows, self.max_timepoints)
+            else:
+                self.built[name] = self.batch.plot_monappKPI_reps(self.step)
+        return self.built[name]
+
+    @property
+    def audit(self):
+        """Audit KPIs figure (boxplots per audit timepoint)"""
+        return self.get('audit')[0]
+
+    @property
+    def q_audit(self):
+        """Queueing time by appointment type figure (violin plot)"""
+        return self.get('audit')[1]
+
+    @property
+    def monappKPI(self):
+        """RTT queueing time KPIs over time figure"""
+        return self.get('monappKPI')[0]
+
+    @property
+    def monappKPIn(self):
+        """Patients seen over time figure"""
+        return self.get('monappKPI')[1]
+
+    def close(self):
+        """Close the figures built so far (free matplotlib memory)"""
+        import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+        for figs in self.built.values():
+            for fig in figs:
+                plt.close(fig)
+        self.built = {}
+
+
 class Batch_rheum_model:
     """ Class for Batch runs / replications of the model """
 
-    def __init__(self,in_res=5 , in_inter_arrival=1, in_prob_pifu=0.6, in_path_horizon_y=3,audit_interval=7,in_savepath="temp/",in_FOavoidable=0,in_interfu_perc=0.6):
+    def __init__(self,in_res=5 , in_inter_arrival=1, in_prob_pifu=0.6, in_path_horizon_y=3,audit_interval=7,in_savepath="temp/",in_FOavoidable=0,in_interfu_perc=0.6,in_log_format='csv',in_loglinesave=True,in_stream_stats=False,in_raw_logs=True,in_capacity_engine='resource',in_rng_block=4096,in_figures=True,in_instrument=False,in_trace_level=0):
         """# Initialise Class for Batch run model. Instantiate g.
 
         Args:
@@ -38,30 +179,82 @@ class Batch_rheum_model:
             in_savepath (str, optional): Save path for outputs. Defaults to "temp/".
             in_FOavoidable (int, optional): A&G proportion - proportion of first-only pathways avoidable via A&G [%]. Defaults to 0.
             in_interfu_perc (float, optional): Percentage increase in inter-appointment interval with PIFU (vs traditional), i.e. 0.6 means 60% longer interval. Defaults to 0.6.
+            in_log_format (str, optional): Backend for saved logs - 'csv', 'parquet' or 'npy' (see logsinks). Defaults to 'csv'.
+            in_loglinesave (bool, optional): Whether replications save their logs to file (True) or keep them in memory (False). Defaults to True.
+            in_stream_stats (bool, optional): Whether replications keep streaming queueing time KPIs, used by headline_KPI and plot_monappKPI_reps instead of the appointment log (see streamstats). Defaults to False.
+            in_raw_logs (bool, optional): Whether replications keep the appointment log (can be False with in_stream_stats). Defaults to True.
+            in_capacity_engine (str, optional): Slot capacity engine of replications - 'resource' or 'heap' (see slotheap). Defaults to 'resource'.
+            in_rng_block (int, optional): Number of random variates pre-sampled per block and source in replications (see randomstreams). 0 for scalar draws from the global random module (without crn). Defaults to 4096.
+            in_figures (bool, optional): Whether run_reps builds figures (batch figures and last replication chart). If False, matplotlib and seaborn are not used, and figures can be built on demand from batch_figures. Defaults to True.
+            in_instrument (bool, optional): Whether replications are instrumented (see instrument). Their summaries are kept in batch_instrument, and exported per replication (instrument_rep<id>.json/.csv) when saving logs. Defaults to False.
+            in_trace_level (int, optional): Highest level of trace records kept by replications (see tracing) - written to trace_rep<id>.bin when saving logs. Defaults to 0, i.e. no trace.
         """
 
         self.batch_mon_appointments = pd.DataFrame()
         self.batch_mon_audit = pd.DataFrame()
         self.batch_mon_app_kpit = pd.DataFrame()
         self.batch_kpi = pd.DataFrame()
+        self.batch_kpi_rep = pd.DataFrame()
+        self.batch_app_kpis = pd.DataFrame()
+        self.batch_stream_kpis = pd.DataFrame() # streaming KPIs per rep, priority and interval (if stream_stats)
+        self.batch_stream_headline = pd.DataFrame() # streaming headline RTT KPIs per rep (if stream_stats)
+        self.batch_time_weighted = pd.DataFrame() # time-weighted waiting list size and utilisation KPIs per rep
+        self.trial_results_df = pd.DataFrame()
+        self.batch_instrument = pd.DataFrame() # instrumentation summary per rep (if instrument)
+        self.crn_seed = None # seed of common random number streams (set by run_reps if crn)
+        self.timings = {} # wall time [s] of batch phases - replications, monappKPI_reps, headline_KPI, plot_audit_reps, plot_monappKPI_reps (the last two if figures are built)
+        self.reps_run = 0 # number of replications run by run_reps_adaptive
+        self.kpi_precision = pd.Series(dtype=float) # relative CI half-width of KPIs reached by run_reps_adaptive
+        self.batch_figures = None # figures of the replications run, built on first access (see BatchFigures). Set by summarise_reps
+        self.log_readers = {} # incremental readers of the saved logs, created on first read_logs_to_self
         self.savepath=in_savepath
-        self.g = g(in_res,in_inter_arrival,in_prob_pifu, in_path_horizon_y, audit_interval,in_FOavoidable=in_FOavoidable,in_interfu_perc=in_interfu_perc) # instance of global variables
+        self.g = g(in_res,in_inter_arrival,in_prob_pifu, in_path_horizon_y, audit_interval,in_FOavoidable=in_FOavoidable,in_interfu_perc=in_interfu_perc,in_log_format=in_log_format,in_loglinesave=in_loglinesave) # instance of global variables
+        self.g.stream_stats = in_stream_stats
+        self.g.raw_logs = in_raw_logs
+        self.g.capacity_engine = in_capacity_engine
+        self.g.rng_block = in_rng_block
+        self.g.figures = in_figures
+        self.g.instrument = in_instrument
+        self.g.trace_level = in_trace_level
 
 
     def read_logs_to_self(self):
-        """Method to read csv results to constructor instance dataframe"""        
-        # Read in results back into self dataframe
-        self.trial_results_df = pd.read_csv(self.savepath +"patient_result2.csv")
-        self.batch_mon_appointments = pd.read_csv(self.savepath +"appt_result.csv")
-        self.batch_mon_audit = pd.read_csv(self.savepath + "batch_mon_audit_ls.csv")
+        """Method to read saved log results to constructor instance dataframes.
 
+        Incremental: only the rows added to the logs since the previous call (e.g. by the latest replication)
+        are parsed and appended, so loading after each of N replications costs O(N) rather than O(N^2) I/O.
+        """
+        if not self.log_readers:
+            self.log_readers = {log: LogReader(self.savepath, log, self.g.log_format) for log in LOGS}
+
+        # Read in new results and append to self dataframes
+        new_appointments = self.log_readers['appt'].read_new()
+        new_appointments = new_appointments[new_appointments['start_q']>self.g.warm_duration] # keep only post warm-up queue starts
+        self.trial_results_df = pd.concat([self.trial_results_df, self.log_readers['patient'].read_new()], ignore_index=True)
+        self.batch_mon_appointments = pd.concat([self.batch_mon_appointments, new_appointments], ignore_index=True)
+        self.batch_mon_audit = pd.concat([self.batch_mon_audit, self.log_readers['audit'].read_new()], ignore_index=True)
+
+
+    def plot_audit_reps(self,max_rows=None,max_timepoints=None):
+        """ Plotting an overview of behaviour at audit timepoints (across reps)
 
-    def plot_audit_reps(self):
-        """ Plotting an overview of behaviour at audit timepoints (across reps) """
+        Args:
+            max_rows (int, optional): Maximum number of appointments in the queueing time violin plot (a random sample beyond it). Defaults to None, i.e. all.
+            max_timepoints (int, optional): Maximum number of audit timepoints in the boxplots (evenly spaced, including the last). Defaults to None, i.e. all.
+
+        Returns:
+            _type_: audit and queueing time figures
+        """
+        import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+        import seaborn as sns # pylint: disable=import-outside-toplevel
         t_warm = self.g.warm_duration
 
         fig_q = plt.figure(figsize=(12,12))
-        sns.violinplot(x='type',y='q_time',data=self.batch_mon_appointments[self.batch_mon_appointments['start_q']>t_warm],hue='type')
+        if len(self.batch_mon_appointments): # no appointment log if raw_logs off
+            mon_appointments = self.batch_mon_appointments[self.batch_mon_appointments['start_q']>t_warm]
+            if max_rows is not None and len(mon_appointments) > max_rows:
+                mon_appointments = mon_appointments.sample(max_rows, random_state=0) # downsample for the violin plot
+            sns.violinplot(x='type',y='q_time',data=mon_appointments,hue='type')
 
 
         # Other plot
@@ -72,7 +265,12 @@ class Batch_rheum_model:
         audit_kpis = ['priority 3 patients waiting','priority 1 patients waiting','priority 2 patients waiting','resources occupied']
         pricolors = ['orange','skyblue','green','gray']
         audit_kpis_name = ['RTT appointment waits','Traditional appointment waits','PIFU appointment waits','Resources (slots) occupied']
-        batch_mon_audit_melted = pd.melt(self.batch_mon_audit,id_vars=['time','rep'],value_vars=audit_kpis,var_name='audit_KPI')
+        batch_mon_audit = self.batch_mon_audit
+        audit_times = np.sort(batch_mon_audit['time'].unique())
+        if max_timepoints is not None and len(audit_times) > max_timepoints:
+            keep = audit_times[np.unique(np.linspace(len(audit_times) - 1, 0, max_timepoints).round().astype(int))] # evenly spaced, from the last
+            batch_mon_audit = batch_mon_audit[batch_mon_audit['time'].isin(keep)]
+        batch_mon_audit_melted = pd.melt(batch_mon_audit,id_vars=['time','rep'],value_vars=audit_kpis,var_name='audit_KPI')
 
         fig, axes = plt.subplots(len(audit_kpis),1, figsize=(20, 20), sharey=False)
         #fig.suptitle('Audit point KPIs')
@@ -88,38 +286,44 @@ class Batch_rheum_model:
 
 
     def headline_KPI(self,window_tail=365):
-        """Computing headline/core KPIs on queuing time, resources and waiting list size (batch / inter-replication)."""
+        """Computing headline/core KPIs on queuing time, resources and waiting list size (batch / inter-replication).
 
-        max_time = self.g.warm_duration +  self.g.obs_duration
-        batch_mon_appointments = self.batch_mon_appointments.copy()
-        batch_mon_appointments['end_q']=batch_mon_appointments['start_q']+batch_mon_appointments['q_time']
-        batch_mon_appointments = batch_mon_appointments[batch_mon_appointments['start_q'] > max_time - window_tail]
-        batch_KPIs = batch_mon_appointments[batch_mon_appointments['priority']==3].copy() # only first referrals
-
-        batch_KPIs_q = batch_KPIs[['rep','q_time']].groupby(['rep']).quantile([0.50,0.75,0.92,0.95]).reset_index()
-        batch_KPIs_q=batch_KPIs_q.rename(columns={'level_1':'KPI','q_time':'value'})
-        batch_KPIs_q['KPI'] = 'RTT_q'+ batch_KPIs_q['KPI'].astype(str)
-
-        batch_KPIs_mu=  batch_KPIs[['rep','q_time']].groupby(['rep']).mean().reset_index()
-        batch_KPIs_mu=batch_KPIs_mu.rename(columns={'q_time':'value'})
-        batch_KPIs_mu['KPI']='RTT_mean'
+        With streaming KPIs (g.stream_stats), the queueing time KPIs come from them - window_tail must then equal g.stream_window_tail.
+        The time-weighted mean, max and quantiles of waiting list size per priority (RTT_WL_*, TFU_WL_*, PIFU_WL_*) and of
+        slot utilisation (utilisation_*), kept by replications over the final g.stream_window_tail days, are included
+        when window_tail equals it.
+        """
 
-        batch_KPIs_n=  batch_KPIs[['rep','q_time']].groupby(['rep']).size().reset_index()
-        batch_KPIs_n=batch_KPIs_n.rename(columns={0:'value'})
-        batch_KPIs_n['KPI']='RTT_n'
+        if self.g.stream_stats:
+            if window_tail != self.g.stream_window_tail:
+                raise ValueError(f"Streaming KPIs were kept for a {self.g.stream_window_tail} day window, not {window_tail}")
+            batch_KPIs_rep = self.batch_stream_headline.drop(columns='var')
+        else:
+            max_time = self.g.warm_duration +  self.g.obs_duration
+            batch_mon_appointments = self.batch_mon_appointments.copy()
+            batch_mon_appointments['end_q']=batch_mon_appointments['start_q']+batch_mon_appointments['q_time']
+            batch_mon_appointments = batch_mon_appointments[batch_mon_appointments['start_q'] > max_time - window_tail]
+            batch_KPIs = batch_mon_appointments[batch_mon_appointments['priority']==3].copy() # only first referrals
+
+            # Per replication queueing time KPIs (quantiles, mean, count) in one pass
+            batch_KPIs_rep = group_kpis(batch_KPIs, ['rep'], 'q_time', QUANTILES)
+        kpi_names = {'n':'RTT_n','mean':'RTT_mean'}
+        kpi_names.update({f"q{q}":f"RTT_q{q}" for q in QUANTILES})
+        batch_KPIs_rep = batch_KPIs_rep.rename(columns=kpi_names)
+        batch_KPIs_q = pd.melt(batch_KPIs_rep,id_vars=['rep'],var_name='KPI')
 
         batch_mon_audit = self.batch_mon_audit.copy()
         batch_KPIs_wl = batch_mon_audit[batch_mon_audit['time']==max(batch_mon_audit['time'])].rename(columns={'priority 3 patients waiting':'RTT_WL_end'})
         batch_KPIs_wl= batch_KPIs_wl[['rep','RTT_WL_end','resources occupied']]
         batch_KPIs_wl = pd.melt(batch_KPIs_wl,id_vars=['rep'],var_name='KPI')
 
-        batch_kpi_rep = pd.concat([batch_KPIs_q,batch_KPIs_mu,batch_KPIs_n,batch_KPIs_wl])
-
-        a = batch_kpi_rep.groupby(['KPI']).agg({'value': lambda x: mean_confidence_interval(x)[0]}).rename(columns={'value':'KPI_mean'})
-        b = batch_kpi_rep.groupby(['KPI']).agg({'value': lambda x: mean_confidence_interval(x)[1]}).rename(columns={'value':'KPI_LCI'})
-        c = batch_kpi_rep.groupby(['KPI']).agg({'value': lambda x: mean_confidence_interval(x)[2]}).rename(columns={'value':'KPI_UCI'})
+        batch_kpi_rep = [batch_KPIs_q,batch_KPIs_wl]
+        if window_tail == self.g.stream_window_tail and not self.batch_time_weighted.empty:
+            batch_kpi_rep.append(pd.melt(self.batch_time_weighted,id_vars=['rep'],var_name='KPI'))
+        batch_kpi_rep = pd.concat(batch_kpi_rep)
+        self.batch_kpi_rep = batch_kpi_rep # KPI value per replication (long format)
 
-        batch_kpi = pd.concat([a,b,c],axis=1)
+        batch_kpi = confidence_intervals(batch_kpi_rep, 'KPI', 'value') # mean and CI across replications
 
         self.batch_kpi = batch_kpi
 
@@ -127,41 +331,51 @@ class Batch_rheum_model:
 
 
 
-    def plot_monappKPI_reps(self,step=365/4):
-        """# Plotting an overview of queueing time appointment KPI behaviour (across reps and by time intervals).
+    def monappKPI_reps(self,step=365/4):
+        """# Queueing time appointment KPIs across reps and by time intervals (kept in batch_app_kpis and batch_mon_app_kpit).
 
         Args:
             step (_double_, optional): The timestep in days by which to aggregate temporal KPIs by. Defaults to 365/4.
 
         Returns:
-            _type_: Two figure objects
+            _dataframe_: Tidy (long) frame of the plotted KPIs - median, mean and number seen - per rep, priority and interval
         """
 
-        batch_mon_appointments = self.batch_mon_appointments.copy()
-
-        batch_mon_appointments['end_q'] = batch_mon_appointments['start_q']+batch_mon_appointments['q_time'] # when queueing ended
+        if self.g.stream_stats: # KPIs kept while running (streamstats)
+            if step != self.g.stream_step:
+                raise ValueError(f"Streaming KPIs were kept for {self.g.stream_step} day intervals, not {step}")
+            self.batch_app_kpis = self.batch_stream_kpis.drop(columns='var')
+        else:
+            batch_mon_appointments = self.batch_mon_appointments.copy()
 
-        batch_mon_appointments['interval'] = (batch_mon_appointments['end_q']//step)*step # which timestep (bucket) this belongs to
+            batch_mon_appointments['end_q'] = batch_mon_appointments['start_q']+batch_mon_appointments['q_time'] # when queueing ended
 
-        batch_mon_appointments = batch_mon_appointments[['rep','priority','interval','q_time']] # mfadd 11/12/2023
+            batch_mon_appointments['interval'] = (batch_mon_appointments['end_q']//step)*step # which timestep (bucket) this belongs to
 
-        batch_mon_app_kpit = batch_mon_appointments.groupby(['rep','priority','interval']).quantile([0.50],numeric_only=True).reset_index() # compute median
+            # KPIs (count, mean, quantiles) per replication, priority and interval in one pass. Kept whole in batch_app_kpis
+            self.batch_app_kpis = group_kpis(batch_mon_appointments, ['rep','priority','interval'], 'q_time', QUANTILES)
 
-        batch_mon_app_kpitmu =batch_mon_appointments
-        batch_mon_app_kpitmu['level_3']='mean'
-        batch_mon_app_kpitmu = batch_mon_appointments.groupby(['rep','priority','interval','level_3']).mean().reset_index() # compute mean
+        # Tidy (long) frame of the plotted KPIs: median, mean and number seen ('Seen')
+        batch_mon_app_kpit = pd.melt(self.batch_app_kpis.rename(columns={'q0.5':0.5,'n':'Seen'}),
+                                     id_vars=['rep','priority','interval'],value_vars=[0.5,'mean','Seen'],
+                                     var_name='KPI',value_name='q_time')
 
-        batch_mon_app_kpit = pd.concat([batch_mon_app_kpit,batch_mon_app_kpitmu])
+        self.batch_mon_app_kpit = batch_mon_app_kpit
+        return batch_mon_app_kpit
 
-        batch_mon_app_kpit = batch_mon_app_kpit.rename(columns={'level_3':'KPI'})
 
-        batch_mon_app_kpiseen = batch_mon_appointments.groupby(['rep','priority','interval']).size().reset_index(name='q_time') # compute patient count
-        batch_mon_app_kpiseen['KPI']='Seen'
-        batch_mon_app_kpit = pd.concat([batch_mon_app_kpit,batch_mon_app_kpiseen])
+    def plot_monappKPI_reps(self,step=365/4):
+        """# Plotting an overview of queueing time appointment KPI behaviour (across reps and by time intervals).
 
-        #batch_mon_app_kpit.to_csv('batch_mon_app_kpit.csv')
+        Args:
+            step (_double_, optional): The timestep in days by which to aggregate temporal KPIs by. Defaults to 365/4.
 
-        self.batch_mon_app_kpit = batch_mon_app_kpit
+        Returns:
+            _type_: Two figure objects
+        """
+        import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+        import seaborn as sns # pylint: disable=import-outside-toplevel
+        batch_mon_app_kpit = self.monappKPI_reps(step)
 
         ## Create boxplot
         #fig_qtime = plt.figure(figsize=(12,12))
@@ -203,75 +417,348 @@ class Batch_rheum_model:
         return fig, fig2
 
 
-    def run_reps(self,reps):
+    def model_kwargs(self):
+        """ Keyword arguments to instantiate one rheum_Model replication from this batch's parameters """
+        return {'in_res': self.g.number_of_slots,
+                'in_inter_arrival': self.g.wl_inter,
+                'in_prob_pifu': self.g.prob_pifu,
+                'in_path_horizon_y': self.g.max_fuopa_tenor_y,
+                'audit_interval': self.g.audit_interval,
+                'in_FOavoidable': self.g.in_FOavoidable,
+                'in_interfu_perc': self.g.interfu_perc,
+                'log_format': self.g.log_format,
+                'loglinesave': self.g.loglinesave,
+                'stream_stats': self.g.stream_stats,
+                'raw_logs': self.g.raw_logs,
+                'crn_seed': self.crn_seed,
+                'capacity_engine': self.g.capacity_engine,
+                'rng_block': self.g.rng_block,
+                'figures': self.g.figures,
+                'instrument': self.g.instrument,
+                'trace_level': self.g.trace_level}
+
+
+    def run_reps(self,reps,n_workers=1,seed=None,crn=False,snapshots=None):
         """  Method to run replications. Calls run method of rheum_Model
 
         Args:
             reps (_integer_): Number of replications
+            n_workers (int, optional): Number of worker processes. If 1, replications run one after another in this process. Defaults to 1.
+            seed (_integer_, optional): Batch seed, from which each replication gets its own RNG stream. If None and n_workers is 1, the global random stream is used as before. Defaults to None.
+            crn (bool, optional): Whether to draw each stochastic source from its own stream seeded by (seed, replication, source), i.e. common random numbers across scenarios run with the same seed (see randomstreams). Defaults to False.
+            snapshots (_list_, optional): End of warm-up snapshot per replication (see warm_up_reps) to start replications from, instead of simulating the warm-up. Random numbers then continue from the snapshots. Defaults to None.
 
         Returns:
             _type_: various outputs for streamlit . Others saved to file or kept in self of Class instance.
         """
 
-        for run in range(reps):
+        self.crn_seed = None
+        if crn:
+            self.crn_seed = seed if seed is not None else random.getrandbits(63)
+
+        seeds = rep_seeds(reps, seed) if seed is not None or n_workers > 1 else None
+        start = time.perf_counter()
+        chart_output_lastrep, text_output_lastrep, quant_output_lastrep = self.run_rep_ids(range(reps), n_workers, seeds, snapshots)
+        self.timings['replications'] = time.perf_counter() - start
+
+        ### Batch summaries (plots, KPIs...)
+        fig_audit_reps, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps = self.summarise_reps()
+
+        return fig_audit_reps, chart_output_lastrep, text_output_lastrep, quant_output_lastrep, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps
+
 
+    def run_reps_adaptive(self,kpis=('RTT_q0.92','RTT_WL_end'),rel_precision=0.1,min_reps=5,batch_reps=None,max_reps=100,n_workers=1,seed=None,crn=False,window_tail=365):
+        """  Method to run replications until the chosen headline KPIs are estimated to a relative precision (or max_reps is reached).
+
+        Replications are launched in batches (in parallel if n_workers > 1). After each batch the headline KPIs are
+        recomputed, and replications stop once every chosen KPI has a confidence interval half-width (as
+        mean_confidence_interval) of at most rel_precision times its mean.
+
+        Args:
+            kpis (tuple, optional): Headline KPIs to reach precision on (see headline_KPI). Defaults to ('RTT_q0.92','RTT_WL_end').
+            rel_precision (float, optional): Target CI half-width relative to KPI mean, as decimal. Defaults to 0.1.
+            min_reps (int, optional): Number of replications in the first batch (before precision is first checked), at least 1. Defaults to 5.
+            batch_reps (int, optional): Number of replications per further batch. Defaults to None, i.e. n_workers.
+            max_reps (int, optional): Cap on number of replications. Defaults to 100.
+            n_workers (int, optional): Number of worker processes. Defaults to 1.
+            seed (_integer_, optional): Batch seed. Defaults to None, i.e. drawn from the global random module.
+            crn (bool, optional): Whether to use common random number streams (see run_reps). Defaults to False.
+            window_tail (int, optional): Final window for headline KPIs [days]. Defaults to 365.
+
+        Returns:
+            _type_: as run_reps. The number of replications run and the precision reached are kept in self.reps_run and self.kpi_precision.
+        """
+        if min_reps < 1 or max_reps < 1:
+            raise ValueError(f"min_reps and max_reps must be at least 1, not {min_reps} and {max_reps}")
+        if seed is None:
+            seed = random.getrandbits(63)
+        self.crn_seed = seed if crn else None
+        seeds = rep_seeds(max_reps, seed) # seeds of first n reps do not depend on max_reps
+        batch_reps = batch_reps or max(n_workers, 1)
+
+        reps_run = 0
+        while reps_run < max_reps:
+            new_reps = min(min_reps if reps_run == 0 else batch_reps, max_reps - reps_run)
+            chart_output_lastrep, text_output_lastrep, quant_output_lastrep = self.run_rep_ids(range(reps_run, reps_run + new_reps), n_workers, seeds)
+            reps_run += new_reps
+
+            batch_kpi = self.headline_KPI(window_tail).reindex(list(kpis)) # (KPIs missing from every rep: NaN)
+            self.kpi_precision = relative_precision(batch_kpi) # KPIs not estimated yet (NaN interval) never converge
             if self.g.debug  and self.g.debuglevel>=0:
-                print (f"Run {run+1} of {reps}")
+                print(f"{reps_run} reps - relative CI half-width: {self.kpi_precision.round(3).to_dict()}")
+            if (self.kpi_precision <= rel_precision).all():
+                break
+
+        self.reps_run = reps_run
+
+        ### Batch summaries (plots, KPIs...)
+        fig_audit_reps, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps = self.summarise_reps(window_tail)
+
+        return fig_audit_reps, chart_output_lastrep, text_output_lastrep, quant_output_lastrep, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps
+
+
+    def warm_up_reps(self,reps,n_workers=1,seed=None,crn=False):
+        """  Method to simulate the warm-up of each replication once, and snapshot the system at its end.
+
+        The snapshots can be passed to run_reps (snapshots=...) of this or any other batch that shares the warm-up
+        parameters (e.g. scenarios differing only in PIFU or A&G), so that each starts from the end of warm-up.
+
+        Args:
+            reps (_integer_): Number of replications
+            n_workers (int, optional): Number of worker processes. Defaults to 1.
+            seed (_integer_, optional): Batch seed (as run_reps). Defaults to None.
+            crn (bool, optional): Whether to use common random number streams (as run_reps). Defaults to False.
+
+        Returns:
+            _list_: One WarmSnapshot per replication
+        """
+        self.crn_seed = None
+        if crn:
+            self.crn_seed = seed if seed is not None else random.getrandbits(63)
+
+        seeds = rep_seeds(reps, seed) if seed is not None or n_workers > 1 else [None] * reps
+        model_kwargs = self.model_kwargs()
+
+        if n_workers > 1:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                return list(executor.map(warm_up_worker, range(reps), [model_kwargs] * reps, seeds))
+        return [warm_up_worker(run, model_kwargs, seeds[run]) for run in range(reps)]
+
+
+    def summarise_reps(self,window_tail=365,step=365/4):
+        """ Batch summaries (KPIs, and figures unless g.figures is off) across the replications run so far.
+
+        Figures come from batch_figures, which builds them on first access - with g.figures off they are not built here,
+        but can still be built later from batch_figures.
+
+        Returns:
+            _type_: audit, queueing time (audit), KPI over time and patients seen over time figures (None if g.figures is off)
+        """
+        self.batch_figures = BatchFigures(self, step)
+
+        start = time.perf_counter()
+        self.monappKPI_reps(step) # KPIs over time (for plots and batch_app_kpis)
+        self.timings['monappKPI_reps'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        self.headline_KPI(window_tail) # generate core/headline KPIs
+        self.timings['headline_KPI'] = time.perf_counter() - start
+
+        if not self.g.figures:
+            return None, None, None, None
+
+        start = time.perf_counter()
+        fig_audit_reps, fig_q_audit_reps = self.batch_figures.audit, self.batch_figures.q_audit # generate audit plots
+        self.timings['plot_audit_reps'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        fig_monappKPI_reps, fig_monappKPIn_reps = self.batch_figures.monappKPI, self.batch_figures.monappKPIn # generate KPI over time plots
+        self.timings['plot_monappKPI_reps'] = time.perf_counter() - start
+
+        return fig_audit_reps, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps
+
+
+    def run_rep_ids(self,rep_ids,n_workers=1,seeds=None,snapshots=None):
+        """ Method to run the given replications and add their results to the batch logs
+
+        Args:
+            rep_ids (_range_): Replication ids to run
+            n_workers (int, optional): Number of worker processes. Defaults to 1.
+            seeds (_list_, optional): Seed per replication id (see rep_seeds). Needed if n_workers > 1. Defaults to None, i.e. global random stream.
+            snapshots (_list_, optional): End of warm-up snapshot per replication id (see warm_up_reps). Defaults to None.
+
+        Returns:
+            _type_: chart, text and quant outputs of the last replication (as rheum_Model.run). None if no replication is run.
+        """
+        if len(rep_ids) == 0:
+            return None, None, None
+        if n_workers > 1:
+            return self.run_reps_parallel(rep_ids, n_workers, seeds, snapshots)
+
+        for run in rep_ids:
+
+            if self.g.debug  and self.g.debuglevel>=0:
+                print (f"Run {run+1} of {rep_ids[-1]+1}")
+
+            if seeds is not None:
+                random.seed(seeds[run])
 
             # Instance of rheumatology model
             my_ed_model = rheum_Model(run,
-                                      in_res=self.g.number_of_slots,
-                                      in_inter_arrival=self.g.wl_inter,
-                                      in_prob_pifu=self.g.prob_pifu,
-                                      in_path_horizon_y=self.g.max_fuopa_tenor_y,
-                                      audit_interval=self.g.audit_interval,
                                       repid = run,
                                       savepath = self.savepath,
-                                      in_FOavoidable = self.g.in_FOavoidable,
-                                      in_interfu_perc = self.g.interfu_perc) # create instance of rheumatology model (constructor init)
+                                      snapshot = None if snapshots is None else snapshots[run],
+                                      **self.model_kwargs()) # create instance of rheumatology model (constructor init)
 
 
             start=datetime.now()
-            if run<reps-1:
-                my_ed_model.run() # apply custom method run to instance
+            if run<rep_ids[-1]:
+                my_ed_model.run(chart=False) # apply custom method run to instance (chart only kept for last rep)
 
             else:
                 chart_output_lastrep, text_output_lastrep, quant_output_lastrep = my_ed_model.run()
             if self.g.debug  and self.g.debuglevel>=0:
                 scenario1run = datetime.now()-start
                 print(f"Run-time of Run {run+1}: {scenario1run}")
+                print ()
 
-            print ()
-
-            # Load up audit results of replication
-            e_results = my_ed_model.g.results # audit counts . patients waiting per time
-            self.batch_mon_audit = pd.concat([self.batch_mon_audit, e_results]) # Replication audit result added to Batch audit result df
-
-            # Load up appointment log results of replication
+            # Load up audit and appointment log results of replication
             if self.g.loglinesave:
-                self.read_logs_to_self() # read from file
+                self.read_logs_to_self() # read rows added by this replication from file
             else:
+                e_results = my_ed_model.g.results # audit counts . patients waiting per time
+                self.batch_mon_audit = pd.concat([self.batch_mon_audit, e_results]) # Replication audit result added to Batch audit result df
+
                 e_appt_queuing_result= my_ed_model.g.appt_queuing_results # replication appointments monitor in memory
+                e_appt_queuing_result = e_appt_queuing_result[e_appt_queuing_result['start_q']>self.g.warm_duration] # keep only post warm-up queue starts (rather q finish????)
                 self.batch_mon_appointments = pd.concat([self.batch_mon_appointments,e_appt_queuing_result]) # append for batch
 
-            # keep only post warm-up queue starts (rather q finish????)
-            self.batch_mon_appointments = self.batch_mon_appointments[self.batch_mon_appointments['start_q']>self.g.warm_duration]
+            if my_ed_model.stream_kpis is not None:
+                self.add_stream_kpis(my_ed_model.stream_kpis.interval_kpis(), my_ed_model.stream_kpis.headline_kpis())
+            self.add_time_weighted(my_ed_model.time_weighted.headline_kpis())
+            if my_ed_model.instruments is not None:
+                self.add_instrument(my_ed_model.instrument_summary())
 
-        ### Batch summaries (plots, KPIs...)
-        fig_audit_reps, fig_q_audit_reps = self.plot_audit_reps() # generate audit plots
+        return chart_output_lastrep, text_output_lastrep, quant_output_lastrep
 
-        fig_monappKPI_reps, fig_monappKPIn_reps = self.plot_monappKPI_reps(step=365/4) # generate KPI over time plots
 
-        self.headline_KPI(365) # generate core/headline KPIs
+    def run_reps_parallel(self,rep_ids,n_workers,seeds,snapshots=None):
+        """ Method to run replications across a pool of worker processes.
 
-        return fig_audit_reps, chart_output_lastrep, text_output_lastrep, quant_output_lastrep, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps
+        Each replication gets its own seeded RNG stream (see rep_seeds) and writes its logs to its own
+        'rep<run>/' subfolder of the save path. Results are merged, in replication order, into
+        batch_mon_appointments, batch_mon_audit and trial_results_df.
+
+        Args:
+            rep_ids (_range_): Replication ids to run
+            n_workers (_integer_): Number of worker processes
+            seeds (_list_): Seed per replication id (see rep_seeds)
+            snapshots (_list_, optional): End of warm-up snapshot per replication id (see warm_up_reps). Defaults to None.
+
+        Returns:
+            _type_: chart, text and quant outputs of the last replication (as rheum_Model.run)
+        """
+        model_kwargs = self.model_kwargs()
+        rep_results = []
+
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(run_rep_worker, run, model_kwargs, self.savepath, seeds[run],
+                                       self.g.debug, self.g.debuglevel, run==rep_ids[-1],
+                                       None if snapshots is None else snapshots[run])
+                       for run in rep_ids]
+            for future in as_completed(futures):
+                rep_result = future.result()
+                rep_results.append(rep_result)
+                if self.g.debug  and self.g.debuglevel>=0:
+                    print (f"Run {rep_result['rep']+1} of {rep_ids[-1]+1} completed ({len(rep_results)}/{len(rep_ids)})")
+
+        rep_results.sort(key=lambda x: x['rep'])
+        self.add_rep_results(rep_results)
+
+        return rep_results[-1]['outputs']
+
+
+    def add_rep_results(self, rep_results):
+        """ Merge replication results (see run_rep_worker), in replication order, into batch_mon_appointments,
+        batch_mon_audit, trial_results_df, the streaming and time-weighted KPIs and instrumentation summaries.
+
+        Args:
+            rep_results (_list_): Replication results (dicts returned by run_rep_worker)
+        """
+        rep_results = sorted(rep_results, key=lambda x: x['rep'])
+
+        self.batch_mon_audit = pd.concat([self.batch_mon_audit] + [r['audit'] for r in rep_results])
+        self.trial_results_df = pd.concat([self.trial_results_df] + [r['patients'] for r in rep_results])
+        # keep only post warm-up queue starts
+        self.batch_mon_appointments = pd.concat([self.batch_mon_appointments]
+                                                + [r['appointments'][r['appointments']['start_q']>self.g.warm_duration] for r in rep_results])
+
+        for r in rep_results:
+            if r['stream'] is not None:
+                self.add_stream_kpis(*r['stream'])
+            if r.get('time_weighted') is not None:
+                self.add_time_weighted(r['time_weighted'])
+            if r.get('instrument') is not None:
+                self.add_instrument(r['instrument'])
+
+
+    def add_stream_kpis(self, interval_kpis, headline_kpis):
+        """Append a replication's streaming KPIs (see streamstats.StreamingKPIs) to the batch"""
+        self.batch_stream_kpis = pd.concat([self.batch_stream_kpis, interval_kpis], ignore_index=True)
+        self.batch_stream_headline = pd.concat([self.batch_stream_headline, headline_kpis], ignore_index=True)
 
 
-    def save_logs(self):
-        """  Save aggregate logs (cross-replication)  """
+    def add_time_weighted(self, kpis):
+        """Append a replication's time-weighted KPIs (see streamstats.TimeWeightedKPIs) to the batch"""
+        self.batch_time_weighted = pd.concat([self.batch_time_weighted, kpis], ignore_index=True)
 
-        self.batch_mon_appointments.to_csv(self.savepath + 'batch_mon_appointments.csv')
-        self.batch_mon_audit.to_csv(self.savepath + 'batch_mon_audit.csv')
-        self.batch_mon_app_kpit.to_csv(self.savepath + 'batch_mon_app_kpit.csv')
-        self.batch_kpi.to_csv(self.savepath + 'batch_kpi.csv')
+
+    def add_instrument(self, summary):
+        """Append a replication's instrumentation summary (see instrument.Instrumentation.summary) to the batch"""
+        self.batch_instrument = pd.concat([self.batch_instrument, pd.DataFrame([summary])], ignore_index=True)
+
+
+    def batch_logs(self):
+        """ Aggregate logs (cross-replication), by file stem """
+        return {'batch_mon_appointments': self.batch_mon_appointments,
+                'batch_mon_audit': self.batch_mon_audit,
+                'batch_mon_app_kpit': self.batch_mon_app_kpit,
+                'batch_kpi': self.batch_kpi}
+
+
+    def save_logs(self,log_format='csv',scenario='default',dataset_path=None):
+        """  Save aggregate logs (cross-replication)
+
+        Args:
+            log_format (str, optional): 'csv' (one file per log in the save path) or 'parquet' (one dataset per log, partitioned by scenario and rep, see logsinks.write_dataset). Defaults to 'csv'.
+            scenario (str, optional): Scenario name, partition value of parquet datasets. Defaults to 'default'.
+            dataset_path (str, optional): Folder of parquet datasets, which can be shared by several scenarios. Defaults to None, i.e. savepath + 'batch_logs/'.
+        """
+        if log_format == 'parquet':
+            dataset_path = dataset_path or self.savepath + 'batch_logs/'
+            for name, frame in self.batch_logs().items():
+                if len(frame):
+                    write_dataset(frame, dataset_path + name, scenario)
+            return
+        if log_format != 'csv':
+            raise ValueError(f"Unknown log_format '{log_format}' for batch logs. Choose from ['csv', 'parquet']")
+
+        for name, frame in self.batch_logs().items():
+            frame.to_csv(self.savepath + name + '.csv')
+
+
+    def read_dataset_to_self(self,dataset_path=None,scenario='default',reps=None):
+        """  Load the audit and appointment logs of a scenario from parquet datasets (see save_logs), to recompute KPIs and plots without rerunning.
+
+        Only the appointment columns used by the KPIs and plots, and the post warm-up rows, are read.
+
+        Args:
+            dataset_path (str, optional): Folder of parquet datasets. Defaults to None, i.e. savepath + 'batch_logs/'.
+            scenario (str, optional): Scenario to read. Defaults to 'default'.
+            reps (_list_, optional): Replications to read. Defaults to None, i.e. all.
+        """
+        dataset_path = dataset_path or self.savepath + 'batch_logs/'
+        self.batch_mon_appointments = read_dataset(dataset_path + 'batch_mon_appointments', columns=['rep','priority','type','q_time','start_q'],
+                                                   filters=[('start_q', '>', self.g.warm_duration)], scenarios=[scenario], reps=reps)
+        self.batch_mon_audit = read_dataset(dataset_path + 'batch_mon_audit', scenarios=[scenario], reps=reps).drop(columns='scenario')
         #my_batch_model.plot_monappKPI_reps(step=28*2)
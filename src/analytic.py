@@ -0,0 +1,232 @@
+""" includes the analytic fast-path: fluid/queueing approximation of the clinic for capacity sizing (milliseconds per point, vs minutes for the DES)
+
+The fluid part steps the three priority queues - traditional follow-up (1), PIFU (2) and RTT first appointments (3) -
+one day at a time over warm-up and observation. Follow-up demand comes from the patients in each follow-up phase
+(first appointments served over the last horizon, split into first-only, TFU and PIFU flows as in rheum_Model). It
+captures overload and the build-up of follow-up demand. The queueing part adds the stochastic wait of a stable
+queue, from a non-preemptive priority M/G/c approximation (Erlang C and Cobham's formula) at the end-of-run loads.
+"""
+import itertools
+import math
+import time
+import numpy as np
+import pandas as pd
+
+from src.initialisers import g
+from src.kpis import QUANTILES
+
+
+def erlang_c(servers, load):
+    """ Probability of waiting in an M/M/c queue (Erlang C)
+
+    Args:
+        servers (_integer_): Number of servers
+        load (_double_): Offered load (arrival rate x mean service time)
+
+    Returns:
+        _double_: Probability that an arrival waits (1 if load >= servers)
+    """
+    if load >= servers:
+        return 1.0
+    erlang_b = 1.0
+    for k in range(1, servers + 1): # Erlang B recursion, stable for large number of servers
+        erlang_b = load * erlang_b / (k + load * erlang_b)
+    return erlang_b / (1 - load / servers * (1 - erlang_b))
+
+
+def priority_waits(rates, services, servers, horizon):
+    """ Mean stochastic wait per priority class of a non-preemptive priority M/G/c queue (Cobham's formula with an Erlang C residual).
+
+    Args:
+        rates (_list_): Arrival rate per class, highest priority first [per day]
+        services (_list_): Deterministic service (slot holding) time per class [days]
+        servers (_integer_): Number of servers (daily slots)
+        horizon (_double_): Time the queue has to build up [days]. Waits of nearly saturated classes are capped at the
+            scale a critically loaded queue reaches in it, sqrt(horizon / rate) - saturated classes (load >= 1) get 0, their wait being the fluid queue's
+
+    Returns:
+        _list_: Probability of waiting (all classes) and mean wait per class [days]
+    """
+    loads = [rate * service for rate, service in zip(rates, services)]
+    total_rate, total_load = sum(rates), sum(loads)
+    if total_rate == 0:
+        return 0.0, [0.0] * len(rates)
+    p_wait = erlang_c(servers, total_load)
+    residual = sum(rate * service**2 for rate, service in zip(rates, services)) / (2 * total_load) # mean residual service of deterministic services
+    w0 = p_wait * residual / servers
+    waits, sigma = [], 0.0
+    for rate, load in zip(rates, loads):
+        sigma_prev, sigma = sigma, sigma + load / servers
+        if sigma >= 1 or rate == 0:
+            waits.append(0.0)
+        else:
+            waits.append(min(w0 / ((1 - sigma_prev) * (1 - sigma)), math.sqrt(horizon / rate)))
+    return p_wait, waits
+
+
+def daily_availability(params, horizon):
+    """ Slots available per simulation day: nominal slots, less unavailable slots if params.unavail_on - a single shock
+    period, or periodic windows (as rheum_Model.obstruct_slots).
+
+    Args:
+        params (_g_): Parameters of the model (number_of_slots and unavailability parameters)
+        horizon (_double_): Simulation end time [days]
+
+    Returns:
+        _numpy array_: Slots available on each day 0..ceil(horizon) [slots]
+    """
+    available = np.full(int(np.ceil(horizon)) + 1, params.number_of_slots)
+    if params.unavail_on:
+        if params.unavail_byshock:
+            start = int(params.unavail_shock_tmin)
+            available[start:start + int(params.unavail_shock_period)] -= params.unavail_shock_nrslots
+        else:
+            for start in range(0, len(available), int(params.unavail_freq_slot)):
+                available[start:start + int(params.unavail_slot)] -= params.unavail_nrslots
+        np.clip(available, 0, None, out=available)
+    return available
+
+
+def fluid_run(params, waits=(0.0, 0.0)):
+    """ Daily fluid run of the three priority queues over warm-up and observation.
+
+    Args:
+        params (_g_): Model parameters
+        waits (tuple, optional): Mean stochastic wait of traditional and PIFU follow-ups [days], added to their appointment cycle. Defaults to (0.0, 0.0).
+
+    Returns:
+        _dict_: Per day arrays - arrivals and appointments served per priority (1 TFU, 2 PIFU, 3 RTT), queue sizes and slots occupied
+    """
+    days = int(params.warm_duration + params.obs_duration)
+    available = daily_availability(params, days)
+    arrival_rate = 1.0 / params.wl_inter
+    horizon, t_decision = int(params.max_fuopa_tenor), int(params.t_decision)
+    tfu_cycle = np.mean(params.interOPA_tri) - 0.5 + 1 + waits[0] # mean (integer) days till next need, plus appointment day and wait
+    pifu_cycle = params.mean_interPIFU + 1 + waits[1]
+
+    rows = [] # per day: arrivals and appointments per priority, queue sizes and slots occupied (plain lists, cheaper than numpy per day)
+    starts_tfu = [0.0] * (days + 1) # cumulative follow-up pathway starts staying on traditional follow-up
+    starts_pifu = [0.0] * (days + 1) # cumulative follow-up pathway starts triaged to PIFU
+    q1 = q2 = q3 = 0.0
+    held = 0.0 # slots still held by yesterday's first appointments (2-day slots)
+    follow_up_share = 1 - params.prob_firstonly # share of arrivals with follow-ups
+    available_days = available.tolist()
+
+    for t in range(days):
+        after_warmup = t > params.warm_duration
+        first_only_kept = params.prob_firstonly * (1 - params.in_FOavoidable if after_warmup else 1) # A&G avoids first-only pathways after warm-up
+        a3 = arrival_rate * (follow_up_share + first_only_kept)
+
+        # Patients in follow-up phases: traditional until the horizon (or PIFU decision if triaged to PIFU), then PIFU
+        in_tfu = starts_tfu[t] - starts_tfu[max(t - horizon, 0)]
+        if after_warmup:
+            in_tfu += starts_pifu[t] - starts_pifu[max(t - t_decision, 0)]
+            in_pifu = starts_pifu[max(t - t_decision, 0)] - starts_pifu[max(t - horizon, 0)]
+        else:
+            in_tfu += starts_pifu[t] - starts_pifu[max(t - horizon, 0)]
+            in_pifu = 0.0
+        a1, a2 = in_tfu / tfu_cycle, in_pifu / pifu_cycle
+
+        # Serve queues in priority order from the slots free today
+        free = max(available_days[t] - held, 0.0)
+        s1 = min(q1 + a1, free)
+        s2 = min(q2 + a2, free - s1)
+        s3 = min(q3 + a3, free - s1 - s2)
+        q1, q2, q3 = q1 + a1 - s1, q2 + a2 - s2, q3 + a3 - s3
+        rows.append((a1, a2, a3, s1, s2, s3, q1, q2, q3, held + s1 + s2 + s3))
+        held = s3
+
+        # First appointments leading to follow-up: triaged to PIFU if their pathway is eligible (from warm-up less decision time)
+        to_follow_up = s3 * follow_up_share / (follow_up_share + first_only_kept)
+        prob_pifu = params.prob_pifu if params.PIFUbigbang or t > params.warm_duration - params.t_decision else 0.0
+        starts_tfu[t + 1] = starts_tfu[t] + to_follow_up * (1 - prob_pifu)
+        starts_pifu[t + 1] = starts_pifu[t] + to_follow_up * prob_pifu
+
+    rows = np.array(rows).T
+    return {'arrived': rows[0:3], 'served': rows[3:6], 'queued': rows[6:9], 'occupied': rows[9], 'available': available[:days]}
+
+
+def analytic_kpis(params, window_tail=365, quantiles=QUANTILES):
+    """ Approximate headline KPIs of a model run (as Batch_rheum_model.headline_KPI means) from its parameters.
+
+    Args:
+        params (_g_): Model parameters
+        window_tail (int, optional): Final window for RTT queueing time KPIs [days]. Defaults to 365.
+        quantiles (tuple, optional): RTT queueing time quantiles. Defaults to QUANTILES.
+
+    Returns:
+        _Series_: RTT_n, RTT_mean, RTT_q<quantile>, RTT_WL_end, resources occupied, TFU_WL_end, PIFU_WL_end and utilisation.
+            RTT_n counts window arrivals seen by the end of the run, while RTT_mean and quantiles also include those still
+            queued (inf if RTT patients are no longer seen at all)
+    """
+    days = int(params.warm_duration + params.obs_duration)
+    window = slice(days - int(window_tail), days)
+    servers = int(params.number_of_slots)
+
+    # Fluid run, rerun with the stochastic follow-up waits in the appointment cycles
+    run = fluid_run(params)
+    for _ in range(2):
+        rates = run['arrived'][:, window].mean(axis=1)
+        p_wait, waits = priority_waits(rates, (1, 1, 2), servers, params.obs_duration)
+        run = fluid_run(params, waits[:2])
+
+    # Fluid RTT delay (FIFO within priority) of arrivals in the window: seen by the end of the run, or still queued
+    # (censored) - waited until the end, plus the fluid queue ahead of them drained at the window's RTT service rate
+    # (inf if none are served). Under overload the DES logs only the appointments seen, but their waits grow with the
+    # backlog, so counting queued arrivals keeps the quantiles increasing as slots go down.
+    cum_arrived = np.cumsum(run['arrived'][2])
+    cum_served = np.cumsum(run['served'][2])
+    arrival_days = np.arange(days)[window]
+    seen = cum_arrived[window] <= cum_served[-1] + 1e-9
+    delay = (np.searchsorted(cum_served, cum_arrived[window][seen] - 1e-9) - arrival_days[seen]).clip(min=0)
+    drain = run['served'][2][window].mean()
+    backlog = cum_arrived[window][~seen] - cum_served[-1]
+    censored = days - arrival_days[~seen] + (backlog / drain if drain > 0 else np.inf)
+    delay = np.concatenate([delay, censored])
+    weights = run['arrived'][2][window]
+    weights = np.concatenate([weights[seen], weights[~seen]])
+    finite = np.isfinite(delay)
+
+    # Plus stochastic wait - waits with probability p_wait, exponential given wait
+    cond_wait = waits[2] / p_wait if p_wait > 0 else 0.0
+    grid = np.linspace(0, delay[finite].max(initial=0) + 10 * cond_wait + 1, 1000)
+    extra = (grid[:, None] - delay[None, finite]).clip(min=0)
+    cdf = np.where(grid[:, None] >= delay[None, finite], 1 - p_wait * np.exp(-extra / cond_wait) if cond_wait > 0 else 1.0, 0.0)
+    cdf = (cdf * weights[finite]).sum(axis=1) / max(weights.sum(), 1e-12) # (infinite delays never reached)
+
+    kpis = {'RTT_n': weights[:seen.sum()].sum(), # seen by the end of the run, as the DES appointment log
+            'RTT_mean': (np.average(delay, weights=weights) if weights.sum() > 0 else 0.0) + waits[2]}
+    for q in quantiles:
+        kpis[f"RTT_q{q}"] = float(np.interp(q, cdf, grid)) if q <= cdf[-1] + 1e-12 else np.inf
+    end_queue = run['queued'][:, -1]
+    kpis['RTT_WL_end'] = end_queue[2] + rates[2] * waits[2] # fluid queue plus stochastic queue (Little's law)
+    kpis['resources occupied'] = run['occupied'][window].mean()
+    kpis['TFU_WL_end'] = end_queue[0] + rates[0] * waits[0]
+    kpis['PIFU_WL_end'] = end_queue[1] + rates[1] * waits[1]
+    kpis['utilisation'] = run['occupied'][window].sum() / run['available'][window].sum()
+    return pd.Series(kpis)
+
+
+def analytic_sweep(grid, window_tail=365, **fixed):
+    """ Analytic KPIs over a full grid of Batch_rheum_model parameters, e.g. to shortlist points for the DES.
+
+    Example:
+        sweep = analytic_sweep({'in_res': range(30, 50), 'in_prob_pifu': [0, 0.1, 0.2, 0.3]}, in_inter_arrival=1/6)
+        shortlist = sweep[sweep['RTT_q0.92'] < 126]
+
+    Args:
+        grid (_dict_): Parameter name (as Batch_rheum_model / g arguments: in_res, in_inter_arrival, in_prob_pifu, in_path_horizon_y, in_FOavoidable, in_interfu_perc) -> values
+        window_tail (int, optional): Final window for RTT queueing time KPIs [days]. Defaults to 365.
+        **fixed: Other parameters, fixed across the grid
+
+    Returns:
+        _dataframe_: One row per grid point - parameters, analytic KPIs (see analytic_kpis) and compute time [ms]
+    """
+    rows = []
+    names = list(grid)
+    for values in itertools.product(*grid.values()):
+        point = {**fixed, **dict(zip(names, values))}
+        start = time.perf_counter()
+        kpis = analytic_kpis(g(**point), window_tail)
+        rows.append({**point, **kpis, 'ms': (time.perf_counter() - start) * 1000})
+    return pd.DataFrame(rows)
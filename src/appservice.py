@@ -0,0 +1,253 @@
+""" includes the results service layer of the Streamlit app: scenario batches run in a background pool of worker
+processes, replication by replication, with progress and partial KPIs as replications complete. Results are cached by
+scenario parameters (LRU, evicting the least recently used batches once their frames exceed a memory budget).
+
+The service is meant to be created once per app process (st.cache_resource) and polled on each script rerun:
+    service = ResultsService()
+    job = service.submit({'in_res': 41, 'in_inter_arrival': 1/6, 'in_prob_pifu': 0.2}, reps=3)
+    service.poll(job) # collect completed replications
+    job.progress(), job.batch.batch_kpi
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+from src.Batch_rheum_Model import Batch_rheum_model, rep_seeds, run_rep_worker, warm_up_worker
+from src.snapshot import WARMUP_PARAMS
+
+
+def scenario_key(scenario, reps, seed, crn, window_tail, warmup=None):
+    """ Cache key of a scenario batch - hash of its Batch_rheum_model arguments, run settings and shared warm-up parameters (if any) """
+    content = json.dumps({'scenario': scenario, 'reps': reps, 'seed': seed, 'crn': crn, 'window_tail': window_tail, 'warmup': warmup},
+                         sort_keys=True, default=float)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def warmup_params(batch):
+    """ Warm-up parameters of a batch (see snapshot.WARMUP_PARAMS) - batches with equal ones can share warm-up snapshots """
+    return {param: getattr(batch.g, param) for param in WARMUP_PARAMS}
+
+
+class ScenarioJob:
+    """ A scenario batch running (or run) in the background - one future per replication, merged into its Batch_rheum_model as they complete """
+
+    def __init__(self, key, batch, reps, window_tail, futures):
+        """Initialise job.
+
+        Args:
+            key (_string_): Cache key (see scenario_key)
+            batch (_Batch_rheum_model_): Batch the replication results are merged into
+            reps (_integer_): Number of replications
+            window_tail (_integer_): Final window for headline KPIs [days]
+            futures (_list_): Future of each replication (run_rep_worker), not yet collected. More can be added later (see add_futures).
+        """
+        self.key = key
+        self.batch = batch
+        self.reps = reps
+        self.window_tail = window_tail
+        self.futures = futures
+        self.completed = 0 # replications merged into batch
+        self.figures = None # audit, queueing time (audit), KPI over time and patients seen figures, once all replications are in
+        self.error = None # exception raised by a replication, if any
+        self.submitted = time.perf_counter()
+        self.run_time = None # wall time [s] from submission to last replication
+        self.lock = threading.Lock() # futures may be added from a dispatcher thread (shared warm-up)
+
+    @property
+    def done(self):
+        """Whether all replications are in (or a replication failed)"""
+        return self.completed == self.reps or self.error is not None
+
+    def progress(self):
+        """Share of replications completed, as decimal"""
+        return self.completed / self.reps
+
+    def poll(self):
+        """Merge completed replications into the batch and update its headline KPIs (partial until all replications are in).
+
+        Returns:
+            _boolean_: Whether new replications were merged
+        """
+        with self.lock:
+            finished = [future for future in self.futures if future.done()]
+            if not finished:
+                return False
+            self.futures = [future for future in self.futures if future not in finished]
+        try:
+            self.batch.add_rep_results([future.result() for future in finished])
+        except Exception as error: # pylint: disable=broad-except
+            self.error = error # shown by the app - the worker traceback is kept in the exception
+            return False
+        self.completed += len(finished)
+        self.batch.headline_KPI(self.window_tail)
+        if self.completed == self.reps:
+            self.run_time = time.perf_counter() - self.submitted
+        return True
+
+    def add_futures(self, futures):
+        """Add replication futures submitted after the job (e.g. once their warm-up snapshot is ready)"""
+        with self.lock:
+            self.futures.extend(futures)
+
+    def summarise(self):
+        """Batch figures (see Batch_rheum_model.summarise_reps), built once all replications are in"""
+        if self.figures is None and self.completed == self.reps:
+            self.figures = self.batch.summarise_reps(self.window_tail)
+        return self.figures
+
+    def nbytes(self):
+        """Memory used by the batch frames [bytes]"""
+        return sum(frame.memory_usage(deep=True).sum() for frame in vars(self.batch).values() if isinstance(frame, pd.DataFrame))
+
+
+class ResultsService:
+    """ Background execution and LRU cache of scenario batches """
+
+    def __init__(self, n_workers=None, max_jobs=16, max_cache_mb=1000):
+        """Initialise service and its worker pool.
+
+        Args:
+            n_workers (int, optional): Number of worker processes. Defaults to None, i.e. number of CPUs.
+            max_jobs (int, optional): Maximum number of scenario batches kept. Defaults to 16.
+            max_cache_mb (int, optional): Memory budget of the frames of finished batches [MB], beyond which the least recently used are evicted. Defaults to 1000.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=n_workers or os.cpu_count())
+        self.max_jobs = max_jobs
+        self.max_cache_bytes = max_cache_mb * 1024**2
+        self.jobs = OrderedDict() # key -> ScenarioJob, least recently used first
+        self.lock = threading.Lock() # app sessions run in their own threads
+        self.savepath = tempfile.mkdtemp(prefix='rheum_service_') + "/" # replications keep logs in memory, folder only holds empty rep subfolders
+
+    def submit(self, scenario, reps=3, seed=9001, crn=False, window_tail=365):
+        """Run a scenario batch in the background, or return the cached (or running) batch of the same scenario.
+
+        Args:
+            scenario (_dict_): Batch_rheum_model keyword arguments (in_res, in_inter_arrival, in_prob_pifu...)
+            reps (int, optional): Number of replications. Defaults to 3.
+            seed (int, optional): Batch seed, from which each replication gets its own RNG stream (see rep_seeds). Defaults to 9001.
+            crn (bool, optional): Whether to use common random number streams (see run_reps). Defaults to False.
+            window_tail (int, optional): Final window for headline KPIs [days]. Defaults to 365.
+
+        Returns:
+            _ScenarioJob_: Job of the scenario batch
+        """
+        key = scenario_key(scenario, reps, seed, crn, window_tail)
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is not None and job.error is None:
+                self.jobs.move_to_end(key)
+                return job
+
+            batch = Batch_rheum_model(in_savepath=self.savepath, in_loglinesave=False, **scenario)
+            batch.crn_seed = seed if crn else None
+            model_kwargs = batch.model_kwargs()
+            seeds = rep_seeds(reps, seed)
+            futures = [self.executor.submit(run_rep_worker, run, model_kwargs, self.savepath, seeds[run])
+                       for run in range(reps)]
+            job = ScenarioJob(key, batch, reps, window_tail, futures)
+            self.jobs[key] = job
+            self.evict()
+            return job
+
+    def submit_comparison(self, scenarios, reps=3, seed=9001, crn=False, window_tail=365, share_warmup=None):
+        """Run several scenario batches as one job - their replications interleaved across the worker pool, and the
+        warm-up of each replication simulated once for all scenarios when they share the warm-up parameters (e.g.
+        scenarios differing only in PIFU or A&G), each scenario then starting from the end-of-warm-up snapshot.
+
+        With enough workers (scenarios x reps), the comparison takes about as long as a single scenario.
+
+        Args:
+            scenarios (_dict_): Scenario name -> Batch_rheum_model keyword arguments
+            reps (int, optional): Number of replications per scenario. Defaults to 3.
+            seed (int, optional): Batch seed shared by all scenarios. Defaults to 9001.
+            crn (bool, optional): Whether to use common random number streams (see run_reps). Defaults to False.
+            window_tail (int, optional): Final window for headline KPIs [days]. Defaults to 365.
+            share_warmup (bool, optional): Whether to share warm-up snapshots. Defaults to None, i.e. if the scenarios share the warm-up parameters (and have no resource unavailability).
+
+        Returns:
+            _dict_: Scenario name -> ScenarioJob (cached jobs are reused)
+        """
+        batches = {name: Batch_rheum_model(in_savepath=self.savepath, in_loglinesave=False, **scenario) for name, scenario in scenarios.items()}
+        warmups = [warmup_params(batch) for batch in batches.values()]
+        if share_warmup is None:
+            share_warmup = all(warmup == warmups[0] for warmup in warmups) and not warmups[0]['unavail_on']
+        if not share_warmup:
+            return {name: self.submit(scenario, reps, seed, crn, window_tail) for name, scenario in scenarios.items()}
+
+        warmup = warmups[0]
+        with self.lock:
+            jobs, new_jobs = {}, {}
+            for name, scenario in scenarios.items():
+                key = scenario_key(scenario, reps, seed, crn, window_tail, warmup)
+                job = self.jobs.get(key)
+                if job is None or job.error is not None:
+                    job = new_jobs.get(key) or ScenarioJob(key, batches[name], reps, window_tail, [])
+                    new_jobs[key] = job
+                    self.jobs[key] = job
+                    batches[name].crn_seed = seed if crn else None
+                self.jobs.move_to_end(key)
+                jobs[name] = job
+            if not new_jobs:
+                return jobs
+
+            # Warm-up of each replication, with the first scenario's parameters. Replications of all new scenario jobs
+            # are submitted as the snapshots come in (dispatcher thread), alternating between scenarios.
+            warm_batch = next(iter(new_jobs.values())).batch
+            seeds = rep_seeds(reps, seed)
+            model_kwargs = warm_batch.model_kwargs()
+            warmup_futures = {self.executor.submit(warm_up_worker, run, model_kwargs, seeds[run]): run for run in range(reps)}
+            threading.Thread(target=self.dispatch_after_warmup, args=(warmup_futures, list(new_jobs.values()), seeds), daemon=True).start()
+            self.evict()
+            return jobs
+
+    def dispatch_after_warmup(self, warmup_futures, jobs, seeds):
+        """Submit the replications of each job as their warm-up snapshot is ready (runs in a dispatcher thread)
+
+        Args:
+            warmup_futures (_dict_): Future of each replication's warm-up (warm_up_worker) -> replication id
+            jobs (_list_): Scenario jobs starting from the snapshots
+            seeds (_list_): Seed per replication id (see rep_seeds)
+        """
+        for future in as_completed(warmup_futures):
+            run = warmup_futures[future]
+            try:
+                snapshot = future.result()
+                for job in jobs:
+                    job.add_futures([self.executor.submit(run_rep_worker, run, job.batch.model_kwargs(), self.savepath, seeds[run], snapshot=snapshot)])
+            except Exception as error: # pylint: disable=broad-except
+                for job in jobs: # failed warm-up, or service shut down
+                    job.error = error
+                return
+
+    def poll(self, job):
+        """Merge a job's completed replications (see ScenarioJob.poll) and mark it recently used
+
+        Returns:
+            _boolean_: Whether new replications were merged
+        """
+        with self.lock:
+            updated = job.poll()
+            if job.key in self.jobs:
+                self.jobs.move_to_end(job.key)
+            if updated and job.done:
+                self.evict()
+            return updated
+
+    def evict(self):
+        """Drop least recently used finished batches while over max_jobs or the memory budget (running batches are kept)"""
+        finished = [key for key, job in self.jobs.items() if job.done]
+        total = sum(self.jobs[key].nbytes() for key in finished)
+        for key in finished[:-1]: # keep the most recent finished batch
+            if len(self.jobs) <= self.max_jobs and total <= self.max_cache_bytes:
+                break
+            total -= self.jobs.pop(key).nbytes()
+
+    def shutdown(self):
+        """Stop the worker pool (cancelling replications not started)"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
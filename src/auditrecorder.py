@@ -0,0 +1,101 @@
+""" includes the change-point audit recorder: the audited system state (patients in system, patients waiting by
+priority, slots occupied) recorded only when it changes, instead of polled at every audit interval.
+
+The state is a step function of simulation time, so it can be resampled after the run to any audit grid (state in
+effect at each audit time) and integrated exactly (time-averaged state over any interval), at a cost per state change rather
+than per audit timepoint.
+"""
+from array import array
+import numpy as np
+
+# Audited state, in audit log column order (see logsinks.AUDIT_SCHEMA)
+AUDIT_STATE = ('patients in system', 'all patients waiting', 'priority 1 patients waiting', 'priority 2 patients waiting',
+               'priority 3 patients waiting', 'resources occupied')
+
+
+class ChangePointAudit:
+    """ Audited state of a replication, recorded at each change from a start time (e.g. end of warm-up) """
+
+    def __init__(self, env, state, start=0, time_weighted=None):
+        """Initialise recorder.
+
+        Args:
+            env (_simpy Environment_): Environment of the replication
+            state (_function_): Current audited state, as a tuple in AUDIT_STATE order
+            start (int, optional): Time from which changes are recorded [days]. Defaults to 0.
+            time_weighted (_TimeWeightedKPIs_, optional): Running time-weighted KPIs fed with each state and how long it was held (see streamstats). Defaults to None.
+        """
+        self.env = env
+        self.state = state
+        self.start = start
+        self.time_weighted = time_weighted
+        self.current = None # state after the latest change
+        self.width = len(AUDIT_STATE)
+        self.times = array('d') # time of each recorded change [days]
+        self.values = array('q') # state after each recorded change (flat, AUDIT_STATE values per change)
+
+        # State at the start time, recorded by a callback of the first event then (no process, so other events keep their order)
+        if start > env.now:
+            env.timeout(start - env.now).callbacks.append(lambda _event: self.update())
+
+    def update(self):
+        """Record the state if it changed (called wherever it may change, from the start time). Several changes at one time keep the last state."""
+        now = self.env.now
+        if now < self.start:
+            return
+        values = self.state()
+        if values == self.current:
+            return
+        if self.time_weighted is not None and self.times:
+            self.time_weighted.update(self.current, self.times[-1], now) # previous state, held until now
+        if self.times and self.times[-1] == now:
+            self.values[-self.width:] = array('q', values)
+        else:
+            self.times.append(now)
+            self.values.extend(values)
+        self.current = values
+
+    def finish(self, end):
+        """Feed the state held from the latest change to the end of the run to the time-weighted KPIs"""
+        if self.time_weighted is not None and self.times:
+            self.time_weighted.update(self.current, self.times[-1], end)
+
+    def arrays(self):
+        """Change times and states (one row per change, AUDIT_STATE columns), from the start time"""
+        if not self.times: # no change since start
+            return np.array([self.start], dtype=float), np.array([self.current or (0,) * self.width], dtype=float)
+        return np.frombuffer(self.times, dtype=float).copy(), np.frombuffer(self.values, dtype=np.int64).reshape(-1, self.width).astype(float)
+
+    def resample(self, grid):
+        """State at each time of a grid: the state in effect just before any changes at that time (as an audit process
+        polling at that time before other events would see it), or the state at the start time for grid times not after it.
+
+        Args:
+            grid (_array_): Audit times [days], from the start time
+
+        Returns:
+            _numpy array_: One row per grid time, AUDIT_STATE columns
+        """
+        times, values = self.arrays()
+        index = np.searchsorted(times, grid, side='left') - 1
+        return values[np.clip(index, 0, None)]
+
+    def integrate(self, grid):
+        """Integral of the state from the start time to each time of a grid [state x days]"""
+        times, values = self.arrays()
+        cumulative = np.vstack([np.zeros(values.shape[1]), np.cumsum(values[:-1] * np.diff(times)[:, None], axis=0)])
+        index = np.clip(np.searchsorted(times, grid, side='right') - 1, 0, None)
+        return cumulative[index] + values[index] * (np.asarray(grid, dtype=float) - times[index])[:, None]
+
+    def time_average(self, edges):
+        """Time-averaged state over each interval between consecutive edges (exact, from the change points)
+
+        Args:
+            edges (_array_): Interval edges [days], increasing, from the start time
+
+        Returns:
+            _numpy array_: One row per interval, AUDIT_STATE columns
+        """
+        edges = np.asarray(edges, dtype=float)
+        integrals = self.integrate(edges)
+        return np.diff(integrals, axis=0) / np.diff(edges)[:, None]
@@ -0,0 +1,342 @@
+""" Benchmark suite: throughput and scaling of rheum_Model (single replication) and Batch_rheum_model over a grid of
+arrival rates, follow-up horizons and slot counts. Results are written to a JSON baseline that can be compared across commits.
+
+Run from the repository root, e.g.:
+    python -m src.benchmark --grid quick --out bench.json
+    python -m src.benchmark --grid quick --out bench_new.json --compare bench.json
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# Grid points (arrivals per day, follow-up horizon [years], slots difference to the steady-state heuristic)
+GRIDS = {'quick': {'arrivals_per_day': (1, 6), 'horizon_y': (3,), 'cap_diff': (0,)},
+         'full': {'arrivals_per_day': (1, 6, 15, 30, 60), 'horizon_y': (1, 3, 5), 'cap_diff': (-1, 0, 1)}}
+
+# Metrics compared across baselines, and whether higher is better
+COMPARED_METRICS = {'events_per_s': True, 'wall_per_sim_year_s': False, 'peak_rss_mb': False, 'total_s': False, 'startup_s': False}
+
+# Plotting and statistics modules, which the simulation core should not import (see startup_point)
+HEAVY_MODULES = ('matplotlib', 'seaborn', 'scipy')
+
+
+class FirstEvent(Exception):
+    """ Raised by the wrapped step method of a simpy environment to stop the run at its first event (see startup_point)"""
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process [MB] (resource module, or psutil on Windows) """
+    try:
+        import resource # pylint: disable=import-outside-toplevel
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024**2 if sys.platform == 'darwin' else maxrss / 1024 # bytes on macOS, kB on Linux
+    except ImportError:
+        import psutil # pylint: disable=import-outside-toplevel
+        return psutil.Process().memory_info().peak_wset / 1024**2
+
+
+def count_events(env):
+    """ Count the events processed by a simpy environment, by wrapping its step method.
+
+    Args:
+        env (_simpy Environment_): Environment (before it is run)
+
+    Returns:
+        _list_: One-element list holding the event count, updated as the environment runs
+    """
+    counter = [0]
+    step = env.step
+
+    def counted_step():
+        counter[0] += 1
+        step()
+
+    env.step = counted_step
+    return counter
+
+
+def startup_point(submitted, arrivals_per_day, horizon_y, cap_diff=0, capacity_engine='resource', seed=1):
+    """ Benchmark worker start-up: time from submission to a fresh (spawned) process until the first event of a replication.
+
+    Run in a spawned worker process (see run_startup), as replication workers are on Windows and macOS. The model
+    keeps its logs in memory and builds no figures, as replications in worker processes.
+
+    Args:
+        submitted (_double_): Time of submission to the worker [s since epoch]
+        arrivals_per_day (_double_): RTT arrivals per day
+        horizon_y (_integer_): Patient follow-up horizon [years]
+        cap_diff (int, optional): Increment or decrement in daily slots applied to the steady-state heuristic. Defaults to 0.
+        capacity_engine (str, optional): Slot capacity engine - 'resource' or 'heap' (see slotheap). Defaults to 'resource'.
+        seed (int, optional): Seed of the global random module. Defaults to 1.
+
+    Returns:
+        _dict_: Parameters, startup_s (submission to first event), spawn_s (submission to worker function), import_s
+        (model modules), setup_s (model initialisation to first event) and heavy modules imported by then
+    """
+    started = time.time()
+    from src.helpers import steady_state_slots # pylint: disable=import-outside-toplevel
+    from src.initialisers import g # pylint: disable=import-outside-toplevel
+    from src.rheum_Model import rheum_Model # pylint: disable=import-outside-toplevel
+    imported = time.time()
+
+    g.debug = False
+    random.seed(seed)
+    slots = np.round(steady_state_slots(1/arrivals_per_day, horizon_y), 0) + cap_diff
+    model = rheum_Model(0, in_res=slots, in_inter_arrival=1/arrivals_per_day, in_path_horizon_y=horizon_y, savepath='',
+                        loglinesave=False, capacity_engine=capacity_engine, figures=False)
+
+    def first_step():
+        raise FirstEvent()
+
+    model.env.step = first_step
+    try:
+        model.run(chart=False)
+    except FirstEvent:
+        pass
+    first_event = time.time()
+
+    return {'bench': 'startup', 'arrivals_per_day': arrivals_per_day, 'horizon_y': horizon_y, 'cap_diff': cap_diff, 'slots': slots,
+            'log_format': 'memory', 'capacity_engine': capacity_engine, 'figures': False,
+            'startup_s': first_event - submitted, 'spawn_s': started - submitted, 'import_s': imported - started,
+            'setup_s': first_event - imported,
+            'heavy_modules': sorted({name.split('.')[0] for name in sys.modules} & set(HEAVY_MODULES))}
+
+
+def model_point(arrivals_per_day, horizon_y, cap_diff=0, log_format='csv', loglinesave=True, capacity_engine='resource', seed=1, figures=True):
+    """ Benchmark one replication of rheum_Model (full run, including chart and summary).
+
+    Args:
+        arrivals_per_day (_double_): RTT arrivals per day
+        horizon_y (_integer_): Patient follow-up horizon [years]
+        cap_diff (int, optional): Increment or decrement in daily slots applied to the steady-state heuristic. Defaults to 0.
+        log_format (str, optional): Backend for saved logs (see logsinks). Defaults to 'csv'.
+        loglinesave (bool, optional): Whether to save logs to file (True) or keep them in memory. Defaults to True.
+        capacity_engine (str, optional): Slot capacity engine - 'resource' or 'heap' (see slotheap). Defaults to 'resource'.
+        seed (int, optional): Seed of the global random module. Defaults to 1.
+        figures (bool, optional): Whether to build the replication chart. Defaults to True.
+
+    Returns:
+        _dict_: Parameters, events, events_per_s, wall_per_sim_year_s, peak_rss_mb and time per phase (see rheum_Model.timings)
+    """
+    import matplotlib # pylint: disable=import-outside-toplevel
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    from src.helpers import Trial_Results_initiate, steady_state_slots # pylint: disable=import-outside-toplevel
+    from src.initialisers import g # pylint: disable=import-outside-toplevel
+    from src.rheum_Model import rheum_Model # pylint: disable=import-outside-toplevel
+
+    g.debug = False
+    random.seed(seed)
+    slots = np.round(steady_state_slots(1/arrivals_per_day, horizon_y), 0) + cap_diff
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        savepath = tmpdir + "/"
+        if loglinesave:
+            Trial_Results_initiate(savepath + "patient_result2.csv", savepath + "appt_result.csv", savepath + "batch_mon_audit_ls.csv", log_format)
+
+        start = time.perf_counter()
+        model = rheum_Model(0, in_res=slots, in_inter_arrival=1/arrivals_per_day, in_path_horizon_y=horizon_y,
+                            savepath=savepath, log_format=log_format, loglinesave=loglinesave, capacity_engine=capacity_engine, figures=figures)
+        events = count_events(model.env)
+        chart_output = model.run()[0]
+        total = time.perf_counter() - start
+        if chart_output is not None:
+            plt.close(chart_output)
+
+    sim_years = (model.g.warm_duration + model.g.obs_duration) / 365
+    return {'bench': 'model', 'arrivals_per_day': arrivals_per_day, 'horizon_y': horizon_y, 'cap_diff': cap_diff, 'slots': slots,
+            'log_format': log_format if loglinesave else 'memory', 'capacity_engine': capacity_engine, 'figures': figures, 'events': events[0],
+            'events_per_s': events[0] / model.timings['simulation'],
+            'wall_per_sim_year_s': model.timings['simulation'] / sim_years,
+            'peak_rss_mb': peak_rss_mb(), 'total_s': total,
+            **{f"{phase}_s": t for phase, t in model.timings.items()}}
+
+
+def batch_point(arrivals_per_day, horizon_y, cap_diff=0, reps=3, n_workers=1, log_format='csv', loglinesave=True, capacity_engine='resource', seed=1, figures=True):
+    """ Benchmark a batch of replications of Batch_rheum_model (run_reps, including batch plots and headline KPIs).
+
+    Args:
+        arrivals_per_day (_double_): RTT arrivals per day
+        horizon_y (_integer_): Patient follow-up horizon [years]
+        cap_diff (int, optional): Increment or decrement in daily slots applied to the steady-state heuristic. Defaults to 0.
+        reps (int, optional): Number of replications. Defaults to 3.
+        n_workers (int, optional): Number of worker processes (see run_reps). Defaults to 1.
+        log_format (str, optional): Backend for saved logs (see logsinks). Defaults to 'csv'.
+        loglinesave (bool, optional): Whether replications save logs to file (True) or keep them in memory. Defaults to True.
+        capacity_engine (str, optional): Slot capacity engine - 'resource' or 'heap' (see slotheap). Defaults to 'resource'.
+        seed (int, optional): Batch seed. Defaults to 1.
+        figures (bool, optional): Whether to build the batch figures and last replication chart. Defaults to True.
+
+    Returns:
+        _dict_: Parameters, wall_per_sim_year_s (per replication), peak_rss_mb and time per phase (see Batch_rheum_model.timings)
+    """
+    import matplotlib # pylint: disable=import-outside-toplevel
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+    from src.Batch_rheum_Model import Batch_rheum_model # pylint: disable=import-outside-toplevel
+    from src.helpers import Trial_Results_initiate, steady_state_slots # pylint: disable=import-outside-toplevel
+    from src.initialisers import g # pylint: disable=import-outside-toplevel
+
+    g.debug = False
+    slots = np.round(steady_state_slots(1/arrivals_per_day, horizon_y), 0) + cap_diff
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        savepath = tmpdir + "/"
+        if loglinesave:
+            Trial_Results_initiate(savepath + "patient_result2.csv", savepath + "appt_result.csv", savepath + "batch_mon_audit_ls.csv", log_format)
+
+        start = time.perf_counter()
+        batch = Batch_rheum_model(in_res=slots, in_inter_arrival=1/arrivals_per_day, in_path_horizon_y=horizon_y, audit_interval=28,
+                                  in_savepath=savepath, in_log_format=log_format, in_loglinesave=loglinesave, in_capacity_engine=capacity_engine, in_figures=figures)
+        batch.run_reps(reps, n_workers=n_workers, seed=seed)
+        total = time.perf_counter() - start
+        plt.close('all')
+
+    sim_years = (batch.g.warm_duration + batch.g.obs_duration) / 365
+    return {'bench': 'batch', 'arrivals_per_day': arrivals_per_day, 'horizon_y': horizon_y, 'cap_diff': cap_diff, 'slots': slots,
+            'log_format': log_format if loglinesave else 'memory', 'capacity_engine': capacity_engine, 'figures': figures, 'reps': reps, 'n_workers': n_workers,
+            'wall_per_sim_year_s': batch.timings['replications'] / (reps * sim_years),
+            'peak_rss_mb': peak_rss_mb(), 'total_s': total,
+            **{f"{phase}_s": t for phase, t in batch.timings.items()}}
+
+
+def run_isolated(func, **kwargs):
+    """ Run a benchmark point in a fresh worker process, so that its peak RSS (and imports) are its own"""
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        return executor.submit(func, **kwargs).result()
+
+
+def run_startup(start_method='spawn', **kwargs):
+    """ Run the start-up benchmark (startup_point) in a fresh worker process started with the given multiprocessing start method"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(start_method)) as executor:
+        return executor.submit(startup_point, time.time(), **kwargs).result()
+
+
+def run_grid(grid='quick', reps=3, n_workers=1, log_format='csv', loglinesave=True, batch=True, capacity_engine='resource', figures=True):
+    """ Benchmark worker start-up, then rheum_Model (and optionally Batch_rheum_model) at every point of a grid, each point in a fresh process.
+
+    Args:
+        grid (str or dict, optional): Name of a grid in GRIDS, or dict of arrivals_per_day, horizon_y and cap_diff tuples. Defaults to 'quick'.
+        reps (int, optional): Number of replications of batch benchmarks. Defaults to 3.
+        n_workers (int, optional): Number of worker processes of batch benchmarks. Defaults to 1.
+        log_format (str, optional): Backend for saved logs. Defaults to 'csv'.
+        loglinesave (bool, optional): Whether to save logs to file (True) or keep them in memory. Defaults to True.
+        batch (bool, optional): Whether to also benchmark Batch_rheum_model at each point. Defaults to True.
+        capacity_engine (str, optional): Slot capacity engine - 'resource' or 'heap' (see slotheap). Defaults to 'resource'.
+        figures (bool, optional): Whether to build figures. Defaults to True.
+
+    Returns:
+        _list_: One result dict per benchmark (see startup_point, model_point and batch_point)
+    """
+    grid = GRIDS[grid] if isinstance(grid, str) else grid
+    results = []
+    for arrivals_per_day, horizon_y, cap_diff in itertools.product(grid['arrivals_per_day'], grid['horizon_y'], grid['cap_diff']):
+        point = {'arrivals_per_day': arrivals_per_day, 'horizon_y': horizon_y, 'cap_diff': cap_diff,
+                 'log_format': log_format, 'loglinesave': loglinesave, 'capacity_engine': capacity_engine, 'figures': figures}
+        if not results: # worker start-up, at the first grid point
+            results.append(run_startup(arrivals_per_day=arrivals_per_day, horizon_y=horizon_y, cap_diff=cap_diff, capacity_engine=capacity_engine))
+            print(f"startup: {results[-1]['startup_s']:.2f} s to first event ({results[-1]['import_s']:.2f} s imports), "
+                  f"heavy modules: {', '.join(results[-1]['heavy_modules']) or 'none'}")
+        results.append(run_isolated(model_point, **point))
+        print(f"model {arrivals_per_day}/day, {horizon_y}y, cap_diff {cap_diff}: {results[-1]['events_per_s']:.0f} events/s, "
+              f"{results[-1]['wall_per_sim_year_s']:.2f} s/sim year, {results[-1]['peak_rss_mb']:.0f} MB")
+        if batch:
+            results.append(run_isolated(batch_point, reps=reps, n_workers=n_workers, **point))
+            print(f"batch {arrivals_per_day}/day, {horizon_y}y, cap_diff {cap_diff}: {results[-1]['total_s']:.1f} s")
+    return results
+
+
+def git_commit():
+    """ Current git commit of the repository (None if not available) """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_baseline(results, path):
+    """ Write benchmark results, with commit and platform, to a JSON baseline file"""
+    baseline = {'commit': git_commit(), 'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(), 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+                'results': results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2, default=float)
+
+
+def load_baseline(path):
+    """ Read a JSON baseline file written by save_baseline"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def compare_baselines(current, baseline):
+    """ Compare two benchmark baselines point by point.
+
+    Args:
+        current (_dict_): Baseline of the current code (as load_baseline)
+        baseline (_dict_): Reference baseline, e.g. of an earlier commit
+
+    Returns:
+        _dataframe_: One row per benchmark point and metric, with both values and speedup (>1: current is better)
+    """
+    keys = ['bench', 'arrivals_per_day', 'horizon_y', 'cap_diff', 'log_format', 'capacity_engine', 'figures']
+    current_results, baseline_results = [pd.DataFrame(b['results']) for b in (current, baseline)]
+    for results in (current_results, baseline_results):
+        if 'capacity_engine' not in results:
+            results['capacity_engine'] = 'resource' # baselines from before the slot heap engine
+        if 'figures' not in results:
+            results['figures'] = True # baselines from before figures could be skipped
+    merged = current_results.merge(baseline_results, on=keys, suffixes=('', '_baseline'))
+    rows = []
+    for metric, higher_better in COMPARED_METRICS.items():
+        if metric not in merged or metric + '_baseline' not in merged:
+            continue
+        compared = merged[keys + [metric, metric + '_baseline']].dropna().rename(columns={metric: 'value', metric + '_baseline': 'value_baseline'})
+        compared.insert(len(keys), 'metric', metric)
+        ratio = compared['value'] / compared['value_baseline']
+        compared['speedup'] = ratio if higher_better else 1 / ratio
+        rows.append(compared)
+    return pd.concat(rows, ignore_index=True)
+
+
+def main(argv=None):
+    """ Command line entry point - run a grid, write its baseline and optionally compare with an earlier one"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n', maxsplit=1)[0])
+    parser.add_argument('--grid', default='quick', choices=sorted(GRIDS))
+    parser.add_argument('--reps', type=int, default=3, help='replications per batch benchmark')
+    parser.add_argument('--n-workers', type=int, default=1, help='worker processes per batch benchmark')
+    parser.add_argument('--log-format', default='csv', choices=['csv', 'parquet', 'npy'])
+    parser.add_argument('--capacity-engine', default='resource', choices=['resource', 'heap'])
+    parser.add_argument('--in-memory', action='store_true', help='keep logs in memory (loglinesave=False)')
+    parser.add_argument('--no-batch', action='store_true', help='benchmark single replications only')
+    parser.add_argument('--no-figures', action='store_true', help='skip figures (headless runs)')
+    parser.add_argument('--out', default='benchmark.json', help='JSON baseline to write')
+    parser.add_argument('--compare', default=None, help='JSON baseline to compare with')
+    args = parser.parse_args(argv)
+
+    results = run_grid(args.grid, args.reps, args.n_workers, args.log_format, not args.in_memory, not args.no_batch, args.capacity_engine,
+                       not args.no_figures)
+    save_baseline(results, args.out)
+    print(f"Baseline written to {args.out}")
+
+    if args.compare:
+        comparison = compare_baselines(load_baseline(args.out), load_baseline(args.compare))
+        with pd.option_context('display.max_rows', None, 'display.width', 200):
+            print(comparison)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 """ includes helper functions or classes"""
-import csv
-import scipy.stats as st
+import os
 import numpy as np
 
+from src.initialisers import g
+from src.logsinks import LOGS, make_sink
+
 def mean_confidence_interval(data, confidence=0.95):
     """ Code to compute (small sample) confidence interval, taken from web.
 
@@ -13,6 +15,7 @@ def mean_confidence_interval(data, confidence=0.95):
     Returns:
         _type_: The mean, the lower bound and the upper bound of the confidence interval.
     """
+    import scipy.stats as st # pylint: disable=import-outside-toplevel
     a = 1.0 * np.array(data)
     n = len(a)
     m, se = np.mean(a), st.sem(a)
@@ -26,27 +29,29 @@ class patient_blocker:
         self.blockerid = blockerid
 
 
-def Trial_Results_initiate(file1,file2,file3):
+def Trial_Results_initiate(file1,file2,file3,log_format='csv'):
     """Method to create files that will hold logs - RTT patient (1), appointment (2), audit (3)
 
     Args:
         file1 (_string_): path to file that will hold RTT patient log
         file2 (_string_): path to file that will hold appointment log
         file3 (_string_): path to file that will hold audit KPI log
+        log_format (str, optional): Log backend - 'csv', 'parquet' or 'npy' (see logsinks). For the latter two, the log is a folder of part files named after the file stem. Defaults to 'csv'.
+    """
+    # Create the (empty) logs to store trial results - csv files with column headers, or empty part folders
+    for file, log in zip([file1, file2, file3], ['patient', 'appt', 'audit']):
+        make_sink(log_format, os.path.splitext(file)[0], LOGS[log][1]).initiate()
+
+
+def steady_state_slots(inter_arrival, path_horizon_y):
+    """ Heuristic number of daily slots needed to deal with steady-state model demand (without interventions), as in the run script and streamlit app.
+
+    Args:
+        inter_arrival (_double_): The inter-arrival time [days]
+        path_horizon_y (_integer_): Patient follow-up horizon [years]
+
+    Returns:
+        _double_: daily slots [slots]
     """
-    # Create a file to store trial results, and write the column headers
-    with open(file1, "w",encoding="cp1252") as f:
-        writer = csv.writer(f, delimiter=",")
-        column_headers = ["P_ID", "Q_time_fopa" , "Q_time_fuopa" , "rep"
-                        ]
-        writer.writerow(column_headers)
-    with open(file2, "w",encoding="cp1252") as f:
-        writer = csv.writer(f, delimiter=",")
-        column_headers = ["P_ID", "Appt_ID","priority","type","pathway","q_time","start_q","DNA" , "rep"
-                        ]
-        writer.writerow(column_headers)
-
-    with open(file3,"w",encoding="cp1252") as f:
-        writer = csv.writer(f, delimiter=",")
-        column_headers = ['time','patients in system','all patients waiting','priority 1 patients waiting','priority 2 patients waiting','priority 3 patients waiting','resources occupied','rep']
-        writer.writerow(column_headers)
+    g_defaults = g()
+    return 1/inter_arrival * ((2 + path_horizon_y / g.mean_interOPA *365) * (1-g_defaults.prob_firstonly) + 2 * g_defaults.prob_firstonly)
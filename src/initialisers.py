@@ -14,11 +14,11 @@ class g:
     t_decision = 1 * 365 # days, time mark for pathway PIFU decision / stratification (from first OPA appointment)
     obs_duration=365*3 # observation period or window (days) for simulation, in addition to warm-up period
 
-    debug=True # whether to print to console
+    debug=False # whether to print to console (run progress, and trace records as they come - see tracing)
     debuglevel = 1 # level of debug prints - 1 as lowest ; 4 for most detailed
 
 
-    def __init__(self,in_res=5,in_inter_arrival=1,in_prob_pifu=0,in_path_horizon_y=3,audit_interval=7,in_reps=1,repid=1,savepath='temp',in_FOavoidable=0,in_interfu_perc=0.6):
+    def __init__(self,in_res=5,in_inter_arrival=1,in_prob_pifu=0,in_path_horizon_y=3,audit_interval=7,in_reps=1,repid=1,savepath='temp',in_FOavoidable=0,in_interfu_perc=0.6,in_log_format='csv',in_loglinesave=True):
         """ Initialise global parameter values."""
 
         self.prob_firstonly = 0.35 # % of rheumatology RTT patients have no follow-ups | Baseline: ~35% with no follow-ups
@@ -35,9 +35,10 @@ class g:
         self.DNA_pifu_pro=0.07 # Did not attend probability (PIFU pathways) [%]
         self.DNA_tra_pro=0.077 # Did not attend probability (traditional pathways) [%]
         self.interfu_perc = in_interfu_perc # Percentage increase in inter-appointment interval with PIFU (vs traditional), i.e. 0.6 means 60% longer interval
-        self.mean_interPIFU = np.round(np.sum(self.interOPA_tri)/3 * (1+self.interfu_perc),0) # resultant mean days inbetween appointments for PIFU pathways (from traditional triangular mean) [days]. Used in exponential distribution
+        self.mean_interPIFU = self.pifu_interval() # resultant mean days inbetween appointments for PIFU pathways (from traditional triangular mean) [days]. Used in exponential distribution
         self.PIFUbigbang = False # [boolean] Whether, when PIFU starts being used, it is offered to all eligible patients when they visit (e.g. those already followed up for years) - big-bang - or only new eligible patients
 
+        self.capacity_engine = 'resource' # [string] Slot capacity engine - 'resource' (simpy PriorityResource, unavailability by blocker processes) or 'heap' (slot request heap, unavailability by block requests without processes, see slotheap)
         self.unavail_on = False # [boolean] Whther to use resource unavailability functionality
         self.unavail_byshock = False # [boolean] for now model only for unavailability by single shock period OR by periodic (e.g. weekends). Can be improved in future.
 
@@ -53,21 +54,59 @@ class g:
 
         self.savepath = savepath # [string] Save path for outputs
         self.repid = repid # [integer] Id of current replication (within batch)
-        self.loglinesave = True # if true saves each line to file, if false creates dataframe that stays in memory (former found to be more efficient)
-        self.audit_time = []
+        self.loglinesave = in_loglinesave # if true saves logs to file, if false keeps them in memory (logsinks.MemorySink column store, no file I/O)
+        self.log_format = in_log_format # [string] Backend for saved logs (if loglinesave) - 'csv', 'parquet' or 'npy' (see logsinks)
+        self.log_chunk = 10000 # [rows] Number of log rows buffered in memory between writes to file (if loglinesave). Initial capacity of in-memory logs otherwise
+        self.rng_block = 4096 # [variates] Size of blocks in which random variates are pre-sampled per stochastic source (see randomstreams). 0 for scalar draws from the global random module (unless common random numbers are used)
+        self.figures = True # [boolean] Whether runs build figures (matplotlib/seaborn). False for headless runs - batch figures can still be built on demand (see Batch_rheum_model.batch_figures)
+        self.instrument = False # [boolean] Whether runs are instrumented - events and wall time per process, processes alive, heap size, log and console output, time per phase (see instrument). Off by default (no cost)
+        self.instrument_interval = 28 # [days] Interval between instrumentation samples
+        self.trace_level = 0 # Highest level of trace records kept - 0 off, 1 audit, 2 patient pathway events, 3 slot unavailability (see tracing)
+        self.trace_categories = None # [list] Categories of trace records kept (see tracing.TRACE_CATEGORIES). None for all
+        self.trace_sink = None # [string] Trace sink - 'ring' (last trace_capacity records in memory), 'file' (trace_rep<id>.bin in the save path) or 'console'. None for 'file' if loglinesave, else 'ring'
+        self.trace_capacity = 100000 # [records] Size of the trace ring buffer, or records buffered between writes to file
+        self.stream_stats = False # [boolean] Whether to keep streaming (online) queueing time KPIs during the run (see streamstats)
+        self.raw_logs = True # [boolean] Whether to keep the appointment log (can be switched off when streaming KPIs are used)
+        self.stream_step = 365/4 # [days] Time interval of streaming temporal KPIs (as plot_monappKPI_reps step)
+        self.stream_window_tail = 365 # [days] Final window of streaming headline RTT KPIs and time-weighted waiting list and utilisation KPIs (as headline_KPI window_tail)
+        self.stream_accuracy = 0.01 # Relative accuracy of streaming quantiles, as decimal
+        self.audit_time = [] # vector of audit timepoints. populated in write_audit
         self.audit_interval = audit_interval # time step for audit metrics [simulation days]
-        self.audit_patients_waiting = [] # vector of patients waiting at audit timepoints. populated in perform_audit
-        self.audit_patients_waiting_p1 = [] # vector of priority 1 patients waiting at audit timepoints. populated in perform_audit
-        self.audit_patients_waiting_p2 = [] # vector of priority 2 patients waiting at audit timepoints. populated in perform_audit
-        self.audit_patients_waiting_p3 = [] # vector of priority 3 patients waiting at audit timepoints. populated in perform_audit
-        self.audit_patients_in_system = [] # vector of patients in system. populated in perform_audit (lifetime to discharge...)
-        self.audit_resources_used = [] # vector of resources in use at audit timepoints. populated in perform_audit
+        self.audit_patients_waiting = [] # [deprecated, audit rows now go to the model audit log] vector of patients waiting at audit timepoints
+        self.audit_patients_waiting_p1 = [] # [deprecated] vector of priority 1 patients waiting at audit timepoints
+        self.audit_patients_waiting_p2 = [] # [deprecated] vector of priority 2 patients waiting at audit timepoints
+        self.audit_patients_waiting_p3 = [] # [deprecated] vector of priority 3 patients waiting at audit timepoints
+        self.audit_patients_in_system = [] # [deprecated] vector of patients in system (lifetime to discharge...)
+        self.audit_resources_used = [] # [deprecated] vector of resources in use at audit timepoints
         self.patients_waiting = 0 # auxiliary counter for patients waiting
         self.patients_waiting_by_priority = [0,0,0] # auxiliary counters for patients waiting by priority
-        self.results = pd.DataFrame() # populated in build_audit_results. audit results in one DF
+        self.results = pd.DataFrame() # populated at end of run (read from file or build_audit_results). audit results in one DF
         self.appt_queuing_results = (pd.DataFrame(
-            columns=['P_ID','App_ID','priority','type',"pathway",'q_time','start_q','DNA'])) # populated in pathway (FOPA_Patiet)
-        self.appt_queuing_results.set_index("App_ID", inplace=True) # reset index
+            columns=['P_ID','Appt_ID','priority','type',"pathway",'q_time','start_q','DNA','rep'])) # populated at end of run from the appointment log
+
+    def pifu_interval(self):
+        """ Mean days between PIFU appointments, from the traditional triangular mean and interfu_perc [days]"""
+        return np.round(np.sum(self.interOPA_tri)/3 * (1+self.interfu_perc),0)
+
+    def set_params(self, params):
+        """ Set parameter values after initialisation, and recompute the values derived from them - follow-up horizon in
+        days (max_fuopa_tenor), PIFU interval (mean_interPIFU) and unavailable slots (unavail_shock_nrslots,
+        unavail_nrslots) - unless those are set too.
+
+        Args:
+            params (_dict_): Attribute name -> value
+        """
+        for name, value in params.items():
+            if not hasattr(self, name):
+                raise ValueError(f"Unknown parameter '{name}'")
+            setattr(self, name, value)
+        derived = {'max_fuopa_tenor': lambda: self.max_fuopa_tenor_y * 365,
+                   'mean_interPIFU': self.pifu_interval,
+                   'unavail_shock_nrslots': lambda: int(np.floor(self.number_of_slots*1)),
+                   'unavail_nrslots': lambda: int(np.floor(self.number_of_slots*1))}
+        for name, value in derived.items():
+            if name not in params:
+                setattr(self, name, value())
 
     def change_reps(self,reps):
         """ Change number of replications for batch run """
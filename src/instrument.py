@@ -0,0 +1,191 @@
+""" includes the instrumentation of a model replication (g.instrument): counters and timers on the simpy hot path -
+events and wall time per process (arrivals generator, patient pathways, blocker processes, audit), processes alive,
+event heap size, log rows and bytes written, console output (debug prints) and time per run phase - exportable per
+replication as JSON (summary) and csv (samples over simulation time).
+
+Instrumentation wraps the step and process methods of the replication's environment, so it costs nothing when off.
+It schedules no events, so the replication's results are unchanged.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+
+def process_name(event):
+    """ Name of the process an event resumes - its innermost generator function (e.g. traditional_follow_ups within
+    attend_OPA), or the event type if it resumes no process (e.g. the end of the run)"""
+    for callback in event.callbacks or ():
+        process = getattr(callback, '__self__', None)
+        generator = getattr(process, '_generator', None)
+        if generator is not None:
+            while getattr(generator, 'gi_yieldfrom', None) is not None and hasattr(generator.gi_yieldfrom, 'gi_code'):
+                generator = generator.gi_yieldfrom
+            return generator.gi_code.co_name
+    return type(event).__name__
+
+
+class ConsoleCounter:
+    """ Stand-in for sys.stdout counting the writes (debug prints), characters and wall time spent on them"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.writes = 0
+        self.chars = 0
+        self.time = 0.0 # wall time spent writing to console [s]
+
+    def write(self, text):
+        start = time.perf_counter()
+        self.stream.write(text)
+        self.time += time.perf_counter() - start
+        self.writes += 1
+        self.chars += len(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class Instrumentation:
+    """ Counters, timers and samples of one replication.
+
+    Built-in counters: events processed (in total and per process, with wall time), processes started and alive, and
+    peak event heap size. Further counters can be plugged in:
+        instruments.count('name') # increment a counter
+        with instruments.timer('name'): ... # accumulate wall time
+        instruments.add_probe('name', func) # value of func() in every sample
+    """
+
+    def __init__(self, env, sample_interval=28):
+        """Initialise instrumentation and attach it to an environment (before it is run).
+
+        Args:
+            env (_simpy Environment_): Environment of the replication
+            sample_interval (int, optional): Interval between samples of the counters and probes [simulation days]. Defaults to 28.
+        """
+        self.env = env
+        self.sample_interval = sample_interval
+        self.next_sample = env.now
+        self.counters = {'events': 0, 'processes_started': 0, 'processes_finished': 0, 'processes_alive_max': 0, 'heap_max': 0}
+        self.timers = {} # wall time [s] per timer
+        self.probes = {} # name -> function, sampled
+        self.process_events = {} # process name -> [events, wall time [s]]
+        self.samples = [] # one row per sample
+        self.console = None # console counter while capture_console is active
+        self.wall_start = time.perf_counter()
+
+        self.step = env.step
+        self.process = env.process
+        env.step = self.instrumented_step
+        env.process = self.instrumented_process
+
+    def instrumented_step(self):
+        """Process the next event (see simpy Environment.step), counting it and its wall time against its process"""
+        queue = self.env._queue # pylint: disable=protected-access
+        if not queue:
+            self.step() # raises EmptySchedule
+        self.counters['heap_max'] = max(self.counters['heap_max'], len(queue))
+        event = queue[0][3]
+        if queue[0][0] >= self.next_sample:
+            self.sample(queue[0][0])
+        name = process_name(event)
+        start = time.perf_counter()
+        try:
+            self.step()
+        finally:
+            elapsed = time.perf_counter() - start
+            self.counters['events'] += 1
+            stats = self.process_events.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+
+    def instrumented_process(self, generator):
+        """Start a process (see simpy Environment.process), counting processes started and finished"""
+        process = self.process(generator)
+        self.counters['processes_started'] += 1
+        self.counters['processes_alive_max'] = max(self.counters['processes_alive_max'],
+                                                   self.counters['processes_started'] - self.counters['processes_finished'])
+        process.callbacks.append(self.process_finished)
+        return process
+
+    def process_finished(self, _event):
+        """Callback of a finished process"""
+        self.counters['processes_finished'] += 1
+
+    def count(self, name, n=1):
+        """Increment a counter"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name):
+        """Accumulate the wall time of a block [s]"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[name] = self.timers.get(name, 0.0) + time.perf_counter() - start
+
+    def add_probe(self, name, func):
+        """Sample func() (e.g. a queue length or log size) with the counters"""
+        self.probes[name] = func
+
+    @contextmanager
+    def capture_console(self):
+        """Count console output (debug prints) written within the block"""
+        self.console = ConsoleCounter(sys.stdout)
+        sys.stdout = self.console
+        try:
+            yield
+        finally:
+            sys.stdout = self.console.stream
+
+    def sample(self, now=None):
+        """Record the counters and probes at a simulation time (default now), and schedule the next sample"""
+        now = self.env.now if now is None else now
+        row = {'time': now, 'wall_s': time.perf_counter() - self.wall_start, 'events': self.counters['events'],
+               'processes_alive': self.counters['processes_started'] - self.counters['processes_finished'],
+               'heap_size': len(self.env._queue)} # pylint: disable=protected-access
+        for name, func in self.probes.items():
+            row[name] = func()
+        self.samples.append(row)
+        while self.next_sample <= now:
+            self.next_sample += self.sample_interval
+
+    def summary(self, **extra):
+        """Counters, timers, console output and per-process events of the replication, as a flat dict
+
+        Args:
+            **extra: Other values to include, e.g. replication id and time per run phase
+        """
+        summary = {**extra, **self.counters, 'processes_alive': self.counters['processes_started'] - self.counters['processes_finished']}
+        if self.samples:
+            summary.update({name: self.samples[-1][name] for name in self.probes})
+        if self.console is not None:
+            summary.update({'console_writes': self.console.writes, 'console_chars': self.console.chars, 'console_s': self.console.time})
+        summary.update({f"{name}_s": value for name, value in self.timers.items()})
+        for name, (events, seconds) in self.process_events.items():
+            summary[f"events_{name}"] = events
+            summary[f"events_{name}_s"] = seconds
+        return summary
+
+    def process_frame(self):
+        """Events and wall time per process, most expensive first"""
+        frame = pd.DataFrame([(name, events, seconds) for name, (events, seconds) in self.process_events.items()],
+                             columns=['process', 'events', 'wall_s'])
+        frame['us_per_event'] = frame['wall_s'] / frame['events'] * 1e6
+        return frame.sort_values('wall_s', ascending=False, ignore_index=True)
+
+    def to_frame(self):
+        """Samples over simulation time"""
+        return pd.DataFrame(self.samples)
+
+    def save(self, path, summary=None):
+        """Write the summary to <path>.json and the samples to <path>.csv
+
+        Args:
+            path (_string_): Path of the exports, without extension (e.g. savepath + 'instrument_rep0')
+            summary (_dict_, optional): Summary to write. Defaults to None, i.e. summary().
+        """
+        with open(path + '.json', 'w', encoding='utf-8') as f:
+            json.dump(self.summary() if summary is None else summary, f, indent=2, default=float)
+        self.to_frame().to_csv(path + '.csv', index=False)
@@ -0,0 +1,79 @@
+""" includes vectorised KPI computations (group quantiles, means, counts and confidence intervals in one pass)"""
+import numpy as np
+import pandas as pd
+
+QUANTILES = (0.50, 0.75, 0.92, 0.95) # queueing time quantiles reported as KPIs
+
+
+def group_kpis(data, by, value='q_time', quantiles=QUANTILES):
+    """ Count, mean and quantiles of a value for every group, in a single sort-based pass.
+
+    Rows are sorted once by (group, value); group boundaries then give counts and sums (np.add.reduceat)
+    and every quantile is read off by index, with linear interpolation as pandas' default quantile.
+
+    Args:
+        data (_dataframe_): Data, e.g. appointment log
+        by (_list_): Grouping columns, e.g. ['rep','priority','interval']
+        value (str, optional): Column to summarise. Defaults to 'q_time'.
+        quantiles (tuple, optional): Quantiles to compute. Defaults to QUANTILES.
+
+    Returns:
+        _dataframe_: One row per group - grouping columns, 'n', 'mean' and one 'q<quantile>' column per quantile
+    """
+    columns = list(by) + ['n', 'mean'] + [f"q{q}" for q in quantiles]
+    if len(data) == 0:
+        return pd.DataFrame(columns=columns)
+
+    group = data.groupby(list(by), sort=True).ngroup().to_numpy()
+    values = data[value].to_numpy(dtype=float)
+    order = np.lexsort((values, group))
+    group, values = group[order], values[order]
+
+    starts = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    counts = np.diff(np.r_[starts, len(values)])
+    kpis = data[list(by)].iloc[order[starts]].reset_index(drop=True)
+    kpis['n'] = counts
+    kpis['mean'] = np.add.reduceat(values, starts) / counts
+
+    for q in quantiles:
+        pos = starts + q * (counts - 1)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, starts + counts - 1)
+        kpis[f"q{q}"] = values[lo] + (pos - lo) * (values[hi] - values[lo])
+
+    return kpis
+
+
+def confidence_intervals(data, by='KPI', value='value', confidence=0.95):
+    """ Mean and (small sample, t-distribution) confidence interval of a value per group - vectorised mean_confidence_interval.
+
+    Args:
+        data (_dataframe_): Data, e.g. one KPI value per replication
+        by (str, optional): Grouping column. Defaults to 'KPI'.
+        value (str, optional): Column to summarise. Defaults to 'value'.
+        confidence (float, optional): The confidence level to apply, as decimal. Defaults to 0.95.
+
+    Returns:
+        _dataframe_: KPI_mean, KPI_LCI and KPI_UCI, indexed by group
+    """
+    import scipy.stats as st # pylint: disable=import-outside-toplevel
+    stats = data.groupby(by)[value].agg(['mean', 'std', 'count'])
+    h = stats['std'] / np.sqrt(stats['count']) * st.t.ppf((1 + confidence) / 2., stats['count'] - 1)
+    return pd.DataFrame({'KPI_mean': stats['mean'], 'KPI_LCI': stats['mean'] - h, 'KPI_UCI': stats['mean'] + h})
+
+
+def relative_precision(batch_kpi):
+    """ Confidence interval half-width relative to the KPI mean, per KPI (as confidence_intervals output).
+
+    No variation around a zero mean (0/0) counts as precise (0). KPIs not estimated - missing, or with a NaN interval
+    (e.g. present in a single replication) - are never precise (inf).
+
+    Args:
+        batch_kpi (_dataframe_): KPI_mean, KPI_LCI and KPI_UCI per KPI
+
+    Returns:
+        _Series_: Relative CI half-width per KPI
+    """
+    half_width = (batch_kpi['KPI_UCI'] - batch_kpi['KPI_LCI']) / 2
+    precision = (half_width / batch_kpi['KPI_mean'].abs()).where(~((half_width == 0) & (batch_kpi['KPI_mean'] == 0)), 0.0)
+    return precision.fillna(np.inf)
@@ -0,0 +1,413 @@
+""" includes event-log sinks: column buffers of typed arrays, flushed in chunks to csv, parquet or npy files, and
+partitioned parquet datasets of batch logs (by scenario and rep)"""
+import csv
+import io
+import os
+import time
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+from src.patient import APPT_TYPES, PATHWAYS # categories of the appointment 'type' and 'pathway' columns
+
+LogColumn = namedtuple('LogColumn', ['name', 'dtype', 'categories'], defaults=[None])
+
+
+# Log schemas - RTT patient (1), appointment (2), audit (3). Column order as written to file.
+PATIENT_SCHEMA = [LogColumn("P_ID", np.int64), LogColumn("Q_time_fopa", np.float64),
+                  LogColumn("Q_time_fuopa", np.float64), LogColumn("rep", np.int32)]
+APPT_SCHEMA = [LogColumn("P_ID", np.int64), LogColumn("Appt_ID", np.int64), LogColumn("priority", np.int8),
+               LogColumn("type", np.int8, APPT_TYPES), LogColumn("pathway", np.int8, PATHWAYS),
+               LogColumn("q_time", np.float64), LogColumn("start_q", np.float64),
+               LogColumn("DNA", np.bool_), LogColumn("rep", np.int32)]
+AUDIT_SCHEMA = [LogColumn('time', np.float64), LogColumn('patients in system', np.int64),
+                LogColumn('all patients waiting', np.int64), LogColumn('priority 1 patients waiting', np.int64),
+                LogColumn('priority 2 patients waiting', np.int64), LogColumn('priority 3 patients waiting', np.int64),
+                LogColumn('resources occupied', np.int64), LogColumn('rep', np.int32)]
+
+# Dictionary-encoded (categorical) columns of batch log datasets, and their partition columns (hive layout: scenario=<name>/rep=<id>/)
+DATASET_CATEGORIES = {'type': APPT_TYPES, 'pathway': PATHWAYS}
+DATASET_PARTITIONS = ('scenario', 'rep')
+
+# Log name (file stem within savepath) and schema, per log
+LOGS = {'patient': ("patient_result2", PATIENT_SCHEMA),
+        'appt': ("appt_result", APPT_SCHEMA),
+        'audit': ("batch_mon_audit_ls", AUDIT_SCHEMA)}
+
+
+class ColumnBuffer:
+    """ Fixed-capacity buffer holding one typed numpy array per log column. Categorical columns are stored as small int codes."""
+
+    def __init__(self, schema, capacity=10000):
+        """Initialise empty column buffer.
+
+        Args:
+            schema (_list of LogColumn_): Columns (name, dtype, categories) of the log
+            capacity (int, optional): Number of rows held before the buffer is full. Defaults to 10000.
+        """
+        self.schema = schema
+        self.capacity = capacity
+        self.columns = [np.empty(capacity, dtype=col.dtype) for col in schema]
+        self.codes = [{v: i for i, v in enumerate(col.categories)} if col.categories else None for col in schema] # category -> code lookups
+        self.size = 0
+
+    def append(self, row):
+        """Add one row (values in schema order, categories as labels). Returns True when the buffer is full."""
+        i = self.size
+        for column, codes, value in zip(self.columns, self.codes, row):
+            column[i] = value if codes is None else codes[value]
+        self.size = i + 1
+        return self.size == self.capacity
+
+    def clear(self):
+        """Empty buffer (arrays are reused)"""
+        self.size = 0
+
+    def grow(self):
+        """Double buffer capacity (amortised O(1) per appended row)"""
+        self.capacity *= 2
+        for i, column in enumerate(self.columns):
+            self.columns[i] = np.empty(self.capacity, dtype=column.dtype)
+            self.columns[i][:self.size] = column[:self.size]
+
+    def decoded_columns(self):
+        """Filled part of each column, with categorical codes decoded back to labels"""
+        return [column[:self.size] if col.categories is None else np.asarray(col.categories, dtype=object)[column[:self.size]]
+                for col, column in zip(self.schema, self.columns)]
+
+    def to_frame(self):
+        """Filled part of buffer as a dataframe (categories as labels)"""
+        return pd.DataFrame({col.name: values for col, values in zip(self.schema, self.decoded_columns())})
+
+    def to_records(self):
+        """Filled part of buffer as a numpy structured array (categories as codes)"""
+        records = np.empty(self.size, dtype=[(col.name, col.dtype) for col in self.schema])
+        for col, column in zip(self.schema, self.columns):
+            records[col.name] = column[:self.size]
+        return records
+
+
+class LogSink:
+    """ Base class of event-log sinks. Rows are buffered in a ColumnBuffer and written out one chunk at a time."""
+    extension = ''
+
+    def __init__(self, path, schema, chunk_size=10000):
+        """Initialise sink.
+
+        Args:
+            path (_string_): Path of the log, without extension (e.g. savepath + 'appt_result')
+            schema (_list of LogColumn_): Columns of the log
+            chunk_size (int, optional): Number of rows buffered between writes. Defaults to 10000.
+        """
+        self.path = path
+        self.schema = schema
+        self.buffer = ColumnBuffer(schema, chunk_size)
+        self.rows_written = 0
+        self.bytes_written = 0 # size of the chunks written out [bytes]
+        self.write_time = 0.0 # wall time spent writing chunks out [s]
+
+    def append(self, row):
+        """Add one row to the log (written out when the buffer is full)"""
+        if self.buffer.append(row):
+            self.flush()
+
+    def flush(self):
+        """Write buffered rows out"""
+        if self.buffer.size:
+            start = time.perf_counter()
+            self.bytes_written += self._write()
+            self.write_time += time.perf_counter() - start
+            self.rows_written += self.buffer.size
+            self.buffer.clear()
+
+    def close(self):
+        """Write any remaining buffered rows out"""
+        self.flush()
+
+    def initiate(self):
+        """Create an empty log, replacing any existing one"""
+        raise NotImplementedError
+
+    def read(self):
+        """Read whole log back into a dataframe"""
+        raise NotImplementedError
+
+    def _write(self):
+        """Write the buffered rows out and return the number of bytes written"""
+        raise NotImplementedError
+
+
+class CSVSink(LogSink):
+    """ Event-log sink appending chunks of rows to a single csv file (same layout as the line-by-line log)"""
+    extension = '.csv'
+
+    def initiate(self):
+        with open(self.path + self.extension, "w",encoding="cp1252") as f:
+            writer = csv.writer(f, delimiter=",")
+            writer.writerow([col.name for col in self.schema])
+
+    def read(self):
+        return pd.read_csv(self.path + self.extension)
+
+    def _write(self):
+        with open(self.path + self.extension, "a",encoding="cp1252") as f:
+            start = f.tell()
+            writer = csv.writer(f, delimiter=",")
+            writer.writerows(zip(*[values.tolist() for values in self.buffer.decoded_columns()]))
+            return f.tell() - start
+
+
+class PartSink(LogSink):
+    """ Event-log sink writing each chunk of rows to its own part file, in a folder named after the log"""
+
+    def initiate(self):
+        os.makedirs(self.path, exist_ok=True)
+        for part in self.parts():
+            os.remove(part)
+
+    def parts(self):
+        """Part files of the log, in write order"""
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, f) for f in sorted(os.listdir(self.path)) if f.endswith(self.extension)]
+
+    def next_part(self):
+        """Path for the next part file (continues numbering of parts already on disk, e.g. from earlier reps)"""
+        os.makedirs(self.path, exist_ok=True)
+        return os.path.join(self.path, f"part-{len(self.parts()):06d}{self.extension}")
+
+    def read(self):
+        parts = self.parts()
+        if not parts:
+            return pd.DataFrame(columns=[col.name for col in self.schema])
+        return pd.concat([self.read_part(part) for part in parts], ignore_index=True)
+
+    def read_part(self, part):
+        """Read a single part file into a dataframe (categories as labels)"""
+        raise NotImplementedError
+
+
+class ParquetSink(PartSink):
+    """ Event-log sink writing chunks as parquet part files (categorical columns dictionary-encoded). Needs pyarrow."""
+    extension = '.parquet'
+
+    def __init__(self, path, schema, chunk_size=10000):
+        try:
+            import pyarrow # pylint: disable=import-outside-toplevel,unused-import
+        except ImportError as e:
+            raise ImportError("log_format 'parquet' needs pyarrow (pip install pyarrow)") from e
+        super().__init__(path, schema, chunk_size)
+
+    def _write(self):
+        frame = self.buffer.to_frame()
+        for col in self.schema:
+            if col.categories:
+                frame[col.name] = pd.Categorical(frame[col.name], categories=col.categories)
+        part = self.next_part()
+        frame.to_parquet(part, index=False)
+        return os.path.getsize(part)
+
+    def read_part(self, part):
+        frame = pd.read_parquet(part)
+        for col in self.schema:
+            if col.categories:
+                frame[col.name] = frame[col.name].astype(object)
+        return frame
+
+
+class NpySink(PartSink):
+    """ Event-log sink writing chunks as numpy .npy part files (structured arrays, categories as codes)"""
+    extension = '.npy'
+
+    def _write(self):
+        part = self.next_part()
+        np.save(part, self.buffer.to_records())
+        return os.path.getsize(part)
+
+    def read_part(self, part):
+        records = np.load(part)
+        return pd.DataFrame({col.name: records[col.name] if col.categories is None
+                             else np.asarray(col.categories, dtype=object)[records[col.name]]
+                             for col in self.schema})
+
+
+class MemorySink(LogSink):
+    """ Event-log sink keeping every row in memory, in a column buffer that grows rather than being written out"""
+
+    def __init__(self, schema, chunk_size=10000):
+        super().__init__(None, schema, chunk_size)
+
+    def append(self, row):
+        if self.buffer.size == self.buffer.capacity:
+            self.buffer.grow()
+        self.buffer.append(row)
+
+    def flush(self):
+        pass
+
+    def initiate(self):
+        self.buffer.clear()
+
+    def read(self):
+        return self.buffer.to_frame()
+
+    def to_frame(self):
+        """All rows logged so far as a dataframe"""
+        return self.buffer.to_frame()
+
+
+LOG_SINKS = {'csv': CSVSink, 'parquet': ParquetSink, 'npy': NpySink}
+
+
+def make_sink(log_format, path, schema, chunk_size=10000):
+    """Create an event-log sink.
+
+    Args:
+        log_format (_string_): Backend - 'csv', 'parquet' or 'npy'
+        path (_string_): Path of the log, without extension
+        schema (_list of LogColumn_): Columns of the log
+        chunk_size (int, optional): Number of rows buffered between writes. Defaults to 10000.
+
+    Returns:
+        _LogSink_: sink instance
+    """
+    if log_format not in LOG_SINKS:
+        raise ValueError(f"Unknown log_format '{log_format}'. Choose from {list(LOG_SINKS)}")
+    return LOG_SINKS[log_format](path, schema, chunk_size)
+
+
+def read_log(savepath, log, log_format='csv'):
+    """Read a whole log (e.g. 'appt', see LOGS) from savepath back into a dataframe"""
+    name, schema = LOGS[log]
+    return make_sink(log_format, savepath + name, schema).read()
+
+
+class LogReader:
+    """ Incremental reader of a saved log: each read_new() parses only the rows added since the previous read.
+
+    csv logs are tracked by byte offset, part-file logs (parquet, npy) by number of part files read.
+    """
+
+    def __init__(self, savepath, log, log_format='csv', from_end=False):
+        """Initialise reader.
+
+        Args:
+            savepath (_string_): Save path holding the log
+            log (_string_): Log to read ('patient', 'appt' or 'audit', see LOGS)
+            log_format (str, optional): Log backend - 'csv', 'parquet' or 'npy'. Defaults to 'csv'.
+            from_end (bool, optional): Whether to skip rows already in the log (only read rows added from now on). Defaults to False.
+        """
+        name, schema = LOGS[log]
+        self.sink = make_sink(log_format, savepath + name, schema)
+        self.names = [col.name for col in schema]
+        self.offset = None # csv: byte offset of first unread row (None: not positioned yet, i.e. after header)
+        self.parts_read = 0 # part-file logs: number of part files already read
+        if from_end:
+            self.seek_end()
+
+    def seek_end(self):
+        """Mark all rows currently in the log as read"""
+        if isinstance(self.sink, CSVSink):
+            path = self.sink.path + self.sink.extension
+            self.offset = os.path.getsize(path) if os.path.exists(path) else None
+        else:
+            self.parts_read = len(self.sink.parts())
+
+    def read_new(self):
+        """Read rows added to the log since the last read, as a dataframe"""
+        if isinstance(self.sink, CSVSink):
+            return self._read_new_csv()
+        parts = self.sink.parts()[self.parts_read:]
+        self.parts_read += len(parts)
+        if not parts:
+            return pd.DataFrame(columns=self.names)
+        return pd.concat([self.sink.read_part(part) for part in parts], ignore_index=True)
+
+    def _read_new_csv(self):
+        path = self.sink.path + self.sink.extension
+        if not os.path.exists(path):
+            return pd.DataFrame(columns=self.names)
+        with open(path, "rb") as f:
+            if self.offset is None:
+                f.readline() # skip header
+            else:
+                f.seek(self.offset)
+            start = f.tell()
+            data = f.read()
+        data = data[:data.rfind(b"\n") + 1] # complete rows only
+        self.offset = start + len(data)
+        if not data.strip():
+            return pd.DataFrame(columns=self.names)
+        return pd.read_csv(io.BytesIO(data), header=None, names=self.names, encoding="cp1252")
+
+
+def write_dataset(frame, path, scenario, row_group_size=65536):
+    """Write a batch log (e.g. Batch_rheum_model.batch_mon_appointments) to a parquet dataset partitioned by scenario and rep.
+
+    type and pathway are dictionary-encoded, and rows are sorted by start_q (or time) within each rep, so that row group
+    statistics let readers skip row groups outside a start_q range. Partitions of the same scenario and rep are replaced.
+    Needs pyarrow.
+
+    Args:
+        frame (_dataframe_): Batch log, with a rep column (or without, e.g. batch_kpi: partitioned by scenario only)
+        path (_string_): Folder of the dataset
+        scenario (_string_): Scenario name (partition value)
+        row_group_size (int, optional): Maximum number of rows per row group. Defaults to 65536.
+    """
+    try:
+        import pyarrow as pa # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError("parquet datasets need pyarrow (pip install pyarrow)") from e
+
+    frame = frame.reset_index(drop=frame.index.name is None).assign(scenario=scenario)
+    for name, categories in DATASET_CATEGORIES.items():
+        if name in frame:
+            frame[name] = pd.Categorical(frame[name], categories=categories)
+    for name in frame.columns:
+        if pd.api.types.infer_dtype(frame[name]).startswith('mixed'): # e.g. batch_mon_app_kpit KPI (quantile or name)
+            frame[name] = frame[name].astype(str)
+    sort_by = [col for col in ('rep', 'start_q' if 'start_q' in frame else 'time') if col in frame]
+    if sort_by:
+        frame = frame.sort_values(sort_by, kind='stable')
+    partitions = [col for col in DATASET_PARTITIONS if col in frame]
+    pq.write_to_dataset(pa.Table.from_pandas(frame, preserve_index=False), path, partition_cols=partitions,
+                        existing_data_behavior='delete_matching', max_rows_per_group=row_group_size,
+                        min_rows_per_group=min(row_group_size, 4096))
+
+
+def read_dataset(path, columns=None, filters=None, scenarios=None, reps=None):
+    """Read (part of) a batch log dataset written by write_dataset. Only the requested columns are read, partitions not
+    in scenarios/reps are skipped, and filters are pushed down to row groups (via their min/max statistics).
+
+    Example:
+        read_dataset(path, columns=['rep', 'priority', 'q_time', 'start_q'], filters=[('start_q', '>', 1825), ('priority', '==', 3)], scenarios=['PIFU 20%'])
+
+    Args:
+        path (_string_): Folder of the dataset
+        columns (_list_, optional): Columns to read (partition columns scenario and rep included). Defaults to None, i.e. all.
+        filters (_list_, optional): Row filters as (column, op, value) tuples, all applied (pyarrow filter syntax). Defaults to None.
+        scenarios (_list_, optional): Scenarios to read. Defaults to None, i.e. all.
+        reps (_list_, optional): Replications to read. Defaults to None, i.e. all.
+
+    Returns:
+        _dataframe_: Rows read, categorical columns as labels
+    """
+    try:
+        import pyarrow.dataset as ds # pylint: disable=import-outside-toplevel
+        import pyarrow.parquet as pq # pylint: disable=import-outside-toplevel
+    except ImportError as e:
+        raise ImportError("parquet datasets need pyarrow (pip install pyarrow)") from e
+
+    filters = list(filters or [])
+    if scenarios is not None:
+        filters.append(('scenario', 'in', list(scenarios)))
+    if reps is not None:
+        filters.append(('rep', 'in', list(reps)))
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+    table = dataset.to_table(columns=columns, filter=pq.filters_to_expression(filters) if filters else None)
+    frame = table.to_pandas()
+    for name in frame.columns:
+        if isinstance(frame[name].dtype, pd.CategoricalDtype):
+            frame[name] = frame[name].astype(object)
+    return frame
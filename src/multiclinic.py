@@ -0,0 +1,323 @@
+""" includes the multi-clinic model: many outpatient clinics (e.g. every specialty of a trust), each a rheum_Model with
+its own parameters, simulated in one simpy environment or sharded across worker processes, with optional cross-clinic
+referrals and shared reporting (per clinic and trust-wide).
+
+Each clinic draws from its own random number streams, seeded from (seed, replication, clinic name), and only its own
+events change its state - so a clinic's results do not depend on which clinics share its environment. Clinics linked
+by referrals are kept in the same shard. Events of all clinics in a shard share one event heap, so the cost grows
+about linearly with the number of clinics (and their arrival rates). The cyclic garbage collector is paused while a
+shard is simulated: patient pathways leave no reference cycles, and its full passes over every live patient of every
+clinic would otherwise make the cost per clinic grow with the number of clinics (about 2x at 40 clinics).
+
+Example:
+    clinics = {'rheumatology': {'in_res': 12, 'in_inter_arrival': 1/6},
+               'dermatology': {'in_res': 20, 'in_inter_arrival': 1/10, 'params': {'prob_firstonly': 0.5}}}
+    trust = MultiClinicModel(clinics, referrals={('rheumatology', 'dermatology'): 0.02}, seed=1)
+    trust.run(n_workers=4)
+    trust.headline_kpis()
+"""
+import gc
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+import simpy
+
+from src.helpers import Trial_Results_initiate
+from src.kpis import QUANTILES, group_kpis
+from src.randomstreams import VariateBlock
+from src.rheum_Model import rheum_Model
+
+# Per-clinic results, gathered across shards with a 'clinic' column
+CLINIC_RESULTS = ('audit', 'appointments', 'patients', 'time_weighted')
+
+
+def clinic_seed(seed, rep, name):
+    """ Seed of a clinic's random number streams, from the run seed, replication and clinic name (not its position or shard)"""
+    return int(np.random.SeedSequence([seed, rep, zlib.crc32(name.encode())]).generate_state(1)[0])
+
+
+def clinic_load(spec):
+    """ Relative simulation cost of a clinic - its arrival rate [patients/day] (events grow with arrivals)"""
+    return 1.0 / spec.get('in_inter_arrival', 365/4590)
+
+
+def referral_groups(names, referrals):
+    """ Groups of clinics linked (directly or not) by referrals, which must be simulated in the same environment
+
+    Args:
+        names (_list_): Clinic names
+        referrals (_dict_): (from clinic, to clinic) -> referral probability
+
+    Returns:
+        _list_: Lists of clinic names, in clinic order
+    """
+    parent = {name: name for name in names}
+
+    def root(name):
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for source, target in referrals:
+        parent[root(source)] = root(target)
+    groups = {}
+    for name in names:
+        groups.setdefault(root(name), []).append(name)
+    return list(groups.values())
+
+
+def shard_clinics(clinics, referrals, n_shards):
+    """ Split clinics into shards of similar load (see clinic_load), keeping referral groups together
+
+    Args:
+        clinics (_dict_): Clinic name -> rheum_Model keyword arguments
+        referrals (_dict_): (from clinic, to clinic) -> referral probability
+        n_shards (_integer_): Maximum number of shards
+
+    Returns:
+        _list_: Lists of clinic names (no empty shard)
+    """
+    groups = referral_groups(list(clinics), referrals)
+    groups.sort(key=lambda group: -sum(clinic_load(clinics[name]) for name in group))
+    shards = [[] for _ in range(min(n_shards, len(groups)))]
+    loads = [0.0] * len(shards)
+    for group in groups: # largest first, to the least loaded shard
+        i = loads.index(min(loads))
+        shards[i].extend(group)
+        loads[i] += sum(clinic_load(clinics[name]) for name in group)
+    return [sorted(shard, key=list(clinics).index) for shard in shards]
+
+
+class ReferralRouter:
+    """ Refers patients discharged from a clinic to other clinics, as new RTT patients, with given probabilities
+    (one uniform draw per discharge from the router's own stream). Referrals after warm-up are counted."""
+
+    def __init__(self, targets, seed, block=4096):
+        """Initialise router.
+
+        Args:
+            targets (_list_): (clinic name, rheum_Model, probability) per clinic referred to. Probabilities sum to at most 1.
+            seed (_integer_): Seed of the router's random number stream
+            block (int, optional): Number of uniform variates pre-sampled per block (see randomstreams). Defaults to 4096.
+        """
+        cumulative = np.cumsum([probability for _name, _model, probability in targets])
+        self.targets = [(name, model, threshold) for (name, model, _probability), threshold in zip(targets, cumulative)]
+        self.uniforms = VariateBlock(np.random.default_rng(seed).random, block)
+        self.counts = {name: 0 for name, _model, _probability in targets} # referrals after warm-up per clinic referred to
+
+    def __call__(self, model, patient): # pylint: disable=unused-argument
+        """Discharge callback of the referring clinic (see rheum_Model.on_discharge)"""
+        u = self.uniforms.draw()
+        for name, target, threshold in self.targets:
+            if u < threshold:
+                target.add_patient()
+                if model.env.now > model.g.warm_duration:
+                    self.counts[name] += 1
+                return
+
+
+def run_clinic_shard(clinics, referrals, rep, seed, savepath, loglinesave=False, log_format='csv'):
+    """ Simulate a shard of clinics in one environment (in the calling or a worker process).
+
+    Args:
+        clinics (_dict_): Clinic name -> rheum_Model keyword arguments (e.g. in_res, in_inter_arrival, params)
+        referrals (_dict_): (from clinic, to clinic) -> referral probability, within the shard
+        rep (_integer_): Replication id
+        seed (_integer_): Run seed (see clinic_seed)
+        savepath (_string_): Save path for outputs - each clinic saves to '<savepath><clinic>/'
+        loglinesave (bool, optional): Whether clinics save logs to file (True) or keep them in memory (False). Defaults to False.
+        log_format (str, optional): Backend for saved logs - 'csv', 'parquet' or 'npy'. Defaults to 'csv'.
+
+    Returns:
+        _dict_: Per clinic results (audit, post warm-up appointments, patients, time-weighted KPIs, parameters), referral counts and timings of the shard
+    """
+    env = simpy.Environment()
+    models = {}
+    for name, spec in clinics.items():
+        clinicpath = savepath + f"{name}/"
+        os.makedirs(clinicpath, exist_ok=True)
+        if loglinesave:
+            Trial_Results_initiate(clinicpath + "patient_result2.csv", clinicpath + "appt_result.csv", clinicpath + "batch_mon_audit_ls.csv", log_format)
+        models[name] = rheum_Model(rep, repid=rep, savepath=clinicpath, env=env, crn_seed=clinic_seed(seed, rep, name),
+                                   loglinesave=loglinesave, log_format=log_format, figures=False, **spec)
+    ends = {model.g.warm_duration + model.g.obs_duration for model in models.values()}
+    if len(ends) > 1:
+        raise ValueError(f"Clinics must have the same simulation horizon (warm-up + observation), not {sorted(ends)}")
+    end = ends.pop()
+
+    routers = {}
+    for source in clinics:
+        targets = [(target, models[target], probability) for (origin, target), probability in referrals.items() if origin == source]
+        if targets:
+            routers[source] = models[source].on_discharge = ReferralRouter(targets, clinic_seed(seed, rep, source + '>referrals'))
+
+    start = time.perf_counter()
+    for model in models.values():
+        model.start()
+    gc_enabled = gc.isenabled()
+    gc.disable() # (see module docstring)
+    try:
+        env.run(until=end)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    timings = {'simulation': time.perf_counter() - start}
+
+    start = time.perf_counter()
+    results = {}
+    for name, model in models.items():
+        model.finish(chart=False)
+        appointments = model.g.appt_queuing_results
+        results[name] = {'audit': model.g.results,
+                         'appointments': appointments[appointments['start_q'] > model.g.warm_duration], # post warm-up queue starts
+                         'patients': model.results_df,
+                         'time_weighted': model.time_weighted.headline_kpis(),
+                         'info': {'slots': model.g.number_of_slots, 'arrival_rate': 1 / model.g.wl_inter, 'end': end,
+                                  'window_tail': model.g.stream_window_tail}}
+    timings['results'] = time.perf_counter() - start
+
+    referral_counts = [(source, target, n) for source, router in routers.items() for target, n in router.counts.items()]
+    return {'clinics': results, 'referrals': referral_counts, 'timings': timings}
+
+
+class MultiClinicModel:
+    """ Many clinics, each a rheum_Model with its own parameters, simulated together (one replication), with optional
+    cross-clinic referrals and results gathered per clinic and trust-wide.
+    """
+
+    def __init__(self, clinics, referrals=None, rep=0, seed=None, savepath='temp/', loglinesave=False, log_format='csv'):
+        """Initialise multi-clinic model.
+
+        Args:
+            clinics (_dict_): Clinic name -> rheum_Model keyword arguments (e.g. in_res, in_inter_arrival, in_prob_pifu, capacity_engine, and params for other g values). All clinics need the same simulation horizon.
+            referrals (_dict_, optional): (from clinic, to clinic) -> probability that a patient discharged from the first clinic is referred to the second, as a new RTT patient. Defaults to None, i.e. no referrals.
+            rep (int, optional): Replication id. Defaults to 0.
+            seed (_integer_, optional): Run seed, from which each clinic's random number streams are seeded (see clinic_seed). Defaults to None, i.e. drawn from the global random module.
+            savepath (str, optional): Save path for outputs - each clinic saves to '<savepath><clinic>/'. Defaults to 'temp/'.
+            loglinesave (bool, optional): Whether clinics save logs to file (True) or keep them in memory (False). Defaults to False.
+            log_format (str, optional): Backend for saved logs - 'csv', 'parquet' or 'npy'. Defaults to 'csv'.
+        """
+        self.clinics = dict(clinics)
+        self.referrals = dict(referrals or {})
+        for (source, target), probability in self.referrals.items():
+            if source not in self.clinics or target not in self.clinics:
+                raise ValueError(f"Referral between unknown clinics {source} -> {target}")
+            if source == target or not 0 <= probability <= 1:
+                raise ValueError(f"Invalid referral {source} -> {target} ({probability})")
+        for source in self.clinics:
+            if sum(p for (origin, _target), p in self.referrals.items() if origin == source) > 1:
+                raise ValueError(f"Referral probabilities from {source} sum to more than 1")
+        for name, spec in self.clinics.items():
+            if {'env', 'snapshot', 'instrument', 'repid', 'savepath', 'crn_seed'} & set(spec):
+                raise ValueError(f"Clinic {name}: env, snapshot, instrument, repid, savepath and crn_seed are set by the multi-clinic model")
+        self.rep = rep
+        self.seed = random.getrandbits(63) if seed is None else seed
+        self.savepath = savepath
+        self.loglinesave = loglinesave
+        self.log_format = log_format
+
+        self.audit = pd.DataFrame() # audit log rows, all clinics
+        self.appointments = pd.DataFrame() # post warm-up appointment log rows, all clinics
+        self.patients = pd.DataFrame() # patient log rows, all clinics
+        self.time_weighted = pd.DataFrame() # time-weighted waiting list and utilisation KPIs per clinic (see streamstats.TimeWeightedKPIs)
+        self.clinic_info = pd.DataFrame() # slots, arrival rate, horizon, time-weighted KPI window and shard per clinic
+        self.referral_counts = pd.DataFrame(columns=['from', 'to', 'n']) # referrals after warm-up
+        self.timings = {} # wall time [s] - total run, and simulation/results per shard
+        self.shards = [] # clinic names per shard of the latest run
+
+    def shard_args(self, shard):
+        """Arguments of run_clinic_shard for a shard (list of clinic names)"""
+        return ({name: self.clinics[name] for name in shard},
+                {(source, target): p for (source, target), p in self.referrals.items() if source in shard},
+                self.rep, self.seed, self.savepath, self.loglinesave, self.log_format)
+
+    def run(self, n_workers=1):
+        """ Simulate all clinics - in one environment, or sharded across worker processes (see shard_clinics)
+
+        Args:
+            n_workers (int, optional): Number of worker processes. Defaults to 1, i.e. all clinics in one environment in this process.
+
+        Returns:
+            _dataframe_: Headline KPIs per clinic and trust-wide (see headline_kpis)
+        """
+        start = time.perf_counter()
+        self.shards = shard_clinics(self.clinics, self.referrals, n_workers) if n_workers > 1 else [list(self.clinics)]
+        if len(self.shards) == 1:
+            shard_results = [run_clinic_shard(*self.shard_args(self.shards[0]))]
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                futures = [executor.submit(run_clinic_shard, *self.shard_args(shard)) for shard in self.shards]
+                shard_results = [future.result() for future in as_completed(futures)]
+        self.add_shard_results(shard_results)
+        self.timings['run'] = time.perf_counter() - start
+        return self.headline_kpis()
+
+    def add_shard_results(self, shard_results):
+        """ Merge shard results (see run_clinic_shard), in clinic order, into the multi-clinic frames
+
+        Args:
+            shard_results (_list_): Results of run_clinic_shard, one per shard
+        """
+        clinic_results = {}
+        for shard, result in enumerate(shard_results):
+            for name, clinic in result['clinics'].items():
+                clinic_results[name] = clinic
+                clinic['info']['shard'] = shard
+            self.timings[f"shard{shard}"] = result['timings']
+        names = [name for name in self.clinics if name in clinic_results]
+
+        for frame in CLINIC_RESULTS:
+            setattr(self, frame, pd.concat([getattr(self, frame)]
+                                           + [clinic_results[name][frame].assign(clinic=name) for name in names], ignore_index=True))
+        self.clinic_info = pd.concat([self.clinic_info, pd.DataFrame([{'clinic': name, **clinic_results[name]['info']} for name in names])],
+                                     ignore_index=True)
+        referral_counts = [row for result in shard_results for row in result['referrals']]
+        self.referral_counts = pd.concat([self.referral_counts, pd.DataFrame(referral_counts, columns=['from', 'to', 'n'])], ignore_index=True)
+
+    def trust_audit(self):
+        """Audited state summed over clinics at each audit time (clinics with the same audit interval)"""
+        return self.audit.drop(columns=['rep', 'clinic']).groupby('time', as_index=False).sum()
+
+    def headline_kpis(self, window_tail=365):
+        """ Headline KPIs per clinic and trust-wide ('trust' row), as Batch_rheum_model.headline_KPI for one replication.
+
+        Per clinic: RTT queueing time count, mean and quantiles (RTT patients starting to queue in the final window),
+        RTT waiting list and slots occupied at the last audit time, and the time-weighted waiting list and utilisation
+        KPIs (when the clinic kept them for this window, see g.stream_window_tail). Trust-wide: RTT queueing time KPIs
+        over all clinics, waiting lists and slots occupied summed, time-weighted mean waiting lists summed and mean
+        utilisation over all slots (time-weighted max and quantiles do not add up across clinics, so are left out).
+
+        Args:
+            window_tail (int, optional): Final window for RTT queueing time KPIs [days]. Defaults to 365.
+
+        Returns:
+            _dataframe_: One row per clinic, then 'trust', indexed by clinic
+        """
+        info = self.clinic_info.set_index('clinic')
+        appointments = self.appointments[(self.appointments['priority'] == 3)
+                                         & (self.appointments['start_q'] > self.appointments['clinic'].map(info['end']) - window_tail)]
+        kpi_names = {'n': 'RTT_n', 'mean': 'RTT_mean'}
+        kpi_names.update({f"q{q}": f"RTT_q{q}" for q in QUANTILES})
+
+        kpis = group_kpis(appointments, ['clinic'], 'q_time', QUANTILES).rename(columns=kpi_names).set_index('clinic')
+        last_audit = self.audit[self.audit['time'] == self.audit['clinic'].map(self.audit.groupby('clinic')['time'].max())]
+        last_audit = last_audit.set_index('clinic').rename(columns={'priority 3 patients waiting': 'RTT_WL_end'})[['RTT_WL_end', 'resources occupied']]
+        time_weighted = self.time_weighted.set_index('clinic').drop(columns='rep')
+        time_weighted = time_weighted[info['window_tail'].reindex(time_weighted.index) == window_tail]
+        kpis = pd.concat([kpis, last_audit, time_weighted], axis=1).reindex(info.index)
+
+        trust = group_kpis(appointments.assign(trust='trust'), ['trust'], 'q_time', QUANTILES).rename(columns=kpi_names).set_index('trust')
+        trust = trust.reindex(['trust'])
+        trust[['RTT_WL_end', 'resources occupied']] = last_audit[['RTT_WL_end', 'resources occupied']].sum().to_numpy()
+        for name in ['RTT_WL', 'TFU_WL', 'PIFU_WL']:
+            if f"{name}_mean" in time_weighted:
+                trust[f"{name}_mean"] = time_weighted[f"{name}_mean"].sum()
+        if 'utilisation_mean' in time_weighted:
+            slots = info['slots'].reindex(time_weighted.index)
+            trust['utilisation_mean'] = (time_weighted['utilisation_mean'] * slots).sum() / slots.sum()
+        return pd.concat([kpis, trust])
@@ -1,54 +1,95 @@
 """ Module includes rheumatology patient class."""
-import random
-import pandas as pd
 # import numpy as np
 
+from src.randomstreams import PYTHON_RANDOM
+
+# Pathway types and appointment types, kept as small int codes (index in these tuples) on patients and in logs
+PATHWAYS = ("First", "First-only", "TFU", "PIFU")
+APPT_TYPES = ("First", "First-only", "Traditional", "PIFU")
+PATHWAY_CODES = {pathway: code for code, pathway in enumerate(PATHWAYS)}
+APPT_TYPE_CODES = {appt_type: code for code, appt_type in enumerate(APPT_TYPES)}
+
+
 class FOPA_Patient:
-    """Class representing our RTT patients entering the secondary care rheumatology pathway."""
-    # The following dictionaries store patients
-    all_patients = {}
+    """Class representing our RTT patients entering the secondary care rheumatology pathway.
 
-    def __init__(self, p_id,prob_pifu,in_path_horizon,DNA_pifu_pro,DNA_tra_pro):
+    Compact record (__slots__, no per-instance dict): patients in the system are held by their model (rheum_Model.patients),
+    and appointment rows go straight to the model's logs.
+    """
+    __slots__ = ('rng', 'id', 'prob_pifu', 'q_time_fopa', 'q_time_fuopa', 'q_time_pifuopa', 'topifu', 'priority',
+                 'max_fuopa_tenor', 'used_fuopa', 'appt_id', 'DNA_pifu_pro', 'DNA_tra_pro', 'tradition_dna', 'pifu_dna',
+                 'FOavoided', 'RTT_sub', 'pathway', 'appt_type', 'pifu_draw', 'stage', 'wake', 'wake_seq', 'start_q',
+                 'end_q_fopa', 'req')
+
+    def __init__(self, p_id,prob_pifu,in_path_horizon,DNA_pifu_pro,DNA_tra_pro,rng=None):
         """Initialises patient attributes.
 
         Args:
             p_id (_integer_): patient id
             prob_pifu (_double_): PIFU probability
-            in_path_horizon (_integer_): _description_
-            DNA_pifu_pro (_double_): Maximum horizon for follow-up per pathway (as days since first OPA) [days]
+            in_path_horizon (_integer_): Maximum horizon for follow-up per pathway (as days since first OPA) [days]
+            DNA_pifu_pro (_double_): DNA probability (PIFU appt)
             DNA_tra_pro (_double_): DNA probability (traditional appt)
+            rng (_RandomStreams_, optional): Random number streams of the model (see randomstreams). Defaults to None, i.e. global random module.
         """
-        self.apptype = []
+        self.rng = rng if rng is not None else PYTHON_RANDOM # random number streams
         self.id = p_id # patient id
         self.prob_pifu = prob_pifu # PIFU probability
         self.q_time_fopa = float("nan") # queueing time first outpatient (deprecated)
         self.q_time_fuopa = float("nan") # queueing time follow-up outpatient (deprecated)
-        self.q_times_fuopa = [] # queueing times follow-up appointments (deprecated)
+        self.q_time_pifuopa = float("nan") # queueing time of latest PIFU appointment
         self.topifu = False # Whether patient is on PIFU pathway or not. Initialised to False
         self.priority = 3 # Patient priority. Initialise at lower priority
-        self.max_fuopa = 999 # Maximum follow up outpatients per pathway (not used, see below)
         self.max_fuopa_tenor = in_path_horizon # Maximum horizon for follow-up per pathway (as days since first OPA) [days]
         self.used_fuopa = 0 # Counter for no f/up appointments used
-        self.ls_appt = [] # Vector to hold ids of appointments for pathway
-        self.DNA_pifu_pro=DNA_pifu_pro # DNA probability (traditional appt)
-        self.DNA_tra_pro=DNA_tra_pro # DNA probability (PIFU appt)
+        self.appt_id = None # Id of the patient's latest appointment
+        self.DNA_pifu_pro=DNA_pifu_pro # DNA probability (PIFU appt)
+        self.DNA_tra_pro=DNA_tra_pro # DNA probability (traditional appt)
         self.tradition_dna=False # instantiate DNA for traditional type as False
         self.pifu_dna=False # instantiated DNA for PIFU type as False
         self.FOavoided = False # instantiate whether first outpatient avoided fully as False
-        self.df_appt_to_add = (pd.DataFrame(
-            columns=['P_ID','App_ID','priority','type',"pathway",'q_time','start_q'])) # Initialise dataframe to hold appointment log
-        self.ls_appt_to_add = [] # Initialise list to hold appointment info
-        self.ls_patient_to_add = [] # Initialise list to hold pathway info
         self.RTT_sub = 0 # Initialise a variable that can 'scramble' further priority of first outpatient - priority increment (to increase variance) [Commented out]
-        self.type = "TFU" # Initialise type. By default traditional follow-up.
+        self.pathway = PATHWAY_CODES["TFU"] # Pathway type code (see PATHWAYS, label as self.type). By default traditional follow-up.
+        self.appt_type = None # First appointment type code (see APPT_TYPES, label as self.apptype), assigned with the pathway
+        self.pifu_draw = None # Uniform draw of PIFU triage (None until triaged)
+        self.stage = None # Current pathway stage (e.g. 'tfu_wait', see rheum_Model.resume_OPA), for snapshots
+        self.wake = None # End time of current wait or appointment [days], for snapshots
+        self.wake_seq = None # Scheduling order of current wait or appointment, for snapshots
+        self.start_q = None # Time the patient started queuing for the current appointment [days]
+        self.end_q_fopa = None # Time the patient was seen for the first appointment [days]
+        self.req = None # Current slot request
+
+    @property
+    def type(self):
+        """Pathway type label ('First', 'First-only', 'TFU' or 'PIFU')"""
+        return PATHWAYS[self.pathway]
+
+    @type.setter
+    def type(self, label):
+        self.pathway = PATHWAY_CODES[label]
+
+    @property
+    def apptype(self):
+        """First appointment type label ('First' or 'First-only')"""
+        return None if self.appt_type is None else APPT_TYPES[self.appt_type]
+
+    @apptype.setter
+    def apptype(self, label):
+        self.appt_type = APPT_TYPE_CODES[label]
 
     def triage_decision(self):
         """ Method to decide and assign at random PIFU fate based on PIFU probability"""
-        if random.random() < self.prob_pifu:
+        self.pifu_draw = self.rng.random('pifu_triage') # kept, so that the decision can be re-applied with another PIFU probability (see apply_triage)
+        self.apply_triage()
+
+    def apply_triage(self):
+        """ Method to assign PIFU fate from the patient's triage draw and (current) PIFU probability"""
+        if self.pifu_draw < self.prob_pifu:
             self.topifu = True
-            self.type = "PIFU"
+            self.pathway = PATHWAY_CODES["PIFU"]
         else:
-            self.type = "TFU"
+            self.topifu = False
+            self.pathway = PATHWAY_CODES["TFU"]
             #self.priority = 2 # assign 2nd highest priority in the sense that those on traditional already are scheduled in/planned so not really 'moveable'
 
     def give_pifu_priority(self):
@@ -61,22 +102,22 @@ class FOPA_Patient:
 
     def assign_firstonly(self,prob_firstonly):
         """Method to assign 'first-only' pathway and appointment status or otherwise 'first' (of more appointments), based on a probability prob_firstonly"""
-        if random.random() < prob_firstonly:
-            self.type = "First-only" # single appointment
-            self.apptype = "First-only"
+        if self.rng.random('firstonly') < prob_firstonly:
+            self.pathway = PATHWAY_CODES["First-only"] # single appointment
+            self.appt_type = APPT_TYPE_CODES["First-only"]
             self.max_fuopa_tenor = 0 # no follow-ups
         else:
-            self.type = "First" # first leading to long-term follow-up
-            self.apptype = "First"
+            self.pathway = PATHWAY_CODES["First"] # first leading to long-term follow-up
+            self.appt_type = APPT_TYPE_CODES["First"]
 
     def decision_DNA_pifu(self):
         """Method to decide and assign at random DNA fate of appointment (PIFU)"""
-        if  random.random() < self.DNA_pifu_pro:
+        if  self.rng.random('dna') < self.DNA_pifu_pro:
             self.pifu_dna = True
 
     def decision_DNA_tradtion(self):
         """Method to decide and assign at random DNA faith of appointment (first ; traditional)"""
-        if  random.random() < self.DNA_tra_pro:
+        if  self.rng.random('dna') < self.DNA_tra_pro:
             self.tradition_dna = True
 
     def sub_RTT_priority(self):
@@ -105,5 +146,5 @@ class FOPA_Patient:
 
         """
         # A&G, whether a first-only appointment can be avoided
-        if random.random() < in_FOavoidable:
+        if self.rng.random('avoidable') < in_FOavoidable:
             self.FOavoided = True
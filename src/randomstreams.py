@@ -0,0 +1,118 @@
+""" includes random number streams - one per stochastic source of the model (common random numbers across scenarios)"""
+import math
+import random
+import numpy as np
+
+# Stochastic sources of the model, each with its own stream. Order fixes each stream's seed - append new sources at the end.
+STREAMS = ('arrivals', 'firstonly', 'avoidable', 'pifu_triage', 'interfu', 'interpifu', 'dna')
+
+
+class VariateBlock:
+    """ Block of variates pre-sampled from a numpy Generator, handed out one at a time and refilled when used up """
+    __slots__ = ('sample', 'size', 'values', 'i')
+
+    def __init__(self, sample, size):
+        """Initialise empty block.
+
+        Args:
+            sample (_callable_): Generator method drawing an array of variates of a given size (e.g. generator.random)
+            size (_integer_): Number of variates drawn per refill
+        """
+        self.sample = sample
+        self.size = size
+        self.values = [] # current block (python floats - cheaper to index than a numpy array)
+        self.i = 0 # position of next variate in block
+
+    def draw(self):
+        """Next variate of the block"""
+        i = self.i
+        if i == len(self.values):
+            self.values = self.sample(self.size).tolist()
+            i = 0
+        self.i = i + 1
+        return self.values[i]
+
+
+class RandomStreams:
+    """ One numpy Generator per stochastic source, seeded from (seed, replication, source).
+
+    Scenarios run with the same seed draw the same arrivals, pathway fates, intervals and DNAs from each source,
+    so that differences between scenarios reflect the intervention rather than sampling noise (common random numbers).
+    Method names and arguments mirror the random module, with the source as first argument.
+
+    Variates are pre-sampled in numpy blocks per source (uniform, or standard exponential for expovariate) and refilled
+    lazily, so the hot loop only indexes a list. Exponential and triangular variates are transformed from them as numpy
+    does, so each source gives the same sequence whatever the block size.
+    """
+
+    def __init__(self, seed, rep, block=4096):
+        """Initialise streams.
+
+        Args:
+            seed (_integer_): Batch / comparison seed, shared by the scenarios to compare
+            rep (_integer_): Replication id
+            block (int, optional): Number of variates pre-sampled per refill of a source's block. Defaults to 4096.
+        """
+        self.seed = seed
+        self.rep = rep
+        self.block = max(int(block), 1)
+        self.generators = {source: np.random.default_rng([seed, rep, i]) for i, source in enumerate(STREAMS)}
+        self.uniforms = {source: VariateBlock(generator.random, self.block) for source, generator in self.generators.items()}
+        self.exponentials = {source: VariateBlock(generator.standard_exponential, self.block) for source, generator in self.generators.items()}
+
+    def random(self, source):
+        """Uniform [0,1) draw from the source's stream"""
+        return self.uniforms[source].draw()
+
+    def expovariate(self, source, lambd):
+        """Exponential draw (rate lambd) from the source's stream"""
+        return self.exponentials[source].draw() * (1.0 / lambd)
+
+    def triangular(self, source, low, high, mode):
+        """Triangular draw from the source's stream (argument order as random.triangular), by inverse CDF as numpy"""
+        u = self.uniforms[source].draw()
+        base = high - low
+        if u <= (mode - low) / base:
+            return low + math.sqrt(u * (mode - low) * base)
+        return high - math.sqrt((1.0 - u) * (high - mode) * base)
+
+    def getstate(self):
+        """State of every stream, including variates sampled but not drawn yet (to resume them later with setstate)"""
+        return {source: (generator.bit_generator.state,
+                         [(block.values, block.i) for block in (self.uniforms[source], self.exponentials[source])])
+                for source, generator in self.generators.items()}
+
+    def setstate(self, state):
+        """Resume every stream from a state returned by getstate"""
+        for source, generator in self.generators.items():
+            generator_state, blocks = state[source]
+            generator.bit_generator.state = generator_state
+            for block, (values, i) in zip((self.uniforms[source], self.exponentials[source]), blocks):
+                block.values, block.i = list(values), i
+
+
+class PythonRandom:
+    """ Same interface as RandomStreams, drawing every source from the global random module (seeded with random.seed)"""
+
+    def random(self, source): # pylint: disable=unused-argument
+        """Uniform [0,1) draw"""
+        return random.random()
+
+    def expovariate(self, source, lambd): # pylint: disable=unused-argument
+        """Exponential draw (rate lambd)"""
+        return random.expovariate(lambd)
+
+    def triangular(self, source, low, high, mode): # pylint: disable=unused-argument
+        """Triangular draw"""
+        return random.triangular(low, high, mode)
+
+    def getstate(self):
+        """State of the global random module"""
+        return random.getstate()
+
+    def setstate(self, state):
+        """Resume the global random module from a state returned by getstate"""
+        random.setstate(state)
+
+
+PYTHON_RANDOM = PythonRandom()
@@ -1,15 +1,31 @@
 """ Module includes model (single replication) and utilities for plotting and saving"""
 import csv
+import itertools
 import random
+import time
 import simpy
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 
 from src.patient import FOPA_Patient
 from src.helpers import patient_blocker
+from src.auditrecorder import AUDIT_STATE, ChangePointAudit
 from src.initialisers import g
+from src.instrument import Instrumentation
+from src.logsinks import LOGS, LogReader, MemorySink, make_sink
+from src.randomstreams import PYTHON_RANDOM, RandomStreams
+from src.slotheap import SlotHeap
+from src.snapshot import WarmSnapshot, patient_state, restore_patient
+from src.streamstats import StreamingKPIs, TimeWeightedKPIs
+from src.tracing import make_tracer
+
+
+# g attributes set from rheum_Model keyword arguments -> argument (not settable by params)
+KWARG_PARAMS = {'number_of_slots': 'in_res', 'wl_inter': 'in_inter_arrival', 'prob_pifu': 'in_prob_pifu', 'max_fuopa_tenor_y': 'in_path_horizon_y',
+                'max_fuopa_tenor': 'in_path_horizon_y', 'audit_interval': 'audit_interval', 'repid': 'repid', 'savepath': 'savepath',
+                'in_FOavoidable': 'in_FOavoidable', 'interfu_perc': 'in_interfu_perc', 'log_format': 'log_format', 'loglinesave': 'loglinesave',
+                'stream_stats': 'stream_stats', 'raw_logs': 'raw_logs', 'capacity_engine': 'capacity_engine', 'rng_block': 'rng_block',
+                'figures': 'figures', 'instrument': 'instrument', 'trace_level': 'trace_level'}
 
 
 class rheum_Model:
@@ -21,7 +37,7 @@ class rheum_Model:
     # the number stored in the g class)
     """
 
-    def __init__(self, run_number, in_res=2 , in_inter_arrival=(365/4590), in_prob_pifu=0.6, in_path_horizon_y=3,audit_interval=1,repid=1, savepath='temp',in_FOavoidable=0,in_interfu_perc=0.6):
+    def __init__(self, run_number, in_res=2 , in_inter_arrival=(365/4590), in_prob_pifu=0.6, in_path_horizon_y=3,audit_interval=1,repid=1, savepath='temp',in_FOavoidable=0,in_interfu_perc=0.6,log_format='csv',loglinesave=True,stream_stats=False,raw_logs=True,crn_seed=None,snapshot=None,capacity_engine='resource',rng_block=4096,figures=True,instrument=False,trace_level=0,env=None,params=None):
         """Initialise rhematology outpatient clinic model.
 
         Args:
@@ -35,16 +51,60 @@ class rheum_Model:
             savepath (str, optional): Save path for outputs. Defaults to 'temp'.
             in_FOavoidable (float, optional): A&G proportion - proportion of first-only pathways avoidable via A&G [%]. Defaults to 0.
             in_interfu_perc (float, optional): Percentage increase in inter-appointment interval with PIFU (vs traditional), i.e. 0.6 means 60% longer interval. Defaults to 0.6.
+            log_format (str, optional): Backend for saved logs - 'csv', 'parquet' or 'npy'. Defaults to 'csv'.
+            loglinesave (bool, optional): Whether to save logs to file (True) or keep them in memory (False). Defaults to True.
+            stream_stats (bool, optional): Whether to keep streaming queueing time KPIs (constant memory, see streamstats). Defaults to False.
+            raw_logs (bool, optional): Whether to keep the appointment log. Defaults to True.
+            crn_seed (_integer_, optional): Seed of the per-source random number streams (common random numbers across scenarios, see randomstreams). Defaults to None, i.e. streams seeded from the global random module.
+            snapshot (_WarmSnapshot_, optional): System state at the end of warm-up (see warm_up) to start the run from, instead of simulating the warm-up. Random numbers continue from the snapshot's streams. Defaults to None.
+            capacity_engine (str, optional): Slot capacity engine - 'resource' (simpy PriorityResource) or 'heap' (slot request heap, see slotheap). Defaults to 'resource'.
+            rng_block (int, optional): Number of random variates pre-sampled per block and source (see randomstreams). 0 for scalar draws from the global random module, unless crn_seed is given. Defaults to 4096.
+            figures (bool, optional): Whether run builds the replication chart (see chart). Defaults to True.
+            instrument (bool, optional): Whether to instrument the replication - events, processes, heap size, log and console output, time per phase (see instrument). Defaults to False.
+            trace_level (int, optional): Highest level of trace records kept - 1 audit, 2 patient pathway events, 3 slot unavailability (see tracing). Defaults to 0, i.e. no trace (unless g.debug, printed to console).
+            env (_simpy Environment_, optional): Environment shared with other models (e.g. clinics of a multiclinic.MultiClinicModel), run by its owner between start and finish. Not with snapshot or instrument. Defaults to None, i.e. own environment, run by run.
+            params (_dict_, optional): Other parameter values of this model, as g attribute -> value (e.g. {'prob_firstonly': 0.3, 'DNA_tra_pro': 0.1}), set before anything is built from them, with the values derived from them recomputed (see g.set_params). Parameters of the keyword arguments above (KWARG_PARAMS, e.g. number_of_slots - in_res) are set by those instead. Defaults to None.
         """
-        self.env = simpy.Environment() # instance of environment
-
-        self.g = g(in_res,in_inter_arrival,in_prob_pifu, in_path_horizon_y, audit_interval, repid = repid, in_FOavoidable = in_FOavoidable,in_interfu_perc=in_interfu_perc) # instance of global variables for this replication
+        if env is not None and (snapshot is not None or instrument):
+            raise ValueError("A shared environment cannot be used with a snapshot or instrumentation")
+        self.snapshot = snapshot
+        self.env = env if env is not None else simpy.Environment(initial_time=0 if snapshot is None else snapshot.time) # instance of environment
+
+        self.g = g(in_res,in_inter_arrival,in_prob_pifu, in_path_horizon_y, audit_interval, repid = repid, in_FOavoidable = in_FOavoidable,in_interfu_perc=in_interfu_perc,in_log_format=log_format,in_loglinesave=loglinesave) # instance of global variables for this replication
+        if params:
+            for name in params:
+                if name in KWARG_PARAMS:
+                    raise ValueError(f"Parameter '{name}' is set by the keyword argument {KWARG_PARAMS[name]}, not params")
+            self.g.set_params(params)
+
+        self.g.rng_block = rng_block
+        self.g.figures = figures
+        if snapshot is not None:
+            snapshot.check_params(self.g)
+            crn_seed = snapshot.crn_seed
+        # Random number streams, one per stochastic source, pre-sampled in blocks. Without common random numbers, seeded from the global random module (so random.seed() upstream still applies)
+        if crn_seed is None and self.g.rng_block and snapshot is None:
+            crn_seed = random.getrandbits(63)
+        self.rng = RandomStreams(crn_seed, repid, self.g.rng_block) if crn_seed is not None else PYTHON_RANDOM
 
         self.patient_counter = 0 # patient counter instantiated to 0
         self.block_counter = 0 # block counter instantiated to 0 (to control that right no of unavailable slots are enforced)
+        self.patients = {} # patients of this model still in their pathway (patient id -> patient)
+        self.next_arrival = None # time of next RTT patient arrival [days]
+        self.next_arrival_seq = None # scheduling order of next arrival (see timer_seq)
+        self.timer_seq = itertools.count() # scheduling order of patient and arrival timeouts - restored in this order, so that same-time events keep their order
+        self.on_discharge = None # callback(model, patient) at the end of each patient's pathway, e.g. cross-clinic referrals (see multiclinic)
+
+        # set up resources, i.e. appointment slot units (assume 1 unit - 15 min slot)
+        self.g.capacity_engine = capacity_engine
+        if self.g.capacity_engine == 'resource':
+            self.consultant = simpy.PriorityResource(self.env, capacity=self.g.number_of_slots)
+        elif self.g.capacity_engine == 'heap':
+            self.consultant = SlotHeap(self.env, self.g.number_of_slots)
+        else:
+            raise ValueError(f"Unknown capacity engine '{capacity_engine}' - use 'resource' or 'heap'")
 
-        self.consultant = simpy.PriorityResource(self.env, capacity=self.g.number_of_slots) # set up resources, i.e. appointment slot units (assume 1 unit - 15 min slot)
-
+        self.timings = {} # wall time [s] of run phases - simulation (incl. log writes), log_write, log_read, chart, summarise
         self.run_number = run_number # [integer] run number id
         self.savepath = savepath # [string] savepath
 
@@ -55,39 +115,101 @@ class rheum_Model:
         self.results_df["Q_Time_fuopa"] = [] # [running but deprecated]
         self.results_df.set_index("P_ID", inplace=True) # [running but deprecated]
 
-    def generate_wl_arrivals(self):
-        """A method that generates patients arriving for the RTT outpatient 'clinic'"""
+        self.g.stream_stats = stream_stats
+        self.g.raw_logs = raw_logs
+        self.stream_kpis = None # streaming queueing time KPIs, updated as each appointment is logged
+        if self.g.stream_stats:
+            self.stream_kpis = StreamingKPIs(self.g.repid, self.g.warm_duration, self.g.warm_duration + self.g.obs_duration,
+                                             self.g.stream_step, self.g.stream_window_tail, accuracy=self.g.stream_accuracy)
 
-        # Keep generating indefinitely (until the simulation ends)
-        while True:
-            # Increment the patient counter by 1
-            self.patient_counter += 1
+        # Event-log sinks: buffered and written out in chunks of g.log_chunk rows (if saving logs), or growing in-memory column stores
+        if self.g.loglinesave:
+            self.patient_log, self.appt_log, self.audit_log = [make_sink(self.g.log_format, self.savepath + LOGS[log][0], LOGS[log][1], self.g.log_chunk)
+                                                               for log in ['patient', 'appt', 'audit']]
+        else:
+            self.patient_log, self.appt_log, self.audit_log = [MemorySink(LOGS[log][1], self.g.log_chunk)
+                                                               for log in ['patient', 'appt', 'audit']]
+
+        # Time-weighted waiting list size per priority and slot utilisation over the final window, updated at each state change
+        self.time_weighted = TimeWeightedKPIs(self.g.repid, {'RTT_WL': (AUDIT_STATE.index('priority 3 patients waiting'), 1),
+                                                             'TFU_WL': (AUDIT_STATE.index('priority 1 patients waiting'), 1),
+                                                             'PIFU_WL': (AUDIT_STATE.index('priority 2 patients waiting'), 1),
+                                                             'utilisation': (AUDIT_STATE.index('resources occupied'), self.g.number_of_slots)},
+                                              self.g.warm_duration + self.g.obs_duration, self.g.stream_window_tail)
+
+        # Audited state (patients in system, waiting by priority, slots occupied), recorded at each change from the end of warm-up
+        self.audit = ChangePointAudit(self.env, self.audit_state, self.g.warm_duration, self.time_weighted)
+        if self.g.capacity_engine == 'heap':
+            self.consultant.on_change = self.audit.update # slots taken or freed by unavailability blocks
+
+        # Trace channel (records of audit and pathway events), None when off - trace points are then a single attribute check
+        self.g.trace_level = trace_level
+        self.tracer = make_tracer(self.g, self.savepath + f"trace_rep{self.g.repid}.bin")
+        if self.tracer is not None and self.g.capacity_engine == 'heap':
+            self.consultant.on_block = self.trace_block # slots taken by unavailability blocks
+
+        # Instrumentation of the replication (counters and timers on the event loop), None when off
+        self.g.instrument = instrument
+        self.instruments = None
+        if self.g.instrument:
+            self.instruments = Instrumentation(self.env, self.g.instrument_interval)
+            self.instruments.add_probe('patients', lambda: len(self.patients))
+            self.instruments.add_probe('patients_waiting', lambda: self.g.patients_waiting)
+            self.instruments.add_probe('log_rows', lambda: sum(log.rows_written + log.buffer.size for log in self.logs()))
+            self.instruments.add_probe('log_bytes', lambda: sum(log.bytes_written for log in self.logs()))
+
+    def generate_wl_arrivals(self, first_arrival=None):
+        """A method that generates patients arriving for the RTT outpatient 'clinic'
 
-            # Create a new patient - an instance of the FOPA_Patient
-            # class, and give the patient an ID determined by the patient
-            # counter, its PIFU prob, its follow-up tenor, its DNA probabilities
-            wp = FOPA_Patient(self.patient_counter,self.g.prob_pifu,self.g.max_fuopa_tenor, self.g.DNA_pifu_pro,self.g.DNA_tra_pro)
+        Args:
+            first_arrival (_double_, optional): Time of the first arrival [days], e.g. as drawn before a snapshot. Defaults to None, i.e. now.
+        """
 
-            # Add patient to dictionary of patients
-            FOPA_Patient.all_patients[wp.id] = wp
+        if first_arrival is not None:
+            yield self.env.timeout(first_arrival - self.env.now)
 
-            # Get the SimPy environment to run the attend_OPA method
-            # with this patient
-            self.env.process(self.attend_OPA(wp))
+        # Keep generating indefinitely (until the simulation ends)
+        while True:
+            self.add_patient()
 
             # Randomly sample the time to the next patient arriving for the
             # RTT outpatient 'clinic'.  The details of patient and pathway are stored in the g replication instance.
             #sampled_interarrival = int(np.round(random.expovariate(1.0 / self.g.wl_inter),0))
-            sampled_interarrival = random.expovariate(1.0 / self.g.wl_inter)
+            sampled_interarrival = self.rng.expovariate('arrivals', 1.0 / self.g.wl_inter)
+            self.next_arrival, self.next_arrival_seq = self.env.now + sampled_interarrival, next(self.timer_seq)
 
             # Freeze this function until that time has elapsed
             yield self.env.timeout(sampled_interarrival)
 
 
-    def obstruct_slot(self,unavail_timeperiod):
+    def add_patient(self):
+        """A method that adds a new RTT patient (an arrival, or a referral from another clinic) and starts its pathway now
+
+        Returns:
+            _FOPA_Patient class_: The new patient
+        """
+        # Increment the patient counter by 1
+        self.patient_counter += 1
+
+        # Create a new patient - an instance of the FOPA_Patient
+        # class, and give the patient an ID determined by the patient
+        # counter, its PIFU prob, its follow-up tenor, its DNA probabilities
+        wp = FOPA_Patient(self.patient_counter,self.g.prob_pifu,self.g.max_fuopa_tenor, self.g.DNA_pifu_pro,self.g.DNA_tra_pro,self.rng)
+
+        # Add patient to dictionary of patients in the system
+        self.patients[wp.id] = wp
+        self.audit.update()
+
+        # Get the SimPy environment to run the attend_OPA method
+        # with this patient
+        self.env.process(self.attend_OPA(wp))
+        return wp
+
+    def obstruct_slot(self,slot_block,unavail_timeperiod): # pylint: disable=unused-argument
         """  A method to obstruct a single slot (emulate unavailability)
 
         Args:
+            slot_block (_patient_blocker class_): The ghost patient blocking the slot.
             unavail_timeperiod (_type_): Time that the slot is obstructed.
 
         Yields:
@@ -102,9 +224,22 @@ class rheum_Model:
             # Freeze the function until the request can be met (this
             # ensures that the slot will finish before becoming unavailabe)
             yield req
+            self.audit.update()
+            if self.tracer is not None:
+                self.trace_block(self.env.now + unavail_timeperiod)
 
             yield self.env.timeout(unavail_timeperiod)
 
+        self.audit.update() # slot released
+
+    def trace_block(self, end):
+        """ A method to trace a slot taken by unavailability (by a blocker process, or a block of the slot heap) until the end of the block
+
+        Args:
+            end (_double_): Time the slot is blocked until [days]
+        """
+        self.tracer.emit('slot_blocked', self.env.now, self.consultant.count, v=end)
+
     def obstruct_slots(self):
         """ A method to obstruct multiple slots (emulate unavailability)"""
 
@@ -123,10 +258,6 @@ class rheum_Model:
                 # Get the SimPy environment to run the obstruct_slot method with this slot block
                 self.env.process(self.obstruct_slot(slot_block,self.g.unavail_shock_period))
 
-                if self.g.debug and self.g.debuglevel>=3:
-                    print ("Appointment will not be able to book at",
-                           f"{self.env.now + self.g.unavail_freq_slot:.1f}")
-
         # If unavailability is periodic
         else:
 
@@ -141,10 +272,6 @@ class rheum_Model:
                     # Get the SimPy environment to run the obstruct_slot method with this slot block
                     self.env.process(self.obstruct_slot(slot_block,self.g.unavail_slot))
 
-                    if self.g.debug and self.g.debuglevel>=3:
-                        print ("Appointment will not be able to book at",
-                               f"{self.env.now + self.g.unavail_freq_slot:.1f}")
-
                 # Freeze the function for the time period during which no unavailability
                 yield self.env.timeout(self.g.unavail_freq_slot)
 
@@ -164,25 +291,83 @@ class rheum_Model:
         # If first-only AND avoidance from A&G AND past warm-up period
         if patient.type == "First-only" and patient.FOavoided and self.env.now > self.g.warm_duration:
             # if first-only pathway and avoidable through A&G and current day within intervention/study period, skip anything further for patient
-            if self.g.debug and self.g.debuglevel>=2:
-                print(f"Patient {patient.id} had first outpatient avoided. Not added to log.")
+            if self.tracer is not None:
+                self.tracer.emit('first_avoided', self.env.now, patient.id)
 
         # ELSE
         else:
 
-            ############################################
-            ### First outpatient appointment ####
-            ############################################
-
             # Record the time the patient started queuing for the first outpatient
-            start_q_fopa = self.env.now
+            patient.start_q = self.env.now
             self.g.appt_counter +=1 # increment
-            patient.ls_appt.append(self.g.appt_counter) # append
+            patient.appt_id = self.g.appt_counter # latest appointment id
             self.g.patients_waiting += 1 # increment
             self.g.patients_waiting_by_priority[patient.priority-1] += 1 # increment
+            self.audit.update()
+            patient.stage = 'first_queue'
+
+            yield from self.first_appointment(patient) # First outpatient appointment
+            yield from self.follow_ups(patient) # Traditional and/or PIFU follow-up appointments
+
+        self.discharge(patient)
+
+    def resume_OPA(self, patient):
+        """    A method that continues the pathway of a patient restored from a snapshot, from the stage it was at.
+
+        Stages: 'first_queue'/'first_appt' (queuing for / in first appointment), 'tfu_wait'/'tfu_queue'/'tfu_appt'
+        (until / queuing for / in traditional follow-up) and 'pifu_wait'/'pifu_queue'/'pifu_appt' (same, PIFU).
+
+        Args:
+            patient (_FOPA_Patient class_): A restored patient, with its stage, wait end time (wake) and queue start time
+        """
+        if patient.stage.startswith('first'):
+            yield from self.first_appointment(patient, in_service=patient.stage == 'first_appt')
+            yield from self.follow_ups(patient)
+        else:
+            yield from self.follow_ups(patient, patient.stage)
+
+        self.discharge(patient)
 
-            # Request a slot
-            with self.consultant.request(priority = patient.priority + patient.RTT_sub) as req:
+    def patient_timeout(self, patient, stage, delay):
+        """ A method to freeze a patient's pathway for a time, recording its stage, when the timeout ends and in which order it was scheduled (for snapshots)
+
+        Args:
+            patient (_FOPA_Patient class_): Patient
+            stage (_string_): Pathway stage during the timeout (e.g. 'tfu_wait', see resume_OPA)
+            delay (_double_): Duration [days]
+
+        Returns:
+            _simpy Timeout_: the timeout event
+        """
+        patient.stage, patient.wake, patient.wake_seq = stage, self.env.now + delay, next(self.timer_seq)
+        return self.env.timeout(delay)
+
+    def discharge(self, patient):
+        """ A method to remove a patient at the end of its pathway"""
+        # Delete patient (removal from patient dictionary removes only
+            # reference to patient and Python then automatically cleans up)
+        del self.patients[patient.id]
+        self.audit.update()
+        if self.on_discharge is not None:
+            self.on_discharge(self, patient)
+
+    def first_appointment(self, patient, in_service=False):
+        """    A method that models the first outpatient appointment: queuing for a slot (from patient.start_q) and attending it.
+
+        Args:
+            patient (_FOPA_Patient class_): Patient, already counted as waiting
+            in_service (bool, optional): Whether the (restored) patient already holds its slot, until patient.wake. Defaults to False.
+        """
+
+        ############################################
+        ### First outpatient appointment ####
+        ############################################
+
+        # Request a slot
+        with self.consultant.request(priority = patient.priority + patient.RTT_sub) as req:
+            patient.req = req
+
+            if not in_service: # (restored slot holders hold theirs already)
                 # Freeze the function until the request for a slot can be met
                 yield req
 
@@ -201,238 +386,233 @@ class rheum_Model:
                 # reduce patients waiting counts
                 self.g.patients_waiting_by_priority[patient.priority-1] -= 1 # decrement
                 self.g.patients_waiting -= 1 # decrement
+                self.audit.update() # (slot taken too)
 
                 # Record the time the patient finished queuing for a consultant
-                end_q_fopa = self.env.now
+                patient.end_q_fopa = self.env.now
 
                  # Calculate the time this patient spent queuing for the consultant (FU) and
                 # store in the patient's attribute
-                patient.q_time_fopa = end_q_fopa - start_q_fopa
+                patient.q_time_fopa = patient.end_q_fopa - patient.start_q
 
-                if self.g.debug and self.g.debuglevel>=2:
-                    print(f"Req {patient.ls_appt[-1]}: Patient {patient.id} queued {np.round(patient.q_time_fopa,2)} days for 1st app. Priority {patient.priority}")
+                if self.tracer is not None:
+                    self.tracer.emit('first_queued', self.env.now, patient.id, patient.appt_id, patient.priority, v=patient.q_time_fopa)
 
                 # Freeze this function until the day time unit has elapsed
                 #yield self.env.timeout(1) # freeze for one time-unit (a day) - that same slot will only be available the next day
-                yield self.env.timeout(2) # freeze for two time-units (two dayz) - that same slot will only be available in two days (simplification/ discretisation to deal with first outpatient being ~30 min, so 2 of our slot units)
+                yield self.patient_timeout(patient, 'first_appt', 2) # freeze for two time-units (two dayz) - that same slot will only be available in two days (simplification/ discretisation to deal with first outpatient being ~30 min, so 2 of our slot units)
+            else:
+                self.audit.update() # (restored slot taken)
+                yield self.patient_timeout(patient, patient.stage, patient.wake - self.env.now) # remainder of appointment
 
-                patient.decision_DNA_tradtion() # Decide whether this is a DNA or not
+            patient.decision_DNA_tradtion() # Decide whether this is a DNA or not
 
-                if patient.tradition_dna:
-                    if self.g.debug and self.g.debuglevel>=2:
-                        print(f" Patient {patient.id} queued {np.round(patient.q_time_fopa,2)} days for 1st app. Priority {patient.priority} but didn't attend the appointment")
+            if self.tracer is not None:
+                self.tracer.emit('first_dna' if patient.tradition_dna else 'first_attended', self.env.now, patient.id, patient.appt_id, patient.priority, v=patient.q_time_fopa)
 
-                else:
-                    if self.g.debug and self.g.debuglevel>=2:
-                        print(f" Patient {patient.id} queued {np.round(patient.q_time_fopa,2)} days for 1st app. Priority {patient.priority}")
+            # Add line to appointment log (saved to file or held in memory, depending on sink)
+            self.log_appointment([patient.id, patient.appt_id,patient.priority,patient.apptype,patient.type,patient.q_time_fopa,patient.start_q,patient.tradition_dna,self.g.repid])
 
-                # Line/list to add to appointment log held in memory (df) or saved (csv)
-                patient.ls_appt_to_add = [patient.id, patient.ls_appt[-1],patient.priority,patient.apptype,patient.type,patient.q_time_fopa,start_q_fopa,patient.tradition_dna,self.g.repid]
-                patient.ls_patient_to_add = [patient.id , patient.q_time_fopa,999,self.g.repid] # deprecated
+            if patient.start_q > self.g.warm_duration: # don't save things in warm-up period
+                self.patient_log.append([patient.id , patient.q_time_fopa,999,self.g.repid]) # deprecated
 
-                # Whether to save each log line or hold in memory by appending
-                if self.g.loglinesave:
+        self.audit.update() # slot released
+        patient.give_tfu_priority() # Assign traditional follow-up priority to subsequent requests
 
-                    with open(self.savepath +"appt_result.csv", "a",encoding="cp1252") as f:
-                        writer = csv.writer(f, delimiter=",")
-                        writer.writerow(patient.ls_appt_to_add)
+    def follow_ups(self, patient, stage=None):
+        """    A method that models the follow-up appointments of a pathway: traditional, then PIFU if the patient is triaged to it.
 
-                    if start_q_fopa > self.g.warm_duration: # don't save things in warm-up period
-                        with open(self.savepath +"patient_result2.csv", "a",encoding="cp1252") as f:
-                            writer = csv.writer(f, delimiter=",")
-                            writer.writerow(patient.ls_patient_to_add)
+        Args:
+            patient (_FOPA_Patient class_): Patient, after its first appointment
+            stage (_string_, optional): Stage of a restored patient to resume from (see resume_OPA). Defaults to None, i.e. start of follow-up.
+        """
 
-                else:
-                    patient.df_appt_to_add = pd.DataFrame( columns = ["P_ID","App_ID","priority","type","pathway","q_time","start_q","DNA","rep"] ,
-                                                          data=[patient.ls_appt_to_add]) # row list to row dataframe
-                    patient.df_appt_to_add.set_index("App_ID", inplace=True)
-                    self.g.appt_queuing_results=self.g.appt_queuing_results.append(patient.df_appt_to_add)
+        if stage is None or stage.startswith('tfu'):
+            yield from self.traditional_follow_ups(patient, stage)
+            stage = None
 
-                    df_to_add = pd.DataFrame( columns = ["P_ID","Q_time_fopa","Q_time_fuopa","rep"], data =[patient.ls_patient_to_add])
-                    df_to_add.set_index("P_ID", inplace=True)
-                    if start_q_fopa > self.g.warm_duration: # don't save things in warm-up period
-                        self.results_df = self.results_df.append(df_to_add)
+        # If patient is PIFU pathway assigned (will only get to this portion of code if 'break' from traditional appointment cycle)
+        if patient.topifu:
 
-            patient.give_tfu_priority() # Assign traditional follow-up priority to subsequent requests
+            if stage is None:
+                if self.tracer is not None:
+                    self.tracer.emit('to_pifu', self.env.now, patient.id, d=patient.used_fuopa)
 
-            ############################################
-            ### Traditional Follow-up appointments ####
-            ############################################
+                patient.give_pifu_priority() # Assign PIFU priority to all further slot requests
+                #print(f"Patient {patient.id} entered PIFU. Has {patient.used_fuopa} traditional apps. Priority {patient.priority}")
+
+            yield from self.pifu_follow_ups(patient, stage)
+
+        else:
+            if self.tracer is not None:
+                self.tracer.emit('not_pifu', self.env.now, patient.id, d=patient.used_fuopa)
+
+    def traditional_follow_ups(self, patient, stage=None):
+        """    A method that models the traditional follow-up appointment cycle, until the pathway horizon or PIFU.
+
+        Args:
+            patient (_FOPA_Patient class_): Patient, after its first appointment
+            stage (_string_, optional): Stage of a restored patient to resume from ('tfu_wait', 'tfu_queue' or 'tfu_appt'). Defaults to None.
+        """
+
+        ############################################
+        ### Traditional Follow-up appointments ####
+        ############################################
 
-            while self.env.now - end_q_fopa < patient.max_fuopa_tenor: # While within pathway horizon / tenor
-            #while patient.used_fuopa < patient.max_fuopa:
+        while stage is not None or self.env.now - patient.end_q_fopa < patient.max_fuopa_tenor: # While within pathway horizon / tenor (already checked if resuming)
+        #while patient.used_fuopa < patient.max_fuopa:
 
+            if stage is None:
                 # Determine time till next needing F/U
                 #sampled_interfu_duration = int(random.expovariate(1.0 / g.mean_interOPA)) # integer only (days)
-                sampled_interfu_duration = int(random.triangular(g.interOPA_tri[0],g.interOPA_tri[1],g.interOPA_tri[2]))
+                sampled_interfu_duration = int(self.rng.triangular('interfu', self.g.interOPA_tri[0],self.g.interOPA_tri[1],self.g.interOPA_tri[2]))
                 # Freeze this function until time has elapsed
-                yield self.env.timeout(sampled_interfu_duration)
+                yield self.patient_timeout(patient, 'tfu_wait', sampled_interfu_duration)
+            elif stage == 'tfu_wait':
+                yield self.patient_timeout(patient, patient.stage, patient.wake - self.env.now) # remainder of wait
 
+            if stage in (None, 'tfu_wait'):
                 self.g.patients_waiting += 1 # increment
                 self.g.patients_waiting_by_priority[patient.priority-1] += 1 # increment
+                self.audit.update()
                 patient.used_fuopa+=1 # count the follow-up outpatient
 
                 self.g.appt_counter +=1 # increment
-                patient.ls_appt.append(self.g.appt_counter) # append
-                start_q_fuopa = self.env.now # current time
-                # Request a slot for follow-up
-                with self.consultant.request(priority = patient.priority) as req:
+                patient.appt_id = self.g.appt_counter # latest appointment id
+                patient.start_q = self.env.now # current time
+                patient.stage = 'tfu_queue'
+
+            # Request a slot for follow-up
+            with self.consultant.request(priority = patient.priority) as req:
+                patient.req = req
+
+                if stage != 'tfu_appt':
                     # Freeze the function until the request for a slot can be met
                     yield req
 
                     # reduce patients waiting counts
                     self.g.patients_waiting_by_priority[patient.priority-1] -= 1 # decrement
                     self.g.patients_waiting -= 1
+                    self.audit.update() # (slot taken too)
 
                     # Record the time the patient finished queuing for a follow-up slot
                     end_q_fuopa = self.env.now
 
                     # Calculate the time this patient spent queuing for a slot and
                     # store in the patient's attribute
-                    patient.q_times_fuopa.append(end_q_fuopa - start_q_fuopa) # add latest followup
-                    #print(patient.q_time_fuopa)
-
                     if patient.used_fuopa ==1 : # deprecated, not relevant
-                        patient.q_time_fuopa = end_q_fuopa - start_q_fuopa
+                        patient.q_time_fuopa = end_q_fuopa - patient.start_q
 
                     patient.decision_DNA_tradtion() # Determine DNA fate
-                    if patient.tradition_dna:
-                        if self.g.debug  and self.g.debuglevel>=2:
-                            print(f"Req {patient.ls_appt[-1]}: Patient {patient.id} queued {np.round(end_q_fuopa - start_q_fuopa,2)} for app {patient.used_fuopa}. Priority {patient.priority}")
-                    else:
-                        if self.g.debug  and self.g.debuglevel>=2:
-                            print(f"Req {patient.ls_appt[-1]}: Patient {patient.id} queued {np.round(end_q_fuopa - start_q_fuopa,2)} for app {patient.used_fuopa}. Priority {patient.priority} but DNAd")
+                    if self.tracer is not None:
+                        self.tracer.emit('tfu_dna' if patient.tradition_dna else 'tfu_attended', self.env.now, patient.id, patient.appt_id, patient.priority,
+                                         patient.used_fuopa, end_q_fuopa - patient.start_q)
 
 
                     # Freeze this function until the day time unit has elapsed
-                    yield self.env.timeout(1) # freeze for one time-unit (a day) - that same slot will only be available the next day
-
-
-                    # Add to appointment log or save
-                    patient.ls_appt_to_add = [patient.id, patient.ls_appt[-1],patient.priority,"Traditional",patient.type,patient.q_time_fuopa,start_q_fuopa,patient.tradition_dna,self.g.repid]
-                    if self.g.loglinesave:
-                        with open(self.savepath +"appt_result.csv", "a",encoding="cp1252") as f:
-                            writer = csv.writer(f, delimiter=",")
-                            writer.writerow(patient.ls_appt_to_add)
-
-                    else:
-                        patient.df_appt_to_add = pd.DataFrame( columns = ["P_ID","App_ID","priority","type","pathway","q_time","start_q","DNA","rep"] ,
-                                                              data=[patient.ls_appt_to_add])
-                        patient.df_appt_to_add.set_index("App_ID", inplace=True)
-                        self.g.appt_queuing_results=self.g.appt_queuing_results.append(patient.df_appt_to_add)
-
+                    yield self.patient_timeout(patient, 'tfu_appt', 1) # freeze for one time-unit (a day) - that same slot will only be available the next day
+                else:
+                    self.audit.update() # (restored slot taken)
+                    yield self.patient_timeout(patient, patient.stage, patient.wake - self.env.now) # remainder of appointment
 
-                # If current simulation time is beyond warm-up , and if current time exceeds timing for PIFU eligilibity to be adequate for this patient / pathway
-                if self.env.now - end_q_fopa > self.g.t_decision  and self.env.now > self.g.warm_duration:
-                    # if patient is PIFU pathway assigned, 'break' from traditional appointments to enable PIFU appointment cycle below
-                    if patient.topifu:
-                        break
 
+                # Add to appointment log (saved or in memory)
+                self.log_appointment([patient.id, patient.appt_id,patient.priority,"Traditional",patient.type,patient.q_time_fuopa,patient.start_q,patient.tradition_dna,self.g.repid])
 
-            # If patient is PIFU pathway assigned (will only get to this portion of code if 'break' from traditional appointment cycle)
-            if patient.topifu:
+            self.audit.update() # slot released
+            stage = None
 
-                if self.g.debug  and self.g.debuglevel>=2:
-                    print(f"Patient {patient.id} PIFU. Follows {patient.used_fuopa} traditional apps.")
+            # If current simulation time is beyond warm-up , and if current time exceeds timing for PIFU eligilibity to be adequate for this patient / pathway
+            if self.env.now - patient.end_q_fopa > self.g.t_decision  and self.env.now > self.g.warm_duration:
+                # if patient is PIFU pathway assigned, 'break' from traditional appointments to enable PIFU appointment cycle below
+                if patient.topifu:
+                    break
 
-                patient.give_pifu_priority() # Assign PIFU priority to all further slot requests
-                #print(f"Patient {patient.id} entered PIFU. Has {patient.used_fuopa} traditional apps. Priority {patient.priority}")
+    def pifu_follow_ups(self, patient, stage=None):
+        """    A method that models the PIFU appointment cycle, until the pathway horizon.
 
-                while patient.topifu: # while true (indefinitely while simulation running, will break if not within follow-up horizon)
+        Args:
+            patient (_FOPA_Patient class_): Patient, on PIFU priority
+            stage (_string_, optional): Stage of a restored patient to resume from ('pifu_wait', 'pifu_queue' or 'pifu_appt'). Defaults to None.
+        """
 
-                    patient.used_fuopa+=1 # count the follow-up outpatient
-                    # Determine time till next needing PIF/U
-                    sampled_interpifu_duration = int(np.round(random.expovariate(1.0 / self.g.mean_interPIFU),0)) # integer only (days)
-                    # Freeze this function until time has elapsed (inter-pifu)
-                    yield self.env.timeout(sampled_interpifu_duration)
+        while patient.topifu: # while true (indefinitely while simulation running, will break if not within follow-up horizon)
 
-                    self.g.appt_counter +=1 # increment
-                    patient.ls_appt.append(self.g.appt_counter) # append
-                    self.g.patients_waiting += 1 # increment
-                    self.g.patients_waiting_by_priority[patient.priority-1] += 1 # increment
+            if stage is None:
+                patient.used_fuopa+=1 # count the follow-up outpatient
+                # Determine time till next needing PIF/U
+                sampled_interpifu_duration = int(np.round(self.rng.expovariate('interpifu', 1.0 / self.g.mean_interPIFU),0)) # integer only (days)
+                # Freeze this function until time has elapsed (inter-pifu)
+                yield self.patient_timeout(patient, 'pifu_wait', sampled_interpifu_duration)
+            elif stage == 'pifu_wait':
+                yield self.patient_timeout(patient, patient.stage, patient.wake - self.env.now) # remainder of wait
+
+            if stage in (None, 'pifu_wait'):
+                self.g.appt_counter +=1 # increment
+                patient.appt_id = self.g.appt_counter # latest appointment id
+                self.g.patients_waiting += 1 # increment
+                self.g.patients_waiting_by_priority[patient.priority-1] += 1 # increment
+                self.audit.update()
 
+                patient.start_q = self.env.now
+                patient.stage = 'pifu_queue'
 
-                    start_q_pifuopa = self.env.now
-                    # Request slit
-                    with self.consultant.request(priority = patient.priority) as req:
-                        # Freeze the function until the request for a slot can be met
-                        yield req
+            # Request slit
+            with self.consultant.request(priority = patient.priority) as req:
+                patient.req = req
 
-                        # reduce patients waiting counts
-                        self.g.patients_waiting_by_priority[patient.priority-1] -= 1 # decrement
-                        self.g.patients_waiting -= 1 # decrement
+                if stage != 'pifu_appt':
+                    # Freeze the function until the request for a slot can be met
+                    yield req
 
-                        # Record the time the patient finished queuing for a consultant
-                        end_q_pifuopa = self.env.now
+                    # reduce patients waiting counts
+                    self.g.patients_waiting_by_priority[patient.priority-1] -= 1 # decrement
+                    self.g.patients_waiting -= 1 # decrement
+                    self.audit.update() # (slot taken too)
 
-                        # Calculate the time this patient spent queuing for a consultant and
-                        # store in the patient's attribute
-                        patient.q_time_pifuopa = end_q_pifuopa - start_q_pifuopa
+                    # Calculate the time this patient spent queuing for a consultant and
+                    # store in the patient's attribute
+                    patient.q_time_pifuopa = self.env.now - patient.start_q
 
-                        # Freeze this function until the day time unit has elapsed
-                        yield self.env.timeout(1) # freeze for one time-unit (a day) - that same slot will only be available the next day
+                    # Freeze this function until the day time unit has elapsed
+                    yield self.patient_timeout(patient, 'pifu_appt', 1) # freeze for one time-unit (a day) - that same slot will only be available the next day
+                else:
+                    self.audit.update() # (restored slot taken)
+                    yield self.patient_timeout(patient, patient.stage, patient.wake - self.env.now) # remainder of appointment
 
-                        patient.decision_DNA_pifu() # Determine DNA status of appointment
-                        if patient.pifu_dna:
-                            if self.g.debug  and self.g.debuglevel>=2:
-                                print(f"Req {patient.ls_appt[-1]}: Patient {patient.id} queued {np.round(patient.q_time_pifuopa,2)} days for app {patient.used_fuopa} - PIFU. Priority {patient.priority} but did not attend")
-                        else:
-                            if self.g.debug  and self.g.debuglevel>=2:
-                                print(f"Req {patient.ls_appt[-1]}: Patient {patient.id} queued {np.round(patient.q_time_pifuopa,2)} days for app {patient.used_fuopa} - PIFU. Priority {patient.priority}")
+                patient.decision_DNA_pifu() # Determine DNA status of appointment
+                if self.tracer is not None:
+                    self.tracer.emit('pifu_dna' if patient.pifu_dna else 'pifu_attended', self.env.now, patient.id, patient.appt_id, patient.priority,
+                                     patient.used_fuopa, patient.q_time_pifuopa)
 
 
-                        # Add to appointment log or save
-                        patient.ls_appt_to_add = [patient.id, patient.ls_appt[-1],patient.priority,"PIFU",patient.type,end_q_pifuopa - start_q_pifuopa,start_q_pifuopa,patient.pifu_dna,self.g.repid]
-                        if self.g.loglinesave:
-                            with open(self.savepath +"appt_result.csv", "a",encoding="cp1252") as f:
-                                writer = csv.writer(f, delimiter=",")
-                                writer.writerow(patient.ls_appt_to_add)
+                # Add to appointment log (saved or in memory)
+                self.log_appointment([patient.id, patient.appt_id,patient.priority,"PIFU",patient.type,patient.q_time_pifuopa,patient.start_q,patient.pifu_dna,self.g.repid])
 
-                        else:
-                            patient.df_appt_to_add = pd.DataFrame( columns = ["P_ID","App_ID","priority","type","pathway","q_time","start_q","DNA","rep"] ,
-                                                                  data=[patient.ls_appt_to_add])
-                            patient.df_appt_to_add.set_index("App_ID", inplace=True)
-                            self.g.appt_queuing_results=self.g.appt_queuing_results.append(patient.df_appt_to_add)
+            self.audit.update() # slot released
+            stage = None
 
-                    # break if time elapsed since first appointment exceeds follow-up horizon
-                    if self.env.now - end_q_fopa > patient.max_fuopa_tenor:
-                        break
+            # break if time elapsed since first appointment exceeds follow-up horizon
+            if self.env.now - patient.end_q_fopa > patient.max_fuopa_tenor:
+                break
 
-            else:
-                if self.g.debug  and self.g.debuglevel>=2:
-                    print(f"Patient {patient.id} not PIFU. Follows {patient.used_fuopa} traditional apps.")
 
+    def log_appointment(self, appt):
+        """Add an appointment (row as in the appointment log) to the log and/or the streaming KPIs
 
-            # Delete patient (removal from patient dictionary removes only
-                # reference to patient and Python then automatically cleans up)
-            del FOPA_Patient.all_patients[patient.id]
-
+        Args:
+            appt (_list_): P_ID, Appt_ID, priority, type, pathway, q_time, start_q, DNA, rep
+        """
+        if self.g.raw_logs:
+            self.appt_log.append(appt)
+        if self.stream_kpis is not None:
+            self.stream_kpis.update(appt[2], appt[5], appt[6])
 
 
     def build_audit_results(self):
-        """Compiles single run audit results into single dataframe held in g.results """
-
-        self.g.results['time'] = self.g.audit_time
-
-        self.g.results['patients in system'] = (
-            self.g.audit_patients_in_system)
-
-        self.g.results['all patients waiting'] = (
-            self.g.audit_patients_waiting)
-
-        self.g.results['priority 1 patients waiting'] = (
-            self.g.audit_patients_waiting_p1)
-
-        self.g.results['priority 2 patients waiting'] = (
-            self.g.audit_patients_waiting_p2)
-
-        self.g.results['priority 3 patients waiting'] = (
-            self.g.audit_patients_waiting_p3)
+        """Compiles single run audit results (in-memory audit log) into single dataframe held in g.results """
 
-        self.g.results['resources occupied'] = (
-            self.g.audit_resources_used)
-
-        self.g.results['rep']=self.g.repid
+        self.g.results = self.audit_log.to_frame()
 
 
     def calculate_mean_q_time(self):
@@ -452,12 +632,20 @@ class rheum_Model:
                                 self.mean_q_time_total['Q_time_fopa'],
                                 self.mean_q_time_total['Q_time_fuopa'],
                                 self.mean_q_time_total['Q_Time_total']]
-            print(results_to_write)
+            if self.g.debug:
+                print(results_to_write)
             writer.writerow(results_to_write)
 
 
-    def chart(self):
-        """ Plot results relevant to one run """
+    def chart(self, max_rows=None):
+        """ Plot results relevant to one run
+
+        Args:
+            max_rows (int, optional): Maximum number of appointments in the queueing time violin plot (a random sample beyond it). Defaults to None, i.e. all.
+        """
+        import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+        import seaborn as sns # pylint: disable=import-outside-toplevel
+
         # plot results at end of run #
         self.results_df = self.results_df.sort_index()
         #self.g.appt_queuing_results = self.g.appt_queuing_results.sort_values(by=['start_q'])
@@ -500,12 +688,16 @@ class rheum_Model:
         di = {1:"Follow-up", 2:"Follow-up",3:"RTT"}
         step = 365
         mon_appointments = self.g.appt_queuing_results
+        if max_rows is not None and len(mon_appointments) > max_rows:
+            mon_appointments = mon_appointments.sample(max_rows, random_state=0) # downsample for the violin plot
+        mon_appointments = mon_appointments.copy()
         mon_appointments['interval'] = np.round(((mon_appointments['start_q']+mon_appointments['q_time'])//step)*step,0)
         mon_appointments['ttype']=mon_appointments['priority']
         mon_appointments.replace({"ttype": di},inplace=True)
         ax32 = fig.add_subplot(2,4,3)
-        sns.violinplot(ax=ax32,x='interval',y='q_time',data=mon_appointments,hue='ttype',palette="Set2",split=False)
-        ax32.set_xticklabels(ax32.get_xticklabels(),rotation = 30)
+        if len(mon_appointments): # no appointment log if raw_logs off
+            sns.violinplot(ax=ax32,x='interval',y='q_time',data=mon_appointments,hue='ttype',palette="Set2",split=False)
+            ax32.set_xticklabels(ax32.get_xticklabels(),rotation = 30)
 
 
         # Figure 4: Staff usage
@@ -602,54 +794,154 @@ class rheum_Model:
 
         return text, quant
 
-    def perform_audit(self):
-        """Monitors modelled system at regular intervals (as defined by audit interval in self.g)"""
+    def audit_state(self):
+        """Audited state: patients in system, patients waiting (all and by priority) and resources occupied (see auditrecorder.AUDIT_STATE)"""
+        waiting = self.g.patients_waiting_by_priority
+        return (len(self.patients), self.g.patients_waiting, waiting[0], waiting[1], waiting[2], self.consultant.count)
 
-        # Delay before first aurdit if length of warm-up
-        yield self.env.timeout(self.g.warm_duration)
+    def audit_grid(self):
+        """Audit timepoints: every audit interval from the end of warm-up to the end of the run [days]"""
+        return np.arange(self.g.warm_duration, self.g.warm_duration + self.g.obs_duration, self.g.audit_interval)
 
-        # The trigger repeated audits
-        while True:
-            # Record time
-            self.g.audit_time.append(self.env.now)
-            if self.g.debug  and self.g.debuglevel>=1:
-                print("")
-                print(f"-- Audit Day {self.g.audit_time[-1]}")
-                print(f"--- Patients waiting: First: {self.g.patients_waiting_by_priority[2]}, PIFU: {self.g.patients_waiting_by_priority[1]}, Traditional: {self.g.patients_waiting_by_priority[0]}")
-                print(f"--- Slots used: {self.consultant.count}")
-                print("--")
-
-            ## alternative with save to file
-            if self.g.loglinesave:
-                ls_audit_to_add = [self.env.now, len(FOPA_Patient.all_patients), self.g.patients_waiting, self.g.patients_waiting_by_priority[0], self.g.patients_waiting_by_priority[1], self.g.patients_waiting_by_priority[2],self.consultant.count,self.g.repid]
-                with open(self.savepath +"batch_mon_audit_ls.csv", "a",encoding="cp1252") as f:
-                    writer = csv.writer(f, delimiter=",")
-                    writer.writerow(ls_audit_to_add)
+    def audit_frame(self, grid=None):
+        """Audited state resampled to any audit grid after the run (as the audit log rows)
 
-            else:
-                #Record patients waiting by referencing global variables
-                self.g.audit_patients_waiting.append(self.g.patients_waiting)
+        Args:
+            grid (_array_, optional): Audit times [days], from the end of warm-up. Defaults to None, i.e. audit_grid().
 
-                (self.g.audit_patients_waiting_p1.append
-                  (self.g.patients_waiting_by_priority[0]))
+        Returns:
+            _dataframe_: time, patients in system, patients waiting (all and by priority), resources occupied and rep
+        """
+        grid = self.audit_grid() if grid is None else np.asarray(grid, dtype=float)
+        frame = pd.DataFrame(self.audit.resample(grid).astype(np.int64), columns=list(AUDIT_STATE))
+        frame.insert(0, 'time', grid)
+        frame['rep'] = self.g.repid
+        return frame
+
+    def audit_averages(self, edges):
+        """Time-averaged audited state over intervals after the run (exact, see auditrecorder)
+
+        Args:
+            edges (_array_): Interval edges [days], increasing, from the end of warm-up
+
+        Returns:
+            _dataframe_: start and end of each interval, time-averaged patients in system, patients waiting (all and by priority), resources occupied, and rep
+        """
+        edges = np.asarray(edges, dtype=float)
+        frame = pd.DataFrame(self.audit.time_average(edges), columns=list(AUDIT_STATE))
+        frame.insert(0, 'start', edges[:-1])
+        frame.insert(1, 'end', edges[1:])
+        frame['rep'] = self.g.repid
+        return frame
+
+    def write_audit(self):
+        """Monitors modelled system at regular intervals (as defined by audit interval in self.g): the recorded state
+        (see auditrecorder) resampled to the audit timepoints, added to the audit log after the run"""
+        grid = self.audit_grid()
+        self.g.audit_time = grid.tolist()
+        for t, state in zip(self.g.audit_time, self.audit.resample(grid).astype(int).tolist()):
+            if self.tracer is not None:
+                self.tracer.emit('audit', t, state[4], state[3], state[2], state[5])
+            # Record patients in system (length of dictionary of patients in the system), patients waiting (all and by priority) and resources occupied (consultant)
+            self.audit_log.append([t, *state, self.g.repid]) # saved or in memory
+
+
+    def warm_up(self):
+        """  Simulate the warm-up period only, and take a snapshot of the system state at its end.
+
+        Scenarios that differ only in post warm-up interventions (PIFU, A&G) can then start from the snapshot
+        (rheum_Model(..., snapshot=...)) instead of each simulating the same warm-up.
+
+        Returns:
+            _WarmSnapshot_: System state at the end of warm-up
+        """
+        if self.g.unavail_on:
+            raise ValueError("Warm-up snapshots are not supported with resource unavailability (g.unavail_on)")
 
-                (self.g.audit_patients_waiting_p2.append
-                  (self.g.patients_waiting_by_priority[1]))
+        self.env.process(self.generate_wl_arrivals())
+        self.env.run(until=self.g.warm_duration)
 
-                (self.g.audit_patients_waiting_p3.append
-                  (self.g.patients_waiting_by_priority[2]))
+        snapshot = self.take_snapshot()
+        self.close_logs()
+        return snapshot
 
-                # Record patients waiting by asking length of dictionary of all patients
-                # (another way of doing things)
-                self.g.audit_patients_in_system.append(len(FOPA_Patient.all_patients))
-                # Record resources occupied (consultant)
-                self.g.audit_resources_used.append(self.consultant.count)
+    def take_snapshot(self):
+        """  Capture the current system state: patients (in slot, queuing in queue order, or waiting with their remaining timers),
+        counters, next arrival and random number stream state.
+
+        Returns:
+            _WarmSnapshot_: System state now
+        """
+        queue_position = {id(req): i for i, req in enumerate(self.consultant.queue)}
+
+        def restore_order(patient):
+            # patients in a timeout (appointment or wait) in the order their timeouts were scheduled, then queuing patients in queue order
+            if patient.stage.endswith('_queue'):
+                return (1, queue_position[id(patient.req)])
+            return (0, patient.wake_seq)
+
+        patients = sorted(self.patients.values(), key=restore_order)
+        counters = {'patient_counter': self.patient_counter, 'block_counter': self.block_counter, 'appt_counter': self.g.appt_counter,
+                    'patients_waiting': self.g.patients_waiting, 'patients_waiting_by_priority': list(self.g.patients_waiting_by_priority)}
+
+        return WarmSnapshot(self.env.now, self.g, getattr(self.rng, 'seed', None), self.rng.getstate(), counters,
+                            (self.next_arrival, self.next_arrival_seq), [patient_state(patient) for patient in patients])
+
+    def restore(self):
+        """ Restore the system state of self.snapshot: counters, random number streams, arrivals and the pathway of every patient"""
+        snapshot = self.snapshot
+        self.rng.setstate(snapshot.rng_state)
+        self.patient_counter = snapshot.counters['patient_counter']
+        self.block_counter = snapshot.counters['block_counter']
+        self.g.appt_counter = snapshot.counters['appt_counter']
+        self.g.patients_waiting = snapshot.counters['patients_waiting']
+        self.g.patients_waiting_by_priority = list(snapshot.counters['patients_waiting_by_priority'])
+
+        next_arrival, next_arrival_seq = snapshot.next_arrival
+        arrivals = None
+
+        # Processes are restarted in snapshot order, so that their timeouts are scheduled in the original order (arrivals
+        # in their place among them). Slot holders get their slot straight away, queuing patients keep their queue order.
+        for state in snapshot.patients:
+            if arrivals is None and (state['stage'].endswith('_queue') or state['wake_seq'] > next_arrival_seq):
+                arrivals = self.env.process(self.generate_wl_arrivals(next_arrival))
+            patient = FOPA_Patient(state['id'],self.g.prob_pifu,self.g.max_fuopa_tenor, self.g.DNA_pifu_pro,self.g.DNA_tra_pro,self.rng)
+            restore_patient(patient, state)
+            patient.prob_pifu = self.g.prob_pifu
+            if patient.pifu_draw is not None and not patient.stage.startswith('pifu'):
+                patient.apply_triage() # triage decided in warm-up, re-applied with this run's PIFU probability
+
+            self.patients[patient.id] = patient
+            self.env.process(self.resume_OPA(patient))
+
+        if arrivals is None:
+            self.env.process(self.generate_wl_arrivals(next_arrival))
+
+    def logs(self):
+        """Event-log sinks of the replication - patient, appointment and audit"""
+        return self.patient_log, self.appt_log, self.audit_log
+
+    def instrument_summary(self):
+        """Instrumentation summary of the replication (see instrument.Instrumentation.summary), with its id and time per run phase"""
+        return self.instruments.summary(rep=self.g.repid, **{f"phase_{phase}_s": t for phase, t in self.timings.items()})
+
+    def save_instruments(self, path=None):
+        """Write the instrumentation of the replication - summary as JSON, samples as csv (see instrument.Instrumentation.save).
+
+        Args:
+            path (_string_, optional): Path of the exports, without extension. Defaults to None, i.e. savepath + 'instrument_rep<repid>'.
+        """
+        self.instruments.save(self.savepath + f"instrument_rep{self.g.repid}" if path is None else path, self.instrument_summary())
 
-            # Trigger next audit after interval
-            yield self.env.timeout(self.g.audit_interval)
+    def close_logs(self):
+        """Write out rows still held in the event-log sink buffers"""
+        for log in self.logs():
+            log.close()
+        if self.tracer is not None:
+            self.tracer.close()
 
 
-    def run(self):
+    def run(self, chart=None):
         """  Run method to do a single run of the model.
 
         The run method starts up the entity generators, and tells SimPy to start
@@ -658,41 +950,84 @@ class rheum_Model:
         results, and the method that writes these results to file
 
         Returns:
-            chart_output: Chart output for streamlit
+            chart_output: Chart output for streamlit (None if not built)
             text_output: Text output for streamlit
             quant_output: KPI output for streamlit
             Other outputs are stored within object (self) rather than returned.
         """
+        self.start()
+
+        # Run simulation
+        start = time.perf_counter()
+        if self.instruments is None:
+            self.env.run(until=self.g.obs_duration + self.g.warm_duration)
+        else:
+            with self.instruments.capture_console():
+                self.env.run(until=self.g.obs_duration + self.g.warm_duration)
+            self.instruments.sample()
+        self.timings['simulation'] = time.perf_counter() - start
+
+        return self.finish(chart)
+
+    def start(self):
+        """ Start up the entity generators (and restore a snapshot if any) before the environment is run - by run, or by the owner of a shared environment"""
 
         # Start processes: entity generators and audit
-        self.env.process(self.generate_wl_arrivals())
+        if self.snapshot is None:
+            self.env.process(self.generate_wl_arrivals())
 
-        # Check for unavailable feature use or not. If so, create slot obstructor generator.
+        # Check for unavailable feature use or not. If so, create slot obstructor generator (blocker processes, or block requests of the slot heap).
         if self.g.unavail_on:
-            self.env.process(self.obstruct_slots())
+            self.env.process(self.obstruct_slots() if self.g.capacity_engine == 'resource' else self.consultant.obstruct(self.g))
 
-        # Generator to perform audit at fixed intervals
-        self.env.process(self.perform_audit())
+        # If starting from a snapshot, restore patients and arrivals
+        if self.snapshot is not None:
+            self.restore()
+        self.audit.update() # initial state
 
-        # Run simulation
-        self.env.run(until=self.g.obs_duration + self.g.warm_duration)
+        # Position log readers at current end of saved logs (shared by reps), to load back only this run's rows
+        self.log_readers = None
+        if self.g.loglinesave:
+            self.log_readers = {log: LogReader(self.savepath, log, self.g.log_format, from_end=True) for log in LOGS}
+
+    def finish(self, chart=None):
+        """ Build, save and load back the results once the environment has run to the end of the simulation (see run)
+
+        Args:
+            chart (bool, optional): Whether to build the chart. Defaults to None, i.e. g.figures.
+
+        Returns:
+            chart_output, text_output, quant_output: as run
+        """
+        log_readers = self.log_readers
 
         # End of simulation run. Build and save results.
+        start = time.perf_counter()
+        self.audit.finish(self.g.obs_duration + self.g.warm_duration) # state held until the end, for the time-weighted KPIs
+        self.write_audit() # audit log rows from the recorded state
+        self.close_logs() # write out rows still buffered
+        self.timings['simulation'] = self.timings.get('simulation', 0.0) + time.perf_counter() - start
+        self.timings['log_write'] = sum(log.write_time for log in self.logs())
+        start = time.perf_counter()
 
         # Load Results log - audit
         if self.g.loglinesave:
-            self.g.results = pd.read_csv(self.savepath + "batch_mon_audit_ls.csv") # read from csv
-            self.g.results = self.g.results[self.g.results['rep'] == self.g.repid]
+            self.g.results = log_readers['audit'].read_new() # read this run's rows from file
         else:
             self.build_audit_results() # assemple from lists in memory
 
         # Load Results log - patient
         if self.g.loglinesave:
-            self.results_df = pd.read_csv(self.savepath +"patient_result2.csv")
+            self.results_df = log_readers['patient'].read_new()
+        else:
+            self.results_df = self.patient_log.to_frame()
 
-        # Load Results log - patient
+        # Load Results log - appointment
         if self.g.loglinesave:
-            self.g.appt_queuing_results = pd.read_csv(self.savepath +"appt_result.csv")
+            self.g.appt_queuing_results = log_readers['appt'].read_new()
+        else:
+            self.g.appt_queuing_results = self.appt_log.to_frame()
+        self.timings['log_read'] = time.perf_counter() - start
 
         # Calculate run results (aggregate). Run but deprecated in favour of batch methods
         self.calculate_mean_q_time()
@@ -701,9 +1036,17 @@ class rheum_Model:
         self.write_run_results()
 
         # Get a chart of results
-        chart_output = self.chart()
+        start = time.perf_counter()
+        chart_output = self.chart() if (self.g.figures if chart is None else chart) else None
+        self.timings['chart'] = time.perf_counter() - start
 
         # Get text summary of results
+        start = time.perf_counter()
         [text_output,quant_output] = self.summarise()
+        self.timings['summarise'] = time.perf_counter() - start
+
+        # Export instrumentation with the logs (in-memory runs keep it in self.instruments)
+        if self.instruments is not None and self.g.loglinesave:
+            self.save_instruments()
 
         return chart_output, text_output, quant_output
@@ -0,0 +1,80 @@
+""" includes scenario comparison with common random numbers (paired differences across replications)"""
+import os
+import random
+import pandas as pd
+
+from src.Batch_rheum_Model import Batch_rheum_model
+from src.helpers import Trial_Results_initiate
+from src.kpis import confidence_intervals
+
+
+def paired_differences(batch_kpi_rep, baseline_kpi_rep, confidence=0.95):
+    """Mean and confidence interval of the per-replication difference of each KPI (scenario minus baseline).
+
+    Args:
+        batch_kpi_rep (_dataframe_): Scenario KPI per replication (Batch_rheum_model.batch_kpi_rep)
+        baseline_kpi_rep (_dataframe_): Baseline KPI per replication, same replication ids
+        confidence (float, optional): The confidence level to apply, as decimal. Defaults to 0.95.
+
+    Returns:
+        _dataframe_: KPI_mean, KPI_LCI, KPI_UCI of the difference, indexed by KPI
+    """
+    paired = batch_kpi_rep.merge(baseline_kpi_rep, on=['rep','KPI'], suffixes=('','_baseline'))
+    paired['diff'] = paired['value'] - paired['value_baseline']
+    return confidence_intervals(paired, 'KPI', 'diff', confidence)
+
+
+def compare_scenarios(scenarios, reps, baseline=None, seed=None, n_workers=1, window_tail=365, savepath="temp/", share_warmup=False, save_dataset=False):
+    """Run scenarios with common random numbers and report each scenario's KPIs and paired differences to the baseline.
+
+    Every scenario is run with the same seed and per-source random streams (run_reps with crn=True), so replication
+    r of each scenario sees the same arrivals and pathway draws. Differences are then taken replication by replication,
+    which gives much narrower confidence intervals than comparing independent runs, for the same number of replications.
+
+    Args:
+        scenarios (_dict_): Scenario name -> Batch_rheum_model keyword arguments (e.g. {'PIFU 20%': {'in_prob_pifu': 0.2, ...}})
+        reps (_integer_): Number of replications per scenario
+        baseline (_string_, optional): Name of the baseline scenario. Defaults to None, i.e. the first scenario.
+        seed (_integer_, optional): Seed shared by all scenarios. Defaults to None, i.e. drawn from the global random module.
+        n_workers (int, optional): Number of worker processes per scenario batch. Defaults to 1.
+        window_tail (int, optional): Final window for headline KPIs [days]. Defaults to 365.
+        savepath (str, optional): Save path. Each scenario saves its logs to a subfolder named after it. Defaults to "temp/".
+        share_warmup (bool, optional): Whether to simulate each replication's warm-up once (with the baseline parameters) and start every scenario from its end-of-warm-up snapshot. Scenarios must then share the warm-up parameters (see snapshot.WARMUP_PARAMS). Defaults to False.
+        save_dataset (bool, optional): Whether to save the batch logs of all scenarios to parquet datasets in savepath + 'batch_logs/', partitioned by scenario and rep (see Batch_rheum_model.save_logs). Defaults to False.
+
+    Returns:
+        _dataframe_: One row per scenario and KPI - KPI_mean/LCI/UCI of the scenario and diff_mean/LCI/UCI of its paired difference to baseline
+        _dict_: Scenario name -> Batch_rheum_model instance (with logs and per-replication KPIs)
+    """
+    if seed is None:
+        seed = random.getrandbits(63)
+    if baseline is None:
+        baseline = next(iter(scenarios))
+
+    snapshots = None
+    if share_warmup:
+        snapshots = Batch_rheum_model(in_savepath=savepath, **scenarios[baseline]).warm_up_reps(reps, n_workers=n_workers, seed=seed, crn=True)
+
+    batches = {}
+    for name, kwargs in scenarios.items():
+        scenario_path = savepath + name + "/"
+        os.makedirs(scenario_path, exist_ok=True)
+        log_format = kwargs.get('in_log_format', 'csv')
+        Trial_Results_initiate(scenario_path + "patient_result2.csv", scenario_path + "appt_result.csv",
+                               scenario_path + "batch_mon_audit_ls.csv", log_format)
+
+        batches[name] = Batch_rheum_model(in_savepath=scenario_path, **kwargs)
+        batches[name].run_reps(reps, n_workers=n_workers, seed=seed, crn=True, snapshots=snapshots)
+        batches[name].headline_KPI(window_tail)
+        if save_dataset:
+            batches[name].save_logs('parquet', scenario=name, dataset_path=savepath + 'batch_logs/')
+
+    comparison = []
+    for name, batch in batches.items():
+        diffs = paired_differences(batch.batch_kpi_rep, batches[baseline].batch_kpi_rep)
+        diffs = diffs.rename(columns={'KPI_mean':'diff_mean','KPI_LCI':'diff_LCI','KPI_UCI':'diff_UCI'})
+        scenario_kpis = pd.concat([batch.batch_kpi, diffs], axis=1).reset_index()
+        scenario_kpis.insert(0, 'scenario', name)
+        comparison.append(scenario_kpis)
+
+    return pd.concat(comparison, ignore_index=True), batches
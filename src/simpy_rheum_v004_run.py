@@ -17,6 +17,8 @@ random.seed(9001)
 
 scriptrun_flag = True # True to save each log line by line (more efficient)
 reps=30 # Number of model replications | Baseline: 30 replications
+figures=True # Whether to build figures (batch plots and last replication chart). False for headless runs where only KPIs are needed (faster) | Baseline: True
+n_workers=1 # Number of worker processes to spread replications across | Baseline: 1 (serial). >1 on Windows needs this script run under an `if __name__ == "__main__":` guard
 outputdir = 'outputs/'
 savepath = 'out_sand/'
 savepath = outputdir + savepath
@@ -79,10 +81,11 @@ if scriptrun_flag:
                                              audit_interval=audit_interval,
                                              in_savepath = savepath,
                                              in_FOavoidable = in_FOavoidable,
-                                             in_interfu_perc=in_interfu_perc)
+                                             in_interfu_perc=in_interfu_perc,
+                                             in_figures=figures)
 
     # Run model
-    fig_audit_reps, chart_output_lastrep, text_output_lastrep, quant_output_lastrep, fig_q_audit_reps,fig_monappKPI_reps, fig_monappKPIn_reps = my_batch_model.run_reps(reps=reps)
+    fig_audit_reps, chart_output_lastrep, text_output_lastrep, quant_output_lastrep, fig_q_audit_reps,fig_monappKPI_reps, fig_monappKPIn_reps = my_batch_model.run_reps(reps=reps,n_workers=n_workers)
 
 #
 # =============================================================================
@@ -0,0 +1,160 @@
+""" includes the slot heap capacity engine: slot requests in a heap, with unavailability blocks requested by callbacks
+instead of blocker processes (alternative to simpy.PriorityResource)"""
+import heapq
+import itertools
+import simpy
+
+
+class SlotRequest(simpy.Event):
+    """ Request for one slot of a SlotHeap - an event triggered when the slot is granted.
+
+    Used like a simpy PriorityResource request: `with slots.request(priority=...) as req: yield req`,
+    the slot being released (or the request withdrawn) on leaving the with block.
+    """
+
+    def __init__(self, slots, priority):
+        """Initialise request and queue it (granted straight away if it is first in the queue and a slot is free).
+
+        Args:
+            slots (_SlotHeap_): Slot heap to request a slot of
+            priority (_integer_): Priority of the request (lower value is more important)
+        """
+        super().__init__(slots.env)
+        self.slots = slots
+        self.priority = priority
+        self.time = slots.env.now
+        self.key = (priority, self.time, next(slots.request_seq)) # ties broken in request order, as PriorityResource
+        self.granted = False
+        self.cancelled = False
+        slots.add(self)
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not GeneratorExit: # (not when an unfinished process is cleaned up, as simpy requests)
+            self.slots.release(self)
+
+
+class BlockStart(simpy.Event):
+    """ Event requesting the blocks of an unavailability window - urgent, as the start of blocker processes (simpy Initialize),
+    so that the blocks queue after processes started earlier at the same time"""
+
+    def __init__(self, env, request_blocks):
+        super().__init__(env)
+        self.callbacks.append(request_blocks)
+        self._ok = True
+        self._value = None
+        env.schedule(self, simpy.events.URGENT)
+
+
+class SlotHeap:
+    """ Slot capacity as a slot count and a heap of slot requests in priority order.
+
+    Grants follow simpy.PriorityResource exactly: a new request is granted if it is first in the queue and a slot is
+    free, and a released slot passes to the first queued request when the release is processed (one event later, at
+    the same time). Unavailability blocks are top-priority requests held for the window's duration from when they are
+    granted, as the blocker processes of the 'resource' engine, but started and ended by callbacks rather than a process
+    per blocked slot. Results are therefore the same as with the 'resource' engine, with or without unavailability.
+    Mirrors the simpy.PriorityResource interface used by rheum_Model (request, count, queue, capacity), so that the
+    pathway processes and snapshots work with either engine.
+    """
+
+    def __init__(self, env, capacity):
+        """Initialise slot heap.
+
+        Args:
+            env (_simpy Environment_): Environment of the model
+            capacity (_integer_): Number of slots
+        """
+        self.env = env
+        self.capacity = capacity
+        self.count = 0 # slots in use (by patients or blocks)
+        self.heap = [] # queued requests (heap on key, withdrawn requests dropped lazily)
+        self.queued = 0 # number of queued requests, not withdrawn
+        self.request_seq = itertools.count()
+        self.on_change = None # callback when a block takes or frees a slot (e.g. audit of slots occupied)
+        self.on_block = None # callback(end) when a block takes a slot, with the time it is held until (e.g. trace)
+
+    def request(self, priority=0):
+        """Request a slot with the given priority (lower value is more important)"""
+        return SlotRequest(self, priority)
+
+    @property
+    def queue(self):
+        """Queued requests, in the order they will be granted"""
+        return sorted(req for req in self.heap if not req.cancelled)
+
+    def add(self, req):
+        """Queue a new request, and grant the first queued request if a slot is free"""
+        heapq.heappush(self.heap, req)
+        self.queued += 1
+        self.grant_next()
+
+    def grant_next(self, _event=None):
+        """Grant the first queued request if a slot is free (one request per call, as PriorityResource)"""
+        heap = self.heap
+        while heap and heap[0].cancelled:
+            heapq.heappop(heap)
+        if heap and self.count < self.capacity:
+            req = heapq.heappop(heap)
+            self.queued -= 1
+            self.count += 1
+            req.granted = True
+            req.succeed()
+
+    def release(self, req):
+        """Free the slot of a granted request, or withdraw a queued request. Slots pass on when the release is processed."""
+        if req.granted:
+            req.granted = False
+            self.count -= 1
+        elif not req.cancelled and not req.triggered:
+            req.cancelled = True
+            self.queued -= 1
+            if not self.queued:
+                self.heap.clear()
+        self.env.timeout(0).callbacks.append(self.grant_next)
+
+    def obstruct(self, params):
+        """Process requesting unavailability blocks (if params.unavail_on) - a single shock period, or periodic windows
+        (as rheum_Model.obstruct_slots)
+
+        Args:
+            params (_g_): Parameters of the model (unavailability parameters)
+        """
+        if params.unavail_byshock:
+            yield self.env.timeout(params.unavail_shock_tmin)
+            self.block(params.unavail_shock_nrslots, params.unavail_shock_period)
+        else:
+            while True:
+                self.block(params.unavail_nrslots, params.unavail_slot)
+                yield self.env.timeout(params.unavail_freq_slot)
+
+    def block(self, slots, duration):
+        """Request top-priority blocks of the given number of slots, each held for duration [days] once granted"""
+        BlockStart(self.env, lambda _event: self.request_blocks(slots, duration))
+
+    def request_blocks(self, slots, duration):
+        """Callback of a block start: request the blocks"""
+        for _ in range(slots):
+            self.request(priority=-1).callbacks.append(lambda req: self.hold(req, duration))
+
+    def hold(self, req, duration):
+        """Callback of a granted block request: hold the slot for the block's duration, then free it"""
+        self.changed()
+        if self.on_block is not None:
+            self.on_block(self.env.now + duration)
+        self.env.timeout(duration).callbacks.append(lambda _event: self.unblock(req))
+
+    def unblock(self, req):
+        """Free the slot of a block at the end of its hold"""
+        self.release(req)
+        self.changed()
+
+    def changed(self):
+        """Report a change of the slots held by blocks"""
+        if self.on_change is not None:
+            self.on_change()
@@ -0,0 +1,65 @@
+""" includes warm-up snapshots: the system state at the end of warm-up, from which scenario runs can be started (forked)"""
+import pickle
+
+# Parameters (of g) that shape the warm-up. Runs starting from a snapshot must share them - other parameters
+# (PIFU, A&G, inter-PIFU interval) only act after warm-up, the PIFU triage being re-applied from each patient's draw.
+WARMUP_PARAMS = ('number_of_slots', 'wl_inter', 'max_fuopa_tenor', 'prob_firstonly', 'warm_duration', 't_decision',
+                 'PIFUbigbang', 'DNA_tra_pro', 'unavail_on')
+
+PATIENT_STATE_SKIP = ('rng', 'req') # patient attributes not kept in snapshots (rebuilt on restore)
+
+
+class WarmSnapshot:
+    """ System state of one replication at the end of warm-up - plain data, so it can be pickled (saved or sent to worker processes).
+
+    Holds each in-flight patient (attributes, pathway stage, remaining timer, queue start), counters, the next arrival
+    and the random number stream state. Restored by rheum_Model(..., snapshot=...).
+    """
+
+    def __init__(self, time, params, crn_seed, rng_state, counters, next_arrival, patients):
+        """Initialise snapshot.
+
+        Args:
+            time (_double_): Simulation time of the snapshot [days]
+            params (_g_): Parameters of the model (WARMUP_PARAMS are kept)
+            crn_seed (_integer_): Seed of the per-source random number streams, or None if the global random module is used
+            rng_state (_type_): Random number stream state (see randomstreams getstate)
+            counters (_dict_): Patient, block and appointment counters and patients waiting (all and by priority)
+            next_arrival (_tuple_): Time of the next RTT patient arrival [days] and its scheduling order among patient timeouts
+            patients (_list_): Patient states (see patient_state), in restore order
+        """
+        self.time = time
+        self.params = {param: getattr(params, param) for param in WARMUP_PARAMS}
+        self.crn_seed = crn_seed
+        self.rng_state = rng_state
+        self.counters = counters
+        self.next_arrival = next_arrival
+        self.patients = patients
+
+    def check_params(self, params):
+        """Raise a ValueError if the parameters (g) of a run differ from the snapshot's in any warm-up parameter"""
+        mismatch = [param for param in WARMUP_PARAMS if getattr(params, param) != self.params[param]]
+        if mismatch:
+            raise ValueError(f"Run differs from warm-up snapshot in warm-up parameters {mismatch}")
+
+    def save(self, path):
+        """Save snapshot to file (pickle)"""
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+
+def load_snapshot(path):
+    """Load a snapshot saved with WarmSnapshot.save"""
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def patient_state(patient):
+    """Attributes of a patient, as kept in a snapshot"""
+    return {attr: getattr(patient, attr) for attr in type(patient).__slots__ if attr not in PATIENT_STATE_SKIP}
+
+
+def restore_patient(patient, state):
+    """Set the attributes of a (new) patient to a state from a snapshot"""
+    for attr, value in state.items():
+        setattr(patient, attr, list(value) if isinstance(value, list) else value)
@@ -1,49 +1,52 @@
 """ Python script (.py) for deployment of MVP Streamlit app."""
 # from numpy.lib.arraysetops import ediff1d
-from datetime import datetime
 import os
-import csv
-import random
+import time
 import numpy as np
 import streamlit as st
 
-os.chdir('../') ## go up one dir
-import src.Batch_rheum_Model as rheum ##
-from src.helpers import Trial_Results_initiate ##
+if os.path.basename(os.getcwd()) == 'src': # the script reruns on every widget change (and while runs are in progress) - go up one dir once
+    os.chdir('../') ## go up one dir
+from src.appservice import ResultsService ##
 from src.initialisers import g ##
 
-st.write('| Toy tool of backlog rheumatology outpatient Discrete Event Simulation Model. The effect of Patient Initiated Follow-up (PIFU) and Advice & Guidance (A&G) can be simulated. The runs may take 5-10 minutes, Only 3 simulation replications are used so caution is needed - more are used in report examples.')
-
-st.title('Rheumatology PIFU Queueing Simulation - main scenario')
-
-outputdir = 'outputs/'
-savepath = 'out_streamlit_S1/'
-savepath = outputdir + savepath
 
-# Check whether the Outputs directory exists or not ##
-isExist = os.path.exists(outputdir)
-if not isExist:
-    os.makedirs(outputdir)
+@st.cache_resource
+def results_service():
+    """ Results service shared by all reruns and sessions of the app - background worker pool and cache of scenario batches """
+    return ResultsService()
+
+
+def show_job(job):
+    """ Show a scenario batch - progress and partial KPIs while replications run, then run-time, KPIs and figures """
+    results_service().poll(job) # merge replications completed since last rerun
+    if job.error is not None:
+        st.error(f"Run failed: {job.error}")
+        return
+    st.progress(job.progress(), text=f"{job.completed} of {job.reps} replications")
+    if job.completed:
+        st.write('Core KPIs' + ('' if job.done else f" (partial, {job.completed} replications)"))
+        st.write(job.batch.batch_kpi)
+    if job.done:
+        fig_audit_reps, fig_q_audit_reps, fig_monappKPI_reps, fig_monappKPIn_reps = job.summarise()
+        st.write('Run-time:')
+        st.write(f"{job.run_time:.1f} s")
+        st.write('---')
+        st.write('Waiting time KPIs')
+        st.pyplot(fig_monappKPI_reps)
+        st.write('---')
+        st.write('Audit KPIs')
+        st.pyplot(fig_audit_reps)
+        st.write('---')
+        st.write('Patients seen KPIs')
+        st.pyplot(fig_monappKPIn_reps)
 
-# Check whether the specified path exists or not
-isExist = os.path.exists(savepath)
-if not isExist:
-    os.makedirs(savepath)
+st.write('| Toy tool of backlog rheumatology outpatient Discrete Event Simulation Model. The effect of Patient Initiated Follow-up (PIFU) and Advice & Guidance (A&G) can be simulated. The runs may take 5-10 minutes, Only 3 simulation replications are used so caution is needed - more are used in report examples.')
 
-file1 = savepath + 'patient_result2.csv'
-file2 = savepath + 'appt_result.csv'
-file3 = savepath + 'batch_mon_audit_ls.csv'
+st.title('Rheumatology PIFU Queueing Simulation - main scenario')
 
 nrep = 3 ## number of reps to run
 
-Trial_Results_initiate(file1,file2,file3)
-
-# Create file to store trial results
-with open(savepath + "trial_results.csv", "w",encoding="cp1252") as f:
-    writer = csv.writer(f, delimiter=",")
-    column_headers = ["Run", "Mean_Q_Time_FOPA","Mean_Q_Time_FUOPA","Mean_Q_Time_Total"]
-    writer.writerow(column_headers)
-
 #col1, col2, col3, col4, col5 = st.columns(3)
 col1, col2, col3,col4 = st.columns(4)
 in_daily_arrivals = col1.slider(
@@ -66,37 +69,18 @@ col5, col6, col7,col8 = st.columns(4)
 cap_diff = col5.slider('Adjustment in daily slots', -2,2,0,step=1)
 in_res = cap + cap_diff
 
-rheum_model = rheum.Batch_rheum_model(in_res= in_res,
-                                #in_inter_arrival=in_inter_arrival / (24*60),
-                                in_inter_arrival = 1/in_daily_arrivals,
-                                in_prob_pifu=in_prob_pifu,
-                                in_path_horizon_y=in_path_horizon_y,
-                                audit_interval = audit_interval,
-                                in_savepath = savepath,
-                                in_FOavoidable = in_FOavoidable,
-                                in_interfu_perc=in_interfu_perc
-                                )
+scenario = {'in_res': in_res, # Batch_rheum_model arguments of main scenario (logs kept in memory by the results service)
+            'in_inter_arrival': 1/in_daily_arrivals,
+            'in_prob_pifu': in_prob_pifu,
+            'in_path_horizon_y': in_path_horizon_y,
+            'audit_interval': audit_interval,
+            'in_FOavoidable': in_FOavoidable,
+            'in_interfu_perc': in_interfu_perc}
 
 
 
 st.title('Rheumatology PIFU Queueing Simulation - scenario 2')
 
-savepath_S2 = 'out_streamlit_S2/'
-savepath_S2 = outputdir+savepath_S2
-
-# Check whether the specified path exists or not
-isExist = os.path.exists(savepath_S2)
-if not isExist:
-    # Create a new directory because it does not exist
-    os.makedirs(savepath_S2)
-    print("The new directory is created!")
-file1 = savepath_S2 + 'patient_result2.csv'
-file2 = savepath_S2 + 'appt_result.csv'
-file3 = savepath_S2 + 'batch_mon_audit_ls.csv'
-
-Trial_Results_initiate(file1,file2,file3)
-
-
 #colS2_1, colS2_2, colS2_3, colS2_4, colS2_5 = st.columns(3)
 colS2_1, colS2_2, colS2_3, colS2_4 = st.columns(4)
 in_daily_arrivals_S2 = colS2_1.slider(
@@ -118,16 +102,13 @@ in_res_S2 = cap_S2 + cap_diff_S2
 
 st.write(' >[*] among those non first-only pathways, i.e. with follow-up')
 
-rheum_model_S2 = rheum.Batch_rheum_model(in_res = in_res_S2,
-                                   #in_inter_arrival =in_inter_arrival_S2/ (24*60),
-                                   in_inter_arrival = 1/in_daily_arrivals_S2,
-                                   in_prob_pifu=in_prob_pifu_S2,
-                                   in_path_horizon_y=in_path_horizon_y_S2,
-                                   audit_interval = audit_interval_S2,
-                                   in_savepath = savepath_S2,
-                                   in_FOavoidable = in_FOavoidable_S2,
-                                   in_interfu_perc=in_interfu_perc_S2
-                                   )
+scenario_S2 = {'in_res': in_res_S2, # Batch_rheum_model arguments of scenario 2
+               'in_inter_arrival': 1/in_daily_arrivals_S2,
+               'in_prob_pifu': in_prob_pifu_S2,
+               'in_path_horizon_y': in_path_horizon_y_S2,
+               'audit_interval': audit_interval_S2,
+               'in_FOavoidable': in_FOavoidable_S2,
+               'in_interfu_perc': in_interfu_perc_S2}
 
 
 st.title('Runs')
@@ -139,103 +120,20 @@ with st.sidebar:
     st.write('Development project. Not government policy')
 
 
+# Runs are submitted to the results service and run in the background - cached batches (same parameters) come back straight away.
+# The submitted jobs are kept in the session, and the script reruns every second while they run, showing progress and partial KPIs.
 if main_button:
-    # Get results
-    start=datetime.now()
-    random.seed(9001)
-    fig_audit_reps, chart, text , quant, fig_q_audit_reps,fig_monappKPI_reps,fig_monappKPIn_reps = rheum_model.run_reps(nrep)
-    scenario1run = datetime.now()-start
-    print(f"Run-time of {scenario1run}")
-    # Show chart
-    st.write('Run-time:')
-    st.write(scenario1run)
-    st.write('---')
-    st.write('Core KPIs')
-    #st.write(rheum_model.batch_kpi.iloc[[0,1,2,3,7],])
-    st.write(rheum_model.batch_kpi)
-    st.write('---')
-    st.write('Waiting time KPIs')
-    st.pyplot(fig_monappKPI_reps)
-    st.write('---')
-    st.write('Audit KPIs')
-    st.pyplot(fig_audit_reps)
-    st.write('---')
-    st.write('Patients seen KPIs')
-    st.pyplot(fig_monappKPIn_reps)
-
-    #st.write('---')
-    #st.write('Single replication example:')
-    # Show chart
-    #st.pyplot(chart)
-    # Display results (text)
-    # for t in text:
-    #     st.write(t)
-    #st.write(quant)
-    st.write(scenario1run)
-
+    st.session_state['jobs'] = {'Main scenario': results_service().submit(scenario, nrep)}
 
 if tworuns_button:
+    # One comparison job - replications of both scenarios interleaved across workers, sharing the warm-up if only post warm-up parameters differ
+    st.session_state['jobs'] = results_service().submit_comparison({'Main scenario': scenario, 'Scenario 2': scenario_S2}, nrep)
+
+jobs = st.session_state.get('jobs', {})
+for name, job in jobs.items():
+    st.subheader(name)
+    show_job(job)
 
-    st.subheader("Main scenario")
-    # Get results
-    start=datetime.now()
-    random.seed(9001)
-    fig_audit_reps, chart, text , quant, fig_q_audit_reps,fig_monappKPI_reps, fig_monappKPIn_reps = rheum_model.run_reps(nrep)
-    scenario1run = datetime.now()-start
-    print(f"Run-time of {scenario1run}")
-    # Show chart
-    st.write('Run-time:')
-    st.write(scenario1run)
-    st.write('---')
-    st.write('Core KPIs')
-    #st.write(rheum_model.batch_kpi.iloc[[0,1,2,3,7],])
-    st.write(rheum_model.batch_kpi)
-    st.write('---')
-    st.write('Waiting time KPIs')
-    st.pyplot(fig_monappKPI_reps)
-    st.write('---')
-    st.write('Audit KPIs')
-    st.pyplot(fig_audit_reps)
-    st.write('---')
-    st.write('Patients seen KPIs')
-    st.pyplot(fig_monappKPIn_reps)
-    #st.write('---')
-    #st.write('Single replication example:')
-    # Show chart
-    #st.pyplot(chart)
-    # Display results (text)
-    # for t in text:
-    #     st.write(t)
-    #st.write(quant)
-
-    st.subheader("Scenario 2")
-    # Get results
-    start=datetime.now()
-    fig_audit_reps_S2, chart_S2, text_S2 , quant_S2, fig_q_audit_reps_S2,fig_monappKPI_reps_S2, fig_monappKPIn_reps_S2 = rheum_model_S2.run_reps(nrep)
-    scenario2run = datetime.now()-start
-    print(f"Run-time of {scenario2run}")
-    st.write('Run-time:')
-    st.write(scenario2run)
-    st.write('---')
-    st.write('Core KPIs')
-    #st.write(rheum_model_S2.batch_kpi.iloc[[0,1,2,3,7],])
-    st.write(rheum_model_S2.batch_kpi)
-    # Show chart
-    st.write('---')
-    st.write('Waiting time KPIs')
-    st.pyplot(fig_monappKPI_reps_S2)
-    st.write('---')
-    st.write('Audit KPIs')
-    st.pyplot(fig_audit_reps_S2)
-    st.write('---')
-    st.write('Patients seen KPIs')
-    st.pyplot(fig_monappKPIn_reps_S2)
-
-    #st.write('---')
-    #st.write('Single rpelication example:')
-    # Show chart
-    #st.pyplot(chart_S2)
-    # Display results (text)
-    # for t in text_S2:
-    #     st.write(t)
-    #st.write(quant_S2)
+if any(not job.done for job in jobs.values()):
+    time.sleep(1)
+    st.rerun()
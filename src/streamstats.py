@@ -0,0 +1,223 @@
+""" includes streaming (online) statistics for queueing time KPIs - constant memory, no appointment log needed - and
+time-weighted statistics of the audited state (waiting list size, slot utilisation)"""
+import math
+import pandas as pd
+
+from src.kpis import QUANTILES
+
+
+class QuantileSketch:
+    """ Quantile sketch with relative-error guarantee (log-spaced buckets, as DDSketch).
+
+    Values are counted in buckets [gamma^(k-1), gamma^k), gamma = (1+accuracy)/(1-accuracy), so memory grows
+    only with log(max/min value). Values below min_value (e.g. zero waits) share one bucket.
+    Each order statistic is recovered within relative error `accuracy`, so quantile(q) - interpolated between
+    order statistics as pandas - is within relative error `accuracy` of the exact quantile (plus at most
+    min_value absolute error where values below min_value are involved).
+    """
+
+    def __init__(self, accuracy=0.01, min_value=1e-3):
+        """Initialise empty sketch.
+
+        Args:
+            accuracy (float, optional): Relative accuracy of quantiles, as decimal. Defaults to 0.01.
+            min_value (float, optional): Smallest value resolved - below it, values are treated as 0 [days]. Defaults to 1e-3.
+        """
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.buckets = {} # bucket index -> count
+        self.zero_count = 0
+        self.n = 0
+
+    def update(self, x):
+        """Add one value"""
+        self.n += 1
+        if x < self.min_value:
+            self.zero_count += 1
+        else:
+            k = math.ceil(math.log(x) / self.log_gamma)
+            self.buckets[k] = self.buckets.get(k, 0) + 1
+
+    def quantile(self, q):
+        """Approximate q quantile, linearly interpolated between order statistics as pandas (see class docstring for error bound). nan if empty."""
+        if self.n == 0:
+            return float("nan")
+        pos = q * (self.n - 1)
+        lo = math.floor(pos)
+        hi = min(lo + 1, self.n - 1)
+        v_lo, v_hi = self.value_at_rank(lo), self.value_at_rank(hi)
+        return v_lo + (pos - lo) * (v_hi - v_lo)
+
+    def value_at_rank(self, rank):
+        """Approximate order statistic of given (0-based) rank"""
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for k in sorted(self.buckets):
+            seen += self.buckets[k]
+            if rank < seen:
+                return 2 * self.gamma ** k / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class StreamingSummary:
+    """ Running count, mean and variance (Welford) plus quantile sketch of a stream of values"""
+
+    def __init__(self, accuracy=0.01):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0 # sum of squared deviations from the running mean
+        self.sketch = QuantileSketch(accuracy)
+
+    def update(self, x):
+        """Add one value"""
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        self.sketch.update(x)
+
+    def variance(self):
+        """Sample variance (nan if fewer than 2 values)"""
+        return self.m2 / (self.n - 1) if self.n > 1 else float("nan")
+
+
+class StreamingKPIs:
+    """ Streaming queueing time KPIs of one replication, updated as each appointment's queueing time is known.
+
+    Holds one StreamingSummary per (priority, time interval of queue end) - as plot_monappKPI_reps - and one for
+    RTT (priority 3) appointments starting to queue in the final window - as headline_KPI.
+    """
+
+    def __init__(self, rep, warm_duration, max_time, step=365/4, window_tail=365, quantiles=QUANTILES, accuracy=0.01):
+        """Initialise empty KPI streams.
+
+        Args:
+            rep (_integer_): Replication id
+            warm_duration (_double_): Warm-up period [days]. Appointments starting to queue before it are ignored.
+            max_time (_double_): End of simulation [days]
+            step (_double_, optional): Time interval for temporal KPIs [days]. Defaults to 365/4.
+            window_tail (int, optional): Final window for headline RTT KPIs [days]. Defaults to 365.
+            quantiles (tuple, optional): Quantiles to report. Defaults to QUANTILES.
+            accuracy (float, optional): Relative accuracy of quantiles (see QuantileSketch). Defaults to 0.01.
+        """
+        self.rep = rep
+        self.warm_duration = warm_duration
+        self.window_start = max_time - window_tail
+        self.step = step
+        self.quantiles = quantiles
+        self.accuracy = accuracy
+        self.by_interval = {} # (priority, interval) -> StreamingSummary
+        self.headline = StreamingSummary(accuracy)
+
+    def update(self, priority, q_time, start_q):
+        """Add one appointment's queueing time"""
+        if start_q <= self.warm_duration:
+            return
+        key = (priority, ((start_q + q_time) // self.step) * self.step)
+        summary = self.by_interval.get(key)
+        if summary is None:
+            summary = self.by_interval[key] = StreamingSummary(self.accuracy)
+        summary.update(q_time)
+        if priority == 3 and start_q > self.window_start:
+            self.headline.update(q_time)
+
+    def _row(self, summary):
+        return ([summary.n, summary.mean, summary.variance()]
+                + [summary.sketch.quantile(q) for q in self.quantiles])
+
+    def interval_kpis(self):
+        """KPIs per priority and interval - same columns as kpis.group_kpis by ['rep','priority','interval'], plus 'var'"""
+        columns = ['rep','priority','interval','n','mean','var'] + [f"q{q}" for q in self.quantiles]
+        rows = [[self.rep, priority, interval] + self._row(summary)
+                for (priority, interval), summary in sorted(self.by_interval.items())]
+        return pd.DataFrame(rows, columns=columns)
+
+    def headline_kpis(self):
+        """RTT KPIs over the final window - same columns as kpis.group_kpis by ['rep'], plus 'var'"""
+        columns = ['rep','n','mean','var'] + [f"q{q}" for q in self.quantiles]
+        rows = [[self.rep] + self._row(self.headline)] if self.headline.n else []
+        return pd.DataFrame(rows, columns=columns)
+
+
+class TimeWeightedSummary:
+    """ Running time-weighted mean, max and quantiles of an integer-valued step function of time (e.g. a queue length).
+
+    Time spent at each value is accumulated in a histogram (value -> duration), so each update is O(1), memory grows
+    only with the number of distinct values, and quantiles are exact.
+    """
+
+    def __init__(self):
+        self.time = 0.0 # total time observed [days]
+        self.integral = 0.0 # integral of the value over time [value x days]
+        self.max = float("nan")
+        self.durations = {} # value -> time spent at it [days]
+
+    def update(self, value, duration):
+        """Add a period of given duration [days] at a value"""
+        self.time += duration
+        self.integral += value * duration
+        self.durations[value] = self.durations.get(value, 0.0) + duration
+        if not value <= self.max: # (max is nan until the first update)
+            self.max = value
+
+    @property
+    def mean(self):
+        """Time-weighted mean (nan if no time observed)"""
+        return self.integral / self.time if self.time > 0 else float("nan")
+
+    def quantile(self, q):
+        """Time-weighted q quantile: smallest value at or below which the function spends at least fraction q of the time. nan if no time observed."""
+        if self.time <= 0:
+            return float("nan")
+        target = q * self.time
+        seen = 0.0
+        for value in sorted(self.durations):
+            seen += self.durations[value]
+            if seen >= target * (1 - 1e-12):
+                return float(value)
+        return float(self.max)
+
+
+class TimeWeightedKPIs:
+    """ Time-weighted KPIs of audited state series (e.g. waiting list size per priority, slots occupied) over the final
+    window of a replication, updated with each state change (see auditrecorder.ChangePointAudit).
+    """
+
+    def __init__(self, rep, series, max_time, window_tail=365, quantiles=QUANTILES):
+        """Initialise empty KPIs.
+
+        Args:
+            rep (_integer_): Replication id
+            series (_dict_): KPI name prefix -> (index of the series in the state, scale), e.g. {'RTT_WL': (4, 1)}. Values are divided by scale when reported (e.g. slots occupied / slots for utilisation).
+            max_time (_double_): End of simulation [days]
+            window_tail (int, optional): Final window over which KPIs are kept [days]. Defaults to 365.
+            quantiles (tuple, optional): Quantiles to report. Defaults to QUANTILES.
+        """
+        self.rep = rep
+        self.series = [(name, index, scale) for name, (index, scale) in series.items()]
+        self.window_start = max_time - window_tail
+        self.max_time = max_time
+        self.quantiles = quantiles
+        self.summaries = [TimeWeightedSummary() for _ in self.series]
+
+    def update(self, state, t0, t1):
+        """Add the state held from time t0 to t1 [days] (the part within the window)"""
+        t0 = max(t0, self.window_start)
+        t1 = min(t1, self.max_time)
+        if t1 <= t0:
+            return
+        duration = t1 - t0
+        for summary, (_name, index, _scale) in zip(self.summaries, self.series):
+            summary.update(state[index], duration)
+
+    def headline_kpis(self):
+        """Time-weighted mean, max and quantiles of each series over the window - one row for the replication, one column per KPI (e.g. RTT_WL_mean, RTT_WL_q0.92)"""
+        row = {'rep': self.rep}
+        for summary, (name, _index, scale) in zip(self.summaries, self.series):
+            row[f"{name}_mean"] = summary.mean / scale
+            row[f"{name}_max"] = summary.max / scale
+            row.update({f"{name}_q{q}": summary.quantile(q) / scale for q in self.quantiles})
+        return pd.DataFrame([row])
@@ -0,0 +1,232 @@
+""" includes the parameter sweep runner: full grid and Latin hypercube designs over Batch_rheum_model parameters, points
+run in parallel and kept in a content-addressed cache (parameter hash plus code version), so re-running a sweep only
+computes the missing points.
+
+Example (from the repository root):
+    points = full_grid({'cap_diff': [-2, -1, 0, 1], 'in_prob_pifu': [0, 0.1, 0.2, 0.3]}, in_inter_arrival=1/6)
+    results = run_sweep(points, reps=30, n_workers=8)
+    results[results['KPI'] == 'RTT_q0.92']
+"""
+import glob
+import hashlib
+import itertools
+import json
+import os
+import random
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from scipy.stats import qmc
+
+from src.helpers import steady_state_slots
+from src.initialisers import g
+
+# Batch_rheum_model parameters a sweep point can set (plus cap_diff, in daily slots relative to the steady-state heuristic)
+SWEEP_PARAMS = {'in_res': None, 'in_inter_arrival': 1/6, 'in_prob_pifu': 0, 'in_path_horizon_y': 3, 'in_FOavoidable': 0,
+                'in_interfu_perc': 0.6, 'audit_interval': 28, 'in_capacity_engine': 'resource'}
+INTEGER_PARAMS = ('in_res', 'cap_diff', 'in_path_horizon_y', 'audit_interval') # rounded in Latin hypercube designs
+
+# Modules whose source makes up the code version of cached results (a change to any of them invalidates the cache)
+MODEL_MODULES = ('Batch_rheum_Model', 'rheum_Model', 'patient', 'initialisers', 'helpers', 'kpis', 'logsinks', 'auditrecorder',
+                 'randomstreams', 'slotheap', 'snapshot', 'streamstats')
+
+
+def full_grid(factors, **fixed):
+    """ Full factorial design - every combination of the factor values.
+
+    Args:
+        factors (_dict_): Parameter name (see SWEEP_PARAMS, or cap_diff) -> values
+        **fixed: Other parameters, fixed across points
+
+    Returns:
+        _list_: One parameter dict per point
+    """
+    names = list(factors)
+    return [{**fixed, **dict(zip(names, values))} for values in itertools.product(*factors.values())]
+
+
+def latin_hypercube(ranges, n, seed=None, **fixed):
+    """ Latin hypercube design - n points spreading each parameter's range evenly.
+
+    Args:
+        ranges (_dict_): Parameter name (see SWEEP_PARAMS, or cap_diff) -> (low, high). Integer parameters (INTEGER_PARAMS) are rounded.
+        n (_integer_): Number of points
+        seed (_integer_, optional): Seed of the design. Defaults to None.
+        **fixed: Other parameters, fixed across points
+
+    Returns:
+        _list_: One parameter dict per point
+    """
+    names = list(ranges)
+    lows, highs = zip(*ranges.values())
+    samples = qmc.scale(qmc.LatinHypercube(d=len(names), seed=seed).random(n), lows, highs)
+    points = []
+    for sample in samples:
+        point = dict(fixed)
+        for name, value in zip(names, sample):
+            point[name] = int(round(value)) if name in INTEGER_PARAMS else float(value)
+        points.append(point)
+    return points
+
+
+def resolve_point(point):
+    """ Full Batch_rheum_model keyword arguments of a sweep point: defaults filled in, and cap_diff turned into in_res.
+
+    Args:
+        point (_dict_): Parameter name -> value (see SWEEP_PARAMS). Either in_res or cap_diff (default 0) sets the daily slots.
+
+    Returns:
+        _dict_: Batch_rheum_model keyword arguments (SWEEP_PARAMS keys)
+    """
+    unknown = set(point) - set(SWEEP_PARAMS) - {'cap_diff'}
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {sorted(unknown)}")
+    if point.get('in_res') is not None and 'cap_diff' in point:
+        raise ValueError("A sweep point sets the daily slots by in_res or cap_diff, not both")
+    params = {**SWEEP_PARAMS, **{k: v for k, v in point.items() if k != 'cap_diff'}}
+    if params['in_res'] is None:
+        params['in_res'] = int(np.round(steady_state_slots(params['in_inter_arrival'], params['in_path_horizon_y']), 0) + point.get('cap_diff', 0))
+    params = {k: v.item() if isinstance(v, np.generic) else v for k, v in params.items()} # plain python values (json)
+    for name in INTEGER_PARAMS: # whole numbers as int, so that e.g. in_res=22.0 and in_res=22 share a cache key
+        if isinstance(params.get(name), float) and params[name].is_integer():
+            params[name] = int(params[name])
+    return params
+
+
+def code_version():
+    """ Hash of the source of the model modules (MODEL_MODULES) - results cached under another code version are not reused """
+    digest = hashlib.sha256()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for module in MODEL_MODULES:
+        with open(os.path.join(folder, module + '.py'), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def point_key(params, run_settings, version):
+    """ Cache key of a sweep point - hash of its parameters, run settings (reps, seed, crn, window_tail) and code version """
+    content = json.dumps({'params': params, 'run': run_settings, 'code': version}, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def sweep_point_worker(params, reps, seed, crn, window_tail):
+    """ Run one sweep point (a batch of replications, logs kept in memory) and return its headline KPIs.
+
+    Module-level so that it can be pickled and sent to a ProcessPoolExecutor.
+
+    Args:
+        params (_dict_): Batch_rheum_model keyword arguments (see resolve_point)
+        reps (_integer_): Number of replications
+        seed (_integer_): Batch seed
+        crn (_boolean_): Whether to use common random number streams (see run_reps)
+        window_tail (_integer_): Final window for headline KPIs [days]
+
+    Returns:
+        _dict_: KPI value per replication (long format records) and mean/CI per KPI (records)
+    """
+    from src.Batch_rheum_Model import Batch_rheum_model # pylint: disable=import-outside-toplevel
+
+    g.debug = False
+    with tempfile.TemporaryDirectory() as tmpdir:
+        batch = Batch_rheum_model(in_savepath=tmpdir + "/", in_loglinesave=False, in_figures=False, **params)
+        batch.run_reps(reps, seed=seed, crn=crn)
+    batch_kpi = batch.headline_KPI(window_tail)
+    return {'kpi_rep': batch.batch_kpi_rep.to_dict('records'),
+            'kpi': batch_kpi.reset_index().to_dict('records')}
+
+
+def load_cached(cache_dir, key):
+    """ Cached entry of a point (None if missing)"""
+    path = os.path.join(cache_dir, key + '.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_cached(cache_dir, key, entry):
+    """ Write a point's entry to the cache (via a temporary file, so that an interrupted sweep leaves no partial entry)"""
+    path = os.path.join(cache_dir, key + '.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(entry, f, default=float)
+    os.replace(path + '.tmp', path)
+
+
+def run_sweep(points, reps=30, cache_dir='outputs/sweep_cache/', n_workers=1, seed=9001, crn=True, window_tail=365):
+    """ Run a sweep (design points of Batch_rheum_model parameters), computing only the points not in the cache.
+
+    Each point's results are cached under a hash of its full parameters, the run settings and the code version, so
+    points shared between sweeps, and points of an interrupted sweep, are not recomputed.
+
+    Args:
+        points (_list_): Parameter dicts (see full_grid, latin_hypercube, resolve_point)
+        reps (int, optional): Number of replications per point. Defaults to 30.
+        cache_dir (str, optional): Folder of cached point results. Defaults to 'outputs/sweep_cache/'.
+        n_workers (int, optional): Number of worker processes, each running one point at a time. Defaults to 1.
+        seed (int, optional): Batch seed of every point (fixed, so that cached results are reproducible). Defaults to 9001.
+        crn (bool, optional): Whether points use common random number streams, i.e. the same arrivals and pathway draws per replication (see run_reps). Defaults to True.
+        window_tail (int, optional): Final window for headline KPIs [days]. Defaults to 365.
+
+    Returns:
+        _dataframe_: One row per point and KPI - point id, parameters, KPI_mean/LCI/UCI and whether it came from the cache
+    """
+    if seed is None:
+        seed = random.getrandbits(63)
+    os.makedirs(cache_dir, exist_ok=True)
+    run_settings = {'reps': reps, 'seed': seed, 'crn': crn, 'window_tail': window_tail}
+    version = code_version()
+
+    params = [resolve_point(point) for point in points]
+    keys = [point_key(p, run_settings, version) for p in params]
+    entries = {key: load_cached(cache_dir, key) for key in set(keys)}
+    cached = {key for key, entry in entries.items() if entry is not None}
+    missing = {key: p for key, p in zip(keys, params) if key not in cached}
+
+    def store(key, result):
+        entries[key] = {'params': missing[key], 'run': run_settings, 'code': version, **result}
+        save_cached(cache_dir, key, entries[key])
+
+    if n_workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(sweep_point_worker, p, reps, seed, crn, window_tail): key for key, p in missing.items()}
+            for future in as_completed(futures):
+                store(futures[future], future.result())
+    else:
+        for key, p in missing.items():
+            store(key, sweep_point_worker(p, reps, seed, crn, window_tail))
+
+    rows = []
+    for point_id, (key, p) in enumerate(zip(keys, params)):
+        kpi = pd.DataFrame(entries[key]['kpi'])
+        for name, value in reversed(p.items()):
+            kpi.insert(0, name, value)
+        kpi.insert(0, 'point', point_id)
+        kpi['cached'] = key in cached
+        rows.append(kpi)
+    return pd.concat(rows, ignore_index=True)
+
+
+def load_sweep_cache(cache_dir='outputs/sweep_cache/', current_only=True):
+    """ All points in a sweep cache, e.g. for the R scripts instead of separate scenario output folders.
+
+    Args:
+        cache_dir (str, optional): Folder of cached point results. Defaults to 'outputs/sweep_cache/'.
+        current_only (bool, optional): Whether to keep only results of the current code version. Defaults to True.
+
+    Returns:
+        _dataframe_: One row per point, replication and KPI - parameters, run settings, code version, rep, KPI and value
+    """
+    version = code_version()
+    rows = []
+    for path in sorted(glob.glob(os.path.join(cache_dir, '*.json'))):
+        with open(path, encoding='utf-8') as f:
+            entry = json.load(f)
+        if current_only and entry['code'] != version:
+            continue
+        kpi_rep = pd.DataFrame(entry['kpi_rep'])
+        for name, value in {**entry['params'], **entry['run'], 'code': entry['code']}.items():
+            kpi_rep[name] = value
+        kpi_rep.insert(0, 'key', os.path.splitext(os.path.basename(path))[0])
+        rows.append(kpi_rep)
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame()
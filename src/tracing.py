@@ -0,0 +1,183 @@
+""" includes the trace channel of a replication: levelled, category-filtered event records (audit, first appointments,
+follow-ups, PIFU, slot unavailability) kept in a ring buffer or written to a binary file, and rendered to text offline.
+
+Records are fixed-layout tuples of numbers (time, kind, four integers, one float), formatted only when rendered. The
+model holds a tracer only when tracing is on (g.trace_level, or g.debug for console output), so each trace point in
+the model is a single `if self.tracer is not None` check in normal runs.
+
+Render a trace file from the command line (from the repository root):
+    python -m src.tracing temp/trace_rep0.bin --level 2 --category audit pifu
+"""
+import argparse
+import struct
+import sys
+from collections import deque, namedtuple
+import pandas as pd
+
+TRACE_MAGIC = b'RHTRACE1' # header of trace files
+TRACE_RECORD = struct.Struct('<dH4qd') # time [days], kind, four integer fields (a, b, c, d), float field (value)
+
+TraceKind = namedtuple('TraceKind', ['name', 'category', 'level', 'template'])
+
+# Trace record kinds (code -> kind). Level as the former g.debuglevel prints: 1 audit, 2 patient pathway events, 3 slot unavailability.
+# Templates format the record fields: t (time), a, b, c, d (integers), v (float)
+TRACE_KINDS = {
+    1: TraceKind('audit', 'audit', 1, "\n-- Audit Day {t}\n--- Patients waiting: First: {a}, PIFU: {b}, Traditional: {c}\n--- Slots used: {d}\n--"),
+    2: TraceKind('first_avoided', 'first', 2, "Patient {a} had first outpatient avoided. Not added to log."),
+    3: TraceKind('first_queued', 'first', 2, "Req {b}: Patient {a} queued {v:.2f} days for 1st app. Priority {c}"),
+    4: TraceKind('first_attended', 'first', 2, " Patient {a} queued {v:.2f} days for 1st app. Priority {c}"),
+    5: TraceKind('first_dna', 'first', 2, " Patient {a} queued {v:.2f} days for 1st app. Priority {c} but didn't attend the appointment"),
+    6: TraceKind('to_pifu', 'pathway', 2, "Patient {a} PIFU. Follows {d} traditional apps."),
+    7: TraceKind('not_pifu', 'pathway', 2, "Patient {a} not PIFU. Follows {d} traditional apps."),
+    8: TraceKind('tfu_attended', 'tfu', 2, "Req {b}: Patient {a} queued {v:.2f} for app {d}. Priority {c}"),
+    9: TraceKind('tfu_dna', 'tfu', 2, "Req {b}: Patient {a} queued {v:.2f} for app {d}. Priority {c} but DNAd"),
+    10: TraceKind('pifu_attended', 'pifu', 2, "Req {b}: Patient {a} queued {v:.2f} days for app {d} - PIFU. Priority {c}"),
+    11: TraceKind('pifu_dna', 'pifu', 2, "Req {b}: Patient {a} queued {v:.2f} days for app {d} - PIFU. Priority {c} but did not attend"),
+    12: TraceKind('slot_blocked', 'unavail', 3, "Slot blocked (unavailable) until {v:.1f}. Slots used: {a}"),
+}
+TRACE_CODES = {kind.name: code for code, kind in TRACE_KINDS.items()} # kind name -> code
+TRACE_CATEGORIES = sorted({kind.category for kind in TRACE_KINDS.values()})
+
+
+def trace_codes(level, categories=None):
+    """ Codes of the record kinds traced at a level (and in the given categories, default all) """
+    return frozenset(code for code, kind in TRACE_KINDS.items()
+                     if kind.level <= level and (categories is None or kind.category in categories))
+
+
+def render_record(record):
+    """ Human-readable line(s) of a trace record (time, kind, a, b, c, d, value) """
+    t, code, a, b, c, d, v = record
+    return TRACE_KINDS[code].template.format(t=t, a=a, b=b, c=c, d=d, v=v)
+
+
+class Tracer:
+    """ Trace channel of one replication - records of the enabled kinds, kept in a ring buffer (sink 'ring'), written
+    to a binary file in chunks (sink 'file') or printed as they come (sink 'console', as the former debug prints)."""
+
+    def __init__(self, level=2, categories=None, sink='ring', capacity=100000, path=None):
+        """Initialise tracer.
+
+        Args:
+            level (int, optional): Highest level traced - 1 audit, 2 patient pathway events, 3 slot unavailability. Defaults to 2.
+            categories (_list_, optional): Categories traced (see TRACE_CATEGORIES). Defaults to None, i.e. all.
+            sink (str, optional): 'ring' (last capacity records in memory), 'file' (binary file at path) or 'console'. Defaults to 'ring'.
+            capacity (int, optional): Records kept by the ring buffer, or buffered between writes to file. Defaults to 100000.
+            path (_string_, optional): Trace file path (sink 'file'). Defaults to None.
+        """
+        if sink not in ('ring', 'file', 'console'):
+            raise ValueError(f"Unknown trace sink '{sink}' - use 'ring', 'file' or 'console'")
+        if sink == 'file' and path is None:
+            raise ValueError("Trace sink 'file' needs a path")
+        self.codes = trace_codes(level, categories)
+        self.sink = sink
+        self.capacity = capacity
+        self.path = path
+        self.records = deque(maxlen=capacity) if sink == 'ring' else []
+        self.emitted = 0 # records emitted (including those dropped from the ring buffer)
+        if sink == 'file':
+            with open(path, 'wb') as f:
+                f.write(TRACE_MAGIC)
+
+    def emit(self, kind, t, a=0, b=0, c=0, d=0, v=0.0):
+        """Record an event, if its kind is traced.
+
+        Args:
+            kind (_string_): Record kind (see TRACE_KINDS)
+            t (_double_): Simulation time [days]
+            a, b, c, d (int, optional): Integer fields (patient id, appointment id, priority, counts - see the kind's template). Default to 0.
+            v (float, optional): Float field (queueing time, time). Defaults to 0.0.
+        """
+        code = TRACE_CODES[kind]
+        if code not in self.codes:
+            return
+        self.emitted += 1
+        record = (t, code, int(a), int(b), int(c), int(d), float(v))
+        if self.sink == 'console':
+            print(render_record(record))
+            return
+        self.records.append(record)
+        if self.sink == 'file' and len(self.records) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records to the trace file (sink 'file')"""
+        if self.sink == 'file' and self.records:
+            with open(self.path, 'ab') as f:
+                f.write(b''.join(TRACE_RECORD.pack(*record) for record in self.records))
+            self.records.clear()
+
+    def close(self):
+        """Write out records still buffered (sink 'file')"""
+        self.flush()
+
+    def to_frame(self):
+        """Records in the ring buffer as a dataframe (see trace_frame)"""
+        return trace_frame(list(self.records))
+
+    def render(self):
+        """Records in the ring buffer as text"""
+        return "\n".join(render_record(record) for record in self.records)
+
+
+def make_tracer(params, path):
+    """ Tracer of a replication from its parameters, or None if tracing is off.
+
+    Tracing is on if params.trace_level > 0 (sink params.trace_sink, default a file if the run saves its logs, else a
+    ring buffer), or else if params.debug (records printed to console as they come, at params.debuglevel).
+
+    Args:
+        params (_g_): Parameters of the replication
+        path (_string_): Trace file path (sink 'file')
+
+    Returns:
+        _Tracer_: Tracer, or None
+    """
+    if params.trace_level > 0:
+        sink = params.trace_sink or ('file' if params.loglinesave else 'ring')
+        return Tracer(params.trace_level, params.trace_categories, sink, params.trace_capacity, path)
+    if params.debug and params.debuglevel >= 1:
+        return Tracer(params.debuglevel, sink='console')
+    return None
+
+
+def read_trace(path):
+    """ Records of a trace file (written by a Tracer with sink 'file')
+
+    Returns:
+        _list_: Records (time, kind, a, b, c, d, value)
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(TRACE_MAGIC):
+        raise ValueError(f"{path} is not a trace file")
+    return list(TRACE_RECORD.iter_unpack(data[len(TRACE_MAGIC):]))
+
+
+def trace_frame(records):
+    """ Trace records as a dataframe - time, kind name, category, level, a, b, c, d and value """
+    frame = pd.DataFrame(records, columns=['time', 'code', 'a', 'b', 'c', 'd', 'value'])
+    frame.insert(1, 'kind', frame['code'].map({code: kind.name for code, kind in TRACE_KINDS.items()}))
+    frame.insert(2, 'category', frame['code'].map({code: kind.category for code, kind in TRACE_KINDS.items()}))
+    frame.insert(3, 'level', frame['code'].map({code: kind.level for code, kind in TRACE_KINDS.items()}))
+    return frame.drop(columns='code')
+
+
+def main(argv=None):
+    """ Command line entry point - render a trace file as text, optionally filtered by level, category and time"""
+    parser = argparse.ArgumentParser(description="Render a replication trace file as text")
+    parser.add_argument('path', help='trace file (trace_rep<id>.bin)')
+    parser.add_argument('--level', type=int, default=3, help='highest level shown')
+    parser.add_argument('--category', nargs='*', default=None, choices=TRACE_CATEGORIES, help='categories shown (default all)')
+    parser.add_argument('--start', type=float, default=None, help='first simulation day shown')
+    parser.add_argument('--end', type=float, default=None, help='last simulation day shown')
+    args = parser.parse_args(argv)
+
+    codes = trace_codes(args.level, args.category)
+    for record in sorted(read_trace(args.path), key=lambda record: record[0]): # time order (audit records are added after the run)
+        if record[1] in codes and (args.start is None or record[0] >= args.start) and (args.end is None or record[0] <= args.end):
+            sys.stdout.write(render_record(record) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+""" Tests of the analytic fast-path (analytic)"""
+import numpy as np
+import pytest
+
+from src.analytic import analytic_sweep
+from src.helpers import steady_state_slots
+
+
+@pytest.mark.parametrize('inter_arrival', [1/3, 1/6])
+def test_rtt_quantile_increases_as_slots_go_down(inter_arrival):
+    """RTT_q0.92 never decreases with fewer slots - including under overload, where RTT arrivals are still queued at the end"""
+    heuristic = steady_state_slots(inter_arrival, 3)
+    slots = np.arange(int(heuristic * 0.3), int(heuristic * 1.3) + 1)
+    sweep = analytic_sweep({'in_res': slots}, in_inter_arrival=inter_arrival)
+    q = sweep.sort_values('in_res', ascending=False)['RTT_q0.92'].to_numpy()
+    assert np.all(np.diff(q) >= -1e-6)
+
+
+def test_overload_is_not_shortlisted():
+    """Overloaded points (queue still growing) get long RTT waits, not the near-zero waits of the few patients seen"""
+    heuristic = steady_state_slots(1/3, 3)
+    sweep = analytic_sweep({'in_res': [int(heuristic * 0.5)]}, in_inter_arrival=1/3)
+    assert sweep['RTT_WL_end'].iloc[0] > 1000
+    assert sweep['RTT_q0.92'].iloc[0] > 126
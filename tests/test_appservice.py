@@ -0,0 +1,88 @@
+""" Tests of the results service of the Streamlit app (appservice)"""
+import time
+
+import pandas as pd
+import pytest
+
+from src.appservice import ResultsService
+from src.Batch_rheum_Model import Batch_rheum_model
+
+SCENARIO = {'in_res': 3, 'in_inter_arrival': 2, 'in_figures': False} # small batch
+
+
+@pytest.fixture(name='service')
+def fixture_service():
+    """Service with a pool of two workers, shut down after the test"""
+    service = ResultsService(n_workers=2)
+    yield service
+    service.shutdown()
+
+
+def wait(service, job, timeout=120):
+    """Poll a job until all its replications are in"""
+    start = time.perf_counter()
+    while not job.done:
+        assert time.perf_counter() - start < timeout, "job did not finish"
+        service.poll(job)
+        time.sleep(0.05)
+    assert job.error is None
+
+
+def by_rep(frame):
+    """Rows of a batch log in replication order (the service merges replications as they complete)"""
+    return frame.sort_values('rep', kind='stable')
+
+
+def test_batch_matches_run_reps(service, tmp_path):
+    """A batch run in the background gives the logs and KPIs of run_reps with the same seed"""
+    job = service.submit(SCENARIO, reps=2, seed=5)
+    wait(service, job)
+    assert job.progress() == 1
+    batch = Batch_rheum_model(in_savepath=f"{tmp_path}/", in_loglinesave=False, **SCENARIO)
+    batch.run_reps(2, seed=5)
+    batch.headline_KPI()
+    pd.testing.assert_frame_equal(by_rep(job.batch.batch_mon_appointments), batch.batch_mon_appointments)
+    pd.testing.assert_frame_equal(job.batch.batch_kpi, batch.batch_kpi)
+
+
+def test_batches_are_memoised(service):
+    """The same scenario and run settings return the cached job, other settings a new one, and the least recently
+    used finished batches are evicted beyond max_jobs"""
+    service.max_jobs = 2
+    job = service.submit(SCENARIO, reps=1, seed=5)
+    assert service.submit(dict(reversed(SCENARIO.items())), reps=1, seed=5) is job
+    other = service.submit(SCENARIO, reps=1, seed=6)
+    assert other is not job
+    wait(service, job)
+    wait(service, other)
+    third = service.submit({**SCENARIO, 'in_res': 4}, reps=1, seed=5)
+    wait(service, third)
+    assert list(service.jobs) == [other.key, third.key]
+    assert service.submit(SCENARIO, reps=1, seed=5) is not job # evicted, run again
+
+
+
+def test_comparison_shares_the_warm_up(service, tmp_path):
+    """Scenarios sharing the warm-up parameters start from the same warm-up snapshots, as batches forked from
+    warm_up_reps, and a repeated comparison returns the same jobs"""
+    scenarios = {'base': SCENARIO, 'PIFU 20%': {**SCENARIO, 'in_prob_pifu': 0.2}}
+    jobs = service.submit_comparison(scenarios, reps=2, seed=5, crn=True)
+    assert service.submit_comparison(scenarios, reps=2, seed=5, crn=True) == jobs
+    for job in jobs.values():
+        wait(service, job)
+
+    snapshots = Batch_rheum_model(in_savepath=f"{tmp_path}/", in_loglinesave=False, **SCENARIO).warm_up_reps(2, seed=5, crn=True)
+    for name, scenario in scenarios.items():
+        batch = Batch_rheum_model(in_savepath=f"{tmp_path}/", in_loglinesave=False, **scenario)
+        batch.run_reps(2, seed=5, crn=True, snapshots=snapshots)
+        appointments = jobs[name].batch.batch_mon_appointments
+        pd.testing.assert_frame_equal(by_rep(appointments), batch.batch_mon_appointments)
+    assert not jobs['base'].batch.batch_mon_appointments.equals(jobs['PIFU 20%'].batch.batch_mon_appointments)
+
+
+def test_comparison_without_shared_warm_up(service):
+    """Scenarios with different warm-up parameters run as separate batches, the same as submitted one by one"""
+    scenarios = {'base': SCENARIO, 'more slots': {**SCENARIO, 'in_res': 4}}
+    jobs = service.submit_comparison(scenarios, reps=1, seed=5)
+    assert jobs['more slots'] is service.submit(scenarios['more slots'], reps=1, seed=5)
+    assert jobs['base'].futures and jobs['more slots'].futures # submitted straight away, without warm-up
@@ -0,0 +1,58 @@
+""" Tests of the change-point audit (auditrecorder) against an audit process polling the model"""
+import numpy as np
+import pandas as pd
+import pytest
+import simpy
+
+from src.auditrecorder import AUDIT_STATE, ChangePointAudit
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def polling_audit(model, rows):
+    """Audit process as before change points: the state polled every audit interval from the end of warm-up"""
+    yield model.env.timeout(model.g.warm_duration - model.env.now)
+    while True:
+        rows.append([model.env.now, *model.audit_state(), model.g.repid])
+        yield model.env.timeout(model.g.audit_interval)
+
+
+@pytest.mark.parametrize('audit_interval', [1, 7])
+def test_audit_log_matches_polling(tmp_path, audit_interval):
+    """Audit log rows resampled from the change points equal the rows of a polling audit"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, audit_interval=audit_interval, savepath=f"{tmp_path}/",
+                        loglinesave=False, figures=False, crn_seed=2, params=SHORT)
+    rows = []
+    model.env.process(polling_audit(model, rows))
+    model.run(chart=False)
+    polled = pd.DataFrame(rows, columns=model.g.results.columns)
+    pd.testing.assert_frame_equal(model.g.results, polled, check_dtype=False)
+
+
+def test_time_average_integrates_the_steps(tmp_path):
+    """Time averages over intervals equal the mean of the state at a fine grid within them"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False,
+                        crn_seed=2, params=SHORT)
+    model.run(chart=False)
+    edges = np.array([150, 200, 350])
+    fine = [np.arange(lo, hi, 1 / 64) + 1 / 128 for lo, hi in zip(edges[:-1], edges[1:])] # midpoints of fine steps
+    expected = np.array([model.audit.resample(grid).mean(axis=0) for grid in fine])
+    np.testing.assert_allclose(model.audit.time_average(edges), expected, rtol=0.01)
+    assert model.audit.time_average(edges).shape == (2, len(AUDIT_STATE))
+
+
+def test_resample_reads_the_state_before_changes_at_grid_times():
+    """A grid time with a change reads the state in effect until then, as an audit polling before the change"""
+    env = simpy.Environment()
+    state = [0]
+    audit = ChangePointAudit(env, lambda: (state[0],) * len(AUDIT_STATE), start=1)
+
+    def change():
+        for t, value in [(1.5, 3), (2, 5), (2, 6), (3.25, 2)]:
+            yield env.timeout(t - env.now)
+            state[0] = value
+            audit.update()
+    env.process(change())
+    env.run(until=5)
+    np.testing.assert_array_equal(audit.resample(np.array([1, 2, 3, 4]))[:, 0], [0, 3, 6, 2])
@@ -0,0 +1,86 @@
+""" Tests of batch replications (Batch_rheum_Model)"""
+import pandas as pd
+import pytest
+
+from src.Batch_rheum_Model import Batch_rheum_model
+
+
+def make_batch(tmp_path, **kwargs):
+    """Small batch (few patients), logs kept in memory, no figures"""
+    kwargs = {'in_figures': False, **kwargs}
+    return Batch_rheum_model(in_res=3, in_inter_arrival=2, in_savepath=f"{tmp_path}/", in_loglinesave=False, **kwargs)
+
+
+def test_no_replications_to_run(tmp_path):
+    """Running an empty range of replications returns no outputs and adds nothing to the batch"""
+    batch = make_batch(tmp_path)
+    assert batch.run_rep_ids(range(0)) == (None, None, None)
+    assert batch.run_rep_ids(range(0), n_workers=2, seeds=[]) == (None, None, None)
+    assert batch.batch_mon_appointments.empty
+
+
+@pytest.mark.parametrize('min_reps, max_reps', [(0, 5), (2, 0)])
+def test_adaptive_needs_replications(tmp_path, min_reps, max_reps):
+    """The adaptive replication count starts with at least one replication"""
+    with pytest.raises(ValueError, match='at least 1'):
+        make_batch(tmp_path).run_reps_adaptive(min_reps=min_reps, max_reps=max_reps)
+
+
+def test_adaptive_stops_at_max_reps(tmp_path):
+    """An unreachable precision stops at max_reps, with the precision reached per KPI"""
+    batch = make_batch(tmp_path)
+    batch.run_reps_adaptive(rel_precision=0, min_reps=2, batch_reps=1, max_reps=3, seed=4)
+    assert batch.reps_run == 3
+    assert sorted(batch.batch_mon_appointments['rep'].unique()) == [0, 1, 2]
+    assert list(batch.kpi_precision.index) == ['RTT_q0.92', 'RTT_WL_end']
+
+
+def test_parallel_replications_match_serial(tmp_path):
+    """Replications seeded from the same batch seed give the same batch logs in worker processes as one after another"""
+    (tmp_path / 'serial').mkdir()
+    (tmp_path / 'parallel').mkdir()
+    serial = make_batch(tmp_path / 'serial')
+    serial.run_reps(3, seed=8)
+    parallel = make_batch(tmp_path / 'parallel')
+    parallel.run_reps(3, n_workers=2, seed=8)
+    pd.testing.assert_frame_equal(serial.batch_mon_appointments, parallel.batch_mon_appointments)
+    pd.testing.assert_frame_equal(serial.batch_mon_audit, parallel.batch_mon_audit)
+    pd.testing.assert_frame_equal(serial.batch_time_weighted, parallel.batch_time_weighted)
+    assert sorted(parallel.batch_mon_appointments['rep'].unique()) == [0, 1, 2]
+
+
+def test_parquet_batch_logs_reload(tmp_path):
+    """Batch logs saved as parquet datasets reload a scenario's KPI inputs without rerunning"""
+    batch = make_batch(tmp_path)
+    batch.run_reps(2, seed=3)
+    batch.save_logs('parquet', scenario='base')
+    reloaded = make_batch(tmp_path)
+    reloaded.read_dataset_to_self(scenario='base')
+    assert len(reloaded.batch_mon_appointments) == len(batch.batch_mon_appointments)
+    pd.testing.assert_frame_equal(reloaded.headline_KPI(window_tail=300), batch.headline_KPI(window_tail=300))
+
+
+def test_headless_batch(tmp_path):
+    """With figures off, run_reps builds no figures but the same KPIs, and batch figures are built on first access only"""
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    import matplotlib.pyplot # pylint: disable=import-outside-toplevel
+    headless = make_batch(tmp_path)
+    outputs = headless.run_reps(2, seed=6)
+    assert all(output is None for output in outputs[4:]) and outputs[0] is None
+    assert headless.batch_figures.built == {}
+    with_figures = make_batch(tmp_path, in_figures=True)
+    with_figures.run_reps(2, seed=6)
+    pd.testing.assert_frame_equal(headless.batch_kpi, with_figures.batch_kpi)
+    assert set(with_figures.batch_figures.built) == {'audit', 'monappKPI'}
+    matplotlib.pyplot.close('all')
+
+    figures = headless.batch_figures
+    assert isinstance(figures.monappKPI, matplotlib.figure.Figure)
+    assert list(figures.built) == ['monappKPI']
+    assert figures.monappKPIn is figures.get('monappKPI')[1] # built once for both
+    sampled = figures.downsample(max_rows=50, max_timepoints=5)
+    assert isinstance(sampled.audit, matplotlib.figure.Figure) and 'audit' not in figures.built
+    for lazy in (figures, sampled):
+        lazy.close()
+        assert lazy.built == {}
@@ -0,0 +1,40 @@
+""" Tests of the benchmark suite (benchmark)"""
+import pytest
+import simpy
+
+from src.benchmark import compare_baselines, count_events, load_baseline, model_point, save_baseline
+
+
+def test_count_events():
+    """Every event processed by the environment is counted"""
+    env = simpy.Environment()
+
+    def ticks():
+        for _ in range(5):
+            yield env.timeout(1)
+    env.process(ticks())
+    events = count_events(env)
+    env.run(until=10)
+    assert events[0] == 8 # process start, 5 timeouts, process end and end of the run
+
+
+def test_model_point(tmp_path):
+    """A benchmark point reports events, throughput and time per phase, and is saved to a baseline"""
+    result = model_point(1, 1, loglinesave=False, figures=False)
+    assert result['events'] > 0
+    assert result['events_per_s'] == pytest.approx(result['events'] / result['simulation_s'])
+    assert {'simulation_s', 'log_read_s', 'chart_s', 'summarise_s', 'peak_rss_mb'} <= set(result)
+    save_baseline([result], f"{tmp_path}/bench.json")
+    assert load_baseline(f"{tmp_path}/bench.json")['results'][0]['events'] == result['events']
+
+
+def test_compare_baselines():
+    """Speedups are above 1 when the current code is better - higher throughput, lower times - and baselines from
+    before the capacity engine and figures options compare with the defaults"""
+    point = {'bench': 'model', 'arrivals_per_day': 6, 'horizon_y': 3, 'cap_diff': 0, 'log_format': 'csv'}
+    baseline = {'results': [{**point, 'events_per_s': 1000.0, 'total_s': 4.0}]}
+    current = {'results': [{**point, 'capacity_engine': 'resource', 'figures': True, 'events_per_s': 2000.0, 'total_s': 8.0}]}
+    speedup = compare_baselines(current, baseline).set_index('metric')['speedup']
+    assert speedup['events_per_s'] == pytest.approx(2)
+    assert speedup['total_s'] == pytest.approx(0.5)
+    assert compare_baselines({'results': [{**current['results'][0], 'figures': False}]}, baseline).empty
@@ -0,0 +1,37 @@
+""" Tests of the slot capacity engines (rheum_Model capacity_engine 'resource' and 'heap')"""
+import pytest
+
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+UNAVAILABILITY = {'none': {},
+                  'all slots, periodic': {'unavail_on': True},
+                  'some slots, weekly': {'unavail_on': True, 'unavail_freq_slot': 7, 'unavail_slot': 2, 'unavail_nrslots': 3},
+                  'shock': {'unavail_on': True, 'unavail_byshock': True, 'unavail_shock_tmin': 160, 'unavail_shock_period': 30,
+                            'unavail_shock_nrslots': 2}}
+
+
+def run(engine, seed, params, savepath, in_res=6):
+    """Seeded run of a model with the given capacity engine"""
+    model = rheum_Model(0, in_res=in_res, in_inter_arrival=1/2, savepath=f"{savepath}/", loglinesave=False, figures=False, crn_seed=seed,
+                        capacity_engine=engine, params={**SHORT, **params})
+    model.run(chart=False)
+    return model
+
+
+@pytest.mark.parametrize('unavailability', list(UNAVAILABILITY))
+@pytest.mark.parametrize('seed', [1, 2])
+def test_engines_give_the_same_run(tmp_path, unavailability, seed):
+    """Seeded runs give the same appointments, audit (slots occupied including blocked slots) and time-weighted KPIs
+    with either engine, with or without unavailability"""
+    resource = run('resource', seed, UNAVAILABILITY[unavailability], tmp_path)
+    heap = run('heap', seed, UNAVAILABILITY[unavailability], tmp_path)
+    assert resource.g.appt_queuing_results.equals(heap.g.appt_queuing_results)
+    assert resource.g.results.equals(heap.g.results)
+    assert resource.time_weighted.headline_kpis().equals(heap.time_weighted.headline_kpis())
+
+
+def test_unknown_engine():
+    """Engines other than 'resource' and 'heap' are rejected"""
+    with pytest.raises(ValueError, match='capacity engine'):
+        rheum_Model(0, loglinesave=False, figures=False, capacity_engine='calendar')
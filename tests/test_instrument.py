@@ -0,0 +1,77 @@
+""" Tests of the replication instrumentation (instrument)"""
+import json
+
+import pandas as pd
+import simpy
+
+from src.benchmark import count_events
+from src.instrument import Instrumentation
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def make_model(tmp_path, instrument):
+    """Seeded small model on the short horizon, logs kept in memory"""
+    return rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False, crn_seed=4,
+                       instrument=instrument, params={**SHORT, 'unavail_on': True})
+
+
+def test_instrumentation_does_not_change_results(tmp_path):
+    """An instrumented run gives the same results, and counts every event of the plain run against its process"""
+    plain = make_model(tmp_path, False)
+    events = count_events(plain.env)
+    plain.run(chart=False)
+    model = make_model(tmp_path, True)
+    model.run(chart=False)
+    pd.testing.assert_frame_equal(model.g.appt_queuing_results, plain.g.appt_queuing_results)
+    pd.testing.assert_frame_equal(model.g.results, plain.g.results)
+
+    summary = model.instrument_summary()
+    assert summary['events'] == events[0]
+    assert sum(events for events in model.instruments.process_frame()['events']) == events[0]
+    assert summary['events_attend_OPA'] > 0 and summary['events_obstruct_slot'] > 0
+    assert summary['processes_started'] >= model.patient_counter
+    assert summary['patients'] == len(model.patients)
+    assert 'phase_simulation_s' in summary
+
+
+def test_samples_and_export(tmp_path):
+    """Counters and probes are sampled every interval of simulation time and at the end of the run, and exported with
+    the summary"""
+    model = make_model(tmp_path, True)
+    model.run(chart=False)
+    samples = model.instruments.to_frame()
+    interval = model.g.instrument_interval
+    assert list(samples['time'][:-1] // interval) == list(range(len(samples) - 1))
+    assert samples['time'].iloc[-1] == SHORT['warm_duration'] + SHORT['obs_duration']
+    assert {'events', 'heap_size', 'patients', 'patients_waiting', 'log_rows'} <= set(samples)
+    assert samples['events'].is_monotonic_increasing
+
+    model.save_instruments(f"{tmp_path}/instrument")
+    with open(f"{tmp_path}/instrument.json", encoding='utf-8') as f:
+        assert json.load(f)['events'] == model.instruments.counters['events']
+    assert len(pd.read_csv(f"{tmp_path}/instrument.csv")) == len(samples)
+
+
+def test_plug_in_counters():
+    """Counters, timers and probes can be added, and processes are counted as they start and finish"""
+    env = simpy.Environment()
+    instruments = Instrumentation(env, sample_interval=1)
+    queue = []
+
+    def worker():
+        for _ in range(3):
+            instruments.count('jobs')
+            with instruments.timer('work'):
+                queue.append(env.now)
+            yield env.timeout(1)
+    instruments.add_probe('queue', lambda: len(queue))
+    env.process(worker())
+    env.process(worker())
+    env.run()
+    summary = instruments.summary()
+    assert summary['jobs'] == 6 and summary['work_s'] >= 0
+    assert summary['processes_started'] == summary['processes_finished'] == 2 and summary['processes_alive_max'] == 2
+    assert summary['events_worker'] == 8 # starts and 3 timeouts of each
+    assert list(instruments.to_frame()['queue']) == [0, 2, 4, 6]
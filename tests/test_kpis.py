@@ -0,0 +1,40 @@
+""" Tests of the vectorised KPI computations (kpis)"""
+import numpy as np
+import pandas as pd
+
+from src.helpers import mean_confidence_interval
+from src.kpis import QUANTILES, confidence_intervals, group_kpis, relative_precision
+
+
+def test_relative_precision_needs_an_estimate():
+    """No variation around zero is precise, but a KPI missing or seen in a single replication is not"""
+    data = pd.DataFrame({'KPI': ['zero', 'zero', 'stable', 'stable', 'single', 'varied', 'varied'],
+                         'value': [0.0, 0.0, 5.0, 5.0, 3.0, 1.0, 3.0]})
+    batch_kpi = confidence_intervals(data).reindex(['zero', 'stable', 'single', 'varied', 'missing'])
+    precision = relative_precision(batch_kpi)
+    assert precision['zero'] == 0
+    assert precision['stable'] == 0
+    assert precision['single'] == np.inf
+    assert precision['missing'] == np.inf
+    assert 0 < precision['varied'] < np.inf
+
+
+def test_group_kpis_match_pandas():
+    """Counts, means and quantiles per group as pandas groupby"""
+    rng = np.random.default_rng(3)
+    data = pd.DataFrame({'rep': rng.integers(1, 4, 500), 'priority': rng.integers(1, 4, 500), 'q_time': rng.exponential(20, 500)})
+    kpis = group_kpis(data, ['rep', 'priority']).set_index(['rep', 'priority'])
+    grouped = data.groupby(['rep', 'priority'])['q_time']
+    np.testing.assert_array_equal(kpis['n'], grouped.count())
+    np.testing.assert_allclose(kpis['mean'], grouped.mean())
+    for q in QUANTILES:
+        np.testing.assert_allclose(kpis[f"q{q}"], grouped.quantile(q))
+
+
+def test_confidence_intervals_match_per_kpi_computation():
+    """Vectorised confidence intervals equal mean_confidence_interval applied to each KPI's values"""
+    rng = np.random.default_rng(4)
+    data = pd.DataFrame({'KPI': np.repeat(['RTT_mean', 'RTT_q0.92', 'RTT_WL_end'], 6), 'value': rng.normal(50, 10, 18)})
+    batch_kpi = confidence_intervals(data)
+    for kpi, values in data.groupby('KPI')['value']:
+        np.testing.assert_allclose(batch_kpi.loc[kpi], mean_confidence_interval(values))
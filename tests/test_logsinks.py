@@ -0,0 +1,155 @@
+""" Tests of the event-log sinks (logsinks)"""
+import os
+
+import pandas as pd
+import pytest
+
+from src.helpers import Trial_Results_initiate
+from src.logsinks import LOGS, LogReader, MemorySink, make_sink, read_dataset, read_log, write_dataset
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def run(savepath, loglinesave, log_format='csv', seed=5):
+    """Seeded run of a small model on the short horizon, with logs written in chunks of 50 rows"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=savepath, log_format=log_format, loglinesave=loglinesave,
+                        figures=False, crn_seed=seed, params={**SHORT, 'log_chunk': 50})
+    model.run(chart=False)
+    return model
+
+
+def initiate_logs(savepath, log_format):
+    """Empty logs in savepath, as before a batch"""
+    Trial_Results_initiate(*[savepath + LOGS[log][0] + ".csv" for log in ['patient', 'appt', 'audit']], log_format)
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'parquet', 'npy'])
+def test_log_round_trip(tmp_path, log_format):
+    """Rows written in several chunks read back as logged, categories as labels"""
+    name, schema = LOGS['appt']
+    rows = [[i, 100 + i, 1 + i % 3, ['First', 'Traditional', 'PIFU'][i % 3], ['TFU', 'PIFU', 'First-only'][i % 3],
+             i * 0.5, i * 1.25, i % 2 == 0, 1] for i in range(7)]
+    sink = make_sink(log_format, f"{tmp_path}/{name}", schema, chunk_size=3)
+    sink.initiate()
+    memory = MemorySink(schema)
+    for row in rows:
+        sink.append(row)
+        memory.append(row)
+    sink.close()
+    pd.testing.assert_frame_equal(read_log(f"{tmp_path}/", 'appt', log_format), memory.to_frame(), check_dtype=False)
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'parquet', 'npy'])
+def test_saved_logs_match_memory(tmp_path, log_format):
+    """A run logging to file in chunks loads back the same audit, appointment and patient logs as a run logging to memory"""
+    initiate_logs(f"{tmp_path}/", log_format)
+    saved = run(f"{tmp_path}/", True, log_format)
+    memory = run(f"{tmp_path}/", False)
+    assert saved.appt_log.rows_written == len(memory.g.appt_queuing_results) > 50
+    pd.testing.assert_frame_equal(saved.g.appt_queuing_results, memory.g.appt_queuing_results, check_dtype=False)
+    pd.testing.assert_frame_equal(saved.g.results, memory.g.results, check_dtype=False)
+    pd.testing.assert_frame_equal(saved.results_df, memory.results_df, check_dtype=False)
+
+
+def test_memory_sink_grows():
+    """In-memory logs grow past their initial capacity, keeping every row with the schema's column types"""
+    _, schema = LOGS['audit']
+    sink = MemorySink(schema, chunk_size=2)
+    rows = [[i / 2, i, 3 * i, i, i, i, i % 4, 0] for i in range(9)]
+    for row in rows:
+        sink.append(row)
+    assert sink.buffer.capacity == 16
+    frame = sink.to_frame()
+    pd.testing.assert_frame_equal(frame, pd.DataFrame(rows, columns=[col.name for col in schema]).astype({col.name: col.dtype for col in schema}))
+    sink.initiate()
+    assert sink.to_frame().empty
+
+
+def test_memory_logs_do_not_depend_on_initial_capacity(tmp_path):
+    """In-memory logs of a run are the same whether they start at 1 row and grow, or start large"""
+    grown = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False,
+                        crn_seed=5, params={**SHORT, 'log_chunk': 1})
+    grown.run(chart=False)
+    memory = run(f"{tmp_path}/", False)
+    pd.testing.assert_frame_equal(grown.g.appt_queuing_results, memory.g.appt_queuing_results)
+    pd.testing.assert_frame_equal(grown.g.results, memory.g.results)
+
+
+def audit_rows(start, n):
+    """Audit log rows at times start, start + 1, ..."""
+    return [[float(t), t, 2, 1, 0, 1, 3, 0] for t in range(start, start + n)]
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'parquet', 'npy'])
+def test_log_reader_reads_new_rows_only(tmp_path, log_format):
+    """Each read returns the rows written since the previous one, and a reader from the end skips rows already there"""
+    name, schema = LOGS['audit']
+    sink = make_sink(log_format, f"{tmp_path}/{name}", schema, chunk_size=4)
+    sink.initiate()
+    reader = LogReader(f"{tmp_path}/", 'audit', log_format)
+    for row in audit_rows(0, 6):
+        sink.append(row)
+    sink.close()
+    late = LogReader(f"{tmp_path}/", 'audit', log_format, from_end=True)
+    assert list(reader.read_new()['time']) == list(range(6))
+    assert reader.read_new().empty
+    for row in audit_rows(6, 3):
+        sink.append(row)
+    sink.close()
+    assert list(reader.read_new()['time']) == [6, 7, 8]
+    assert list(late.read_new()['time']) == [6, 7, 8]
+
+
+def test_csv_reader_waits_for_complete_rows(tmp_path):
+    """A csv row still being written is read once complete"""
+    name, schema = LOGS['audit']
+    sink = make_sink('csv', f"{tmp_path}/{name}", schema)
+    sink.initiate()
+    reader = LogReader(f"{tmp_path}/", 'audit')
+    with open(f"{tmp_path}/{name}.csv", 'a', encoding="cp1252") as f:
+        f.write("1.0,1,2,1,0,1,3,0\n2.0,2,2")
+    assert list(reader.read_new()['time']) == [1.0]
+    with open(f"{tmp_path}/{name}.csv", 'a', encoding="cp1252") as f:
+        f.write(",1,0,1,3,0\n")
+    assert list(reader.read_new()['time']) == [2.0]
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'parquet'])
+def test_runs_load_their_own_rows(tmp_path, log_format):
+    """Runs saving to the same logs load back only the rows they added"""
+    initiate_logs(f"{tmp_path}/", log_format)
+    run(f"{tmp_path}/", True, log_format, seed=5)
+    second = run(f"{tmp_path}/", True, log_format, seed=6)
+    memory = run(f"{tmp_path}/", False, seed=6)
+    pd.testing.assert_frame_equal(second.g.appt_queuing_results, memory.g.appt_queuing_results, check_dtype=False)
+    pd.testing.assert_frame_equal(second.g.results, memory.g.results, check_dtype=False)
+
+
+def batch_appointments(rep, n=6):
+    """Batch appointment log rows of a replication, not in start_q order"""
+    return pd.DataFrame({'P_ID': range(n), 'priority': [3, 1, 2] * (n // 3), 'type': ['First', 'Traditional', 'PIFU'] * (n // 3),
+                         'pathway': ['TFU', 'TFU', 'PIFU'] * (n // 3), 'q_time': [1.5 * i for i in range(n)],
+                         'start_q': [100.0 * rep + 10 * ((5 * i) % n) for i in range(n)], 'rep': rep})
+
+
+def test_dataset_round_trip(tmp_path):
+    """Batch logs are partitioned by scenario and rep, read back as written (sorted by start_q within each rep), with
+    columns, partitions and start_q filters applied on read, and a scenario's partitions replaced when written again"""
+    path = f"{tmp_path}/batch_mon_appointments"
+    frame = pd.concat([batch_appointments(0), batch_appointments(1)], ignore_index=True)
+    write_dataset(frame, path, 'base')
+    write_dataset(frame.assign(q_time=frame['q_time'] * 2), path, 'PIFU 20%')
+    write_dataset(frame, path, 'base') # rewritten
+    assert len(os.listdir(path)) == 2 # (scenario names are URL-encoded in folder names)
+    assert sorted(os.listdir(f"{path}/scenario=base")) == ['rep=0', 'rep=1']
+
+    base = read_dataset(path, scenarios=['base'])
+    expected = frame.sort_values(['rep', 'start_q'], kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(base.drop(columns='scenario')[expected.columns], expected, check_dtype=False)
+    assert set(base['type']) == {'First', 'Traditional', 'PIFU'}
+
+    selected = read_dataset(path, columns=['rep', 'q_time', 'start_q'], filters=[('start_q', '>', 120)], scenarios=['PIFU 20%'], reps=[1])
+    assert list(selected.columns) == ['rep', 'q_time', 'start_q']
+    assert (selected['start_q'] > 120).all() and set(selected['rep']) == {1}
+    assert len(selected) == (expected[expected['rep'] == 1]['start_q'] > 120).sum()
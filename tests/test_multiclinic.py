@@ -0,0 +1,41 @@
+""" Tests of the multi-clinic model (multiclinic) and per-model parameters (rheum_Model params)"""
+import pytest
+
+from src.multiclinic import MultiClinicModel
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def test_params_recompute_derived_values():
+    """Overridden parameters update the values derived from them"""
+    model = rheum_Model(0, loglinesave=False, figures=False, params={**SHORT, 'interOPA_tri': [60, 120, 90]})
+    assert model.g.mean_interPIFU == round(90 * 1.6)
+    model = rheum_Model(0, loglinesave=False, figures=False, params={**SHORT, 'interOPA_tri': [60, 120, 90], 'mean_interPIFU': 50})
+    assert model.g.mean_interPIFU == 50
+
+
+@pytest.mark.parametrize('name', ['interfu_perc', 'max_fuopa_tenor_y', 'number_of_slots', 'capacity_engine'])
+def test_params_reject_keyword_arguments(name):
+    """Parameters of rheum_Model keyword arguments cannot be set by params"""
+    with pytest.raises(ValueError, match='keyword argument'):
+        rheum_Model(0, loglinesave=False, figures=False, params={name: 1})
+
+
+def test_sharding_does_not_change_results(tmp_path):
+    """Clinics give the same results in one environment or sharded, and alone or with other clinics"""
+    clinics = {'a': {'in_res': 4, 'in_inter_arrival': 1/2, 'params': SHORT},
+               'b': {'in_res': 3, 'in_inter_arrival': 1, 'params': SHORT},
+               'c': {'in_res': 3, 'in_inter_arrival': 1, 'capacity_engine': 'heap', 'params': SHORT}}
+    referrals = {('a', 'b'): 0.1}
+    together = MultiClinicModel(clinics, referrals, seed=3, savepath=f"{tmp_path}/")
+    together.run()
+    sharded = MultiClinicModel(clinics, referrals, seed=3, savepath=f"{tmp_path}/")
+    sharded.run(n_workers=2)
+    assert sorted(map(sorted, sharded.shards)) == [['a', 'b'], ['c']]
+    assert together.appointments.equals(sharded.appointments)
+    assert together.audit.equals(sharded.audit)
+
+    alone = MultiClinicModel({'c': clinics['c']}, seed=3, savepath=f"{tmp_path}/")
+    alone.run()
+    assert alone.appointments.equals(together.appointments[together.appointments['clinic'] == 'c'].reset_index(drop=True))
@@ -0,0 +1,42 @@
+""" Tests of the compact patient records (patient) and the model's register of patients in their pathway"""
+import pytest
+
+from src.patient import APPT_TYPES, PATHWAYS, FOPA_Patient
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def test_patient_is_compact():
+    """Patients have no per-instance dict, so attributes outside __slots__ cannot be set"""
+    patient = FOPA_Patient(1, 0.6, 3 * 365, 0.05, 0.08)
+    assert not hasattr(patient, '__dict__')
+    with pytest.raises(AttributeError):
+        patient.appointments = []
+
+
+@pytest.mark.parametrize('pathway', PATHWAYS)
+def test_pathway_labels(pathway):
+    """Pathway and first appointment type are kept as codes and read back as labels"""
+    patient = FOPA_Patient(1, 0.6, 3 * 365, 0.05, 0.08)
+    assert patient.type == 'TFU' and patient.apptype is None
+    patient.type = pathway
+    patient.apptype = 'First-only'
+    assert patient.type == pathway and patient.pathway == PATHWAYS.index(pathway)
+    assert patient.apptype == 'First-only' and patient.appt_type == APPT_TYPES.index('First-only')
+
+
+def test_model_keeps_patients_in_pathway(tmp_path):
+    """The model holds the patients still in their pathway: discharged patients are dropped, and the audit's
+    'patients in system' counts the model's patients. Logs label pathways and appointment types"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False,
+                        crn_seed=2, params=SHORT)
+    discharged = []
+    model.on_discharge = lambda _model, patient: discharged.append(patient.id)
+    model.run(chart=False)
+    assert discharged
+    assert not set(discharged) & set(model.patients)
+    assert len(model.patients) + len(discharged) == model.patient_counter
+    assert model.audit_state()[0] == len(model.patients)
+    appointments = model.g.appt_queuing_results
+    assert set(appointments['type']) <= set(APPT_TYPES) and set(appointments['pathway']) <= set(PATHWAYS)
@@ -0,0 +1,68 @@
+""" Tests of the random number streams (randomstreams): block pre-sampling and scalar draws"""
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.randomstreams import STREAMS, RandomStreams
+from src.rheum_Model import rheum_Model
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def run(tmp_path, **kwargs):
+    """Run of a small model on the short horizon, logs kept in memory"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False, params=SHORT, **kwargs)
+    model.run(chart=False)
+    return model
+
+
+def assert_same_run(model, other):
+    """Same appointments and audit in two runs"""
+    pd.testing.assert_frame_equal(model.g.appt_queuing_results, other.g.appt_queuing_results)
+    pd.testing.assert_frame_equal(model.g.results, other.g.results)
+
+
+@pytest.mark.parametrize('block', [1, 3, 4096])
+def test_streams_do_not_depend_on_block_size(block):
+    """Each source draws the variates of its own numpy Generator, whatever the block size"""
+    streams = RandomStreams(seed=12, rep=3, block=block)
+    uniforms = [streams.random('dna') for _ in range(10)]
+    exponentials = [streams.expovariate('arrivals', 2.0) for _ in range(10)]
+    np.testing.assert_allclose(uniforms, np.random.default_rng([12, 3, STREAMS.index('dna')]).random(10))
+    np.testing.assert_allclose(exponentials, np.random.default_rng([12, 3, STREAMS.index('arrivals')]).exponential(0.5, 10))
+
+
+def test_triangular_draws():
+    """Triangular draws stay within their bounds, with the distribution's mean"""
+    streams = RandomStreams(seed=1, rep=0)
+    draws = np.array([streams.triangular('interfu', 60, 180, 90) for _ in range(20000)])
+    assert draws.min() >= 60 and draws.max() <= 180
+    assert draws.mean() == pytest.approx((60 + 180 + 90) / 3, rel=0.01)
+
+
+def test_state_resumes_mid_block():
+    """Streams resumed from a saved state continue with the variates not drawn yet"""
+    streams = RandomStreams(seed=4, rep=1, block=8)
+    for _ in range(5):
+        streams.random('pifu_triage')
+    state = streams.getstate()
+    expected = [streams.random('pifu_triage') for _ in range(10)]
+    resumed = RandomStreams(seed=99, rep=0, block=8)
+    resumed.setstate(state)
+    assert [resumed.random('pifu_triage') for _ in range(10)] == expected
+
+
+def test_scalar_draws_are_seeded(tmp_path):
+    """rng_block=0 draws from the global random module, so random.seed reproduces a run"""
+    random.seed(7)
+    model = run(tmp_path, rng_block=0)
+    random.seed(7)
+    assert_same_run(model, run(tmp_path, rng_block=0))
+
+
+@pytest.mark.parametrize('rng_block', [0, 1, 100])
+def test_block_size_does_not_change_results(tmp_path, rng_block):
+    """Common random number streams give the same run whatever the block size (rng_block=0: one variate per draw)"""
+    assert_same_run(run(tmp_path, crn_seed=11), run(tmp_path, crn_seed=11, rng_block=rng_block))
@@ -0,0 +1,35 @@
+""" Tests of scenario comparison with common random numbers (scenarios)"""
+import numpy as np
+import pandas as pd
+
+from src.scenarios import compare_scenarios, paired_differences
+
+BASE = {'in_res': 3, 'in_inter_arrival': 2, 'in_loglinesave': False, 'in_figures': False} # small batch, logs kept in memory
+
+
+def test_paired_differences_by_replication():
+    """Differences are taken replication by replication, so a constant shift has no spread"""
+    baseline = pd.DataFrame({'rep': [0, 1, 2, 0, 1, 2], 'KPI': ['a'] * 3 + ['b'] * 3, 'value': [1.0, 5.0, 9.0, 2.0, 2.0, 4.0]})
+    scenario = baseline.assign(value=baseline['value'] + np.where(baseline['KPI'] == 'a', 3.0, -1.0)).iloc[::-1]
+    diffs = paired_differences(scenario, baseline)
+    np.testing.assert_allclose(diffs.loc['a'], [3.0, 3.0, 3.0])
+    np.testing.assert_allclose(diffs.loc['b'], [-1.0, -1.0, -1.0])
+
+
+def test_scenarios_share_random_numbers(tmp_path):
+    """Scenarios run on the same streams: a copy of the baseline has the same KPIs in every replication, and a scenario
+    changing PIFU sees the same RTT arrivals"""
+    base = {**BASE, 'in_res': 5} # (spare capacity: RTT patients are seen soon after they arrive)
+    comparison, batches = compare_scenarios({'base': base, 'copy': base, 'PIFU 20%': {**base, 'in_prob_pifu': 0.2}},
+                                            reps=2, seed=3, savepath=f"{tmp_path}/")
+    pd.testing.assert_frame_equal(batches['copy'].batch_kpi_rep, batches['base'].batch_kpi_rep)
+    copy = comparison[comparison['scenario'] == 'copy']
+    assert (copy['diff_mean'] == 0).all()
+    assert (copy[['diff_LCI', 'diff_UCI']].fillna(0) == 0).all().all() # (no interval for KPIs seen in one replication)
+
+    def rtt_arrivals(batch):
+        appointments = batch.batch_mon_appointments
+        seen = (appointments['priority'] == 3) & (appointments['start_q'] < batch.g.warm_duration + batch.g.obs_duration - 90)
+        return appointments[seen].sort_values(['rep', 'start_q'])[['rep', 'start_q']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(rtt_arrivals(batches['PIFU 20%']), rtt_arrivals(batches['base']))
+    assert not batches['PIFU 20%'].batch_kpi_rep.equals(batches['base'].batch_kpi_rep)
@@ -0,0 +1,54 @@
+""" Tests of warm-up snapshots (snapshot): runs forked from the end of warm-up"""
+import pandas as pd
+import pytest
+
+from src.rheum_Model import rheum_Model
+from src.snapshot import load_snapshot
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def make_model(tmp_path, **kwargs):
+    """Seeded small model on the short horizon, logs kept in memory"""
+    kwargs = {'in_res': 4, 'crn_seed': 5, **kwargs}
+    return rheum_Model(0, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False, params=SHORT, **kwargs)
+
+
+def run(tmp_path, **kwargs):
+    """Run of a small model"""
+    model = make_model(tmp_path, **kwargs)
+    model.run(chart=False)
+    return model
+
+
+def test_snapshot_fork_matches_straight_run(tmp_path):
+    """A run forked from a warm-up snapshot continues as the straight run does"""
+    straight = run(tmp_path)
+    fork = run(tmp_path, snapshot=make_model(tmp_path).warm_up())
+
+    appointments = fork.g.appt_queuing_results # appointments ending after warm-up
+    pd.testing.assert_frame_equal(straight.g.appt_queuing_results.tail(len(appointments)).reset_index(drop=True), appointments)
+    observed = straight.g.results[straight.g.results['time'] >= SHORT['warm_duration']].reset_index(drop=True)
+    pd.testing.assert_frame_equal(observed, fork.g.results)
+    pd.testing.assert_frame_equal(straight.time_weighted.headline_kpis(), fork.time_weighted.headline_kpis())
+
+
+def test_saved_snapshot_forks_repeatably(tmp_path):
+    """A snapshot loaded from file, and forked more than once, gives the same run each time"""
+    snapshot = make_model(tmp_path).warm_up()
+    snapshot.save(f"{tmp_path}/warm.pkl")
+    first = run(tmp_path, snapshot=snapshot)
+    again = run(tmp_path, snapshot=snapshot)
+    loaded = run(tmp_path, snapshot=load_snapshot(f"{tmp_path}/warm.pkl"))
+    for other in (again, loaded):
+        pd.testing.assert_frame_equal(first.g.appt_queuing_results, other.g.appt_queuing_results)
+        pd.testing.assert_frame_equal(first.g.results, other.g.results)
+
+
+def test_snapshot_needs_the_same_warm_up(tmp_path):
+    """Runs differing from the snapshot in a warm-up parameter are rejected, other parameters can change"""
+    snapshot = make_model(tmp_path).warm_up()
+    with pytest.raises(ValueError, match='number_of_slots'):
+        make_model(tmp_path, in_res=5, snapshot=snapshot)
+    pifu = run(tmp_path, in_prob_pifu=0.2, snapshot=snapshot)
+    assert not pifu.g.appt_queuing_results.equals(run(tmp_path, snapshot=snapshot).g.appt_queuing_results)
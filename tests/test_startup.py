@@ -0,0 +1,35 @@
+""" Tests of worker start-up: the simulation core imports no plotting or statistics modules"""
+import subprocess
+import sys
+
+from src.benchmark import HEAVY_MODULES, run_startup
+
+CORE_MODULES = ('src.rheum_Model', 'src.Batch_rheum_Model', 'src.patient', 'src.initialisers', 'src.kpis', 'src.helpers')
+
+
+def test_core_imports_no_heavy_modules(tmp_path):
+    """Importing the simulation core, and running a replication without figures, loads none of HEAVY_MODULES"""
+    code = ("import sys\n"
+            + "".join(f"import {module}\n" for module in CORE_MODULES)
+            + "from src.rheum_Model import rheum_Model\n"
+            + f"rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath='{tmp_path}/', loglinesave=False, figures=False, "
+              "params={'warm_duration': 50, 'obs_duration': 50}).run(chart=False)\n"
+            + "print(' '.join(sorted({name.split('.')[0] for name in sys.modules})))\n")
+    loaded = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split()
+    assert not set(loaded) & set(HEAVY_MODULES)
+
+
+def test_statistics_import_on_first_use():
+    """Confidence intervals still work, importing scipy when first needed"""
+    code = ("import sys\n"
+            "from src.helpers import mean_confidence_interval\n"
+            "assert 'scipy' not in sys.modules\n"
+            "print(mean_confidence_interval([1.0, 2.0, 3.0])[0])\n")
+    assert subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.strip() == '2.0'
+
+
+def test_spawned_worker_startup():
+    """A spawned worker reaches the first simulation event without importing HEAVY_MODULES"""
+    result = run_startup(arrivals_per_day=1, horizon_y=1)
+    assert result['heavy_modules'] == []
+    assert result['startup_s'] >= result['import_s'] > 0
@@ -0,0 +1,100 @@
+""" Tests of the streaming and time-weighted statistics (streamstats)"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.kpis import QUANTILES, group_kpis
+from src.rheum_Model import rheum_Model
+from src.auditrecorder import AUDIT_STATE
+from src.streamstats import QuantileSketch, StreamingSummary, TimeWeightedKPIs, TimeWeightedSummary
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def stream_run(tmp_path, raw_logs=True):
+    """Seeded run of a small model with streaming KPIs"""
+    model = rheum_Model(0, in_res=4, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False, crn_seed=9,
+                        stream_stats=True, raw_logs=raw_logs, params=SHORT)
+    model.run(chart=False)
+    return model
+
+
+@pytest.mark.parametrize('accuracy', [0.01, 0.05])
+def test_sketch_quantiles_within_accuracy(accuracy):
+    """Sketch quantiles are within the relative accuracy of the exact (interpolated) quantiles"""
+    values = np.random.default_rng(1).exponential(30, 5000)
+    sketch = QuantileSketch(accuracy)
+    for x in values:
+        sketch.update(x)
+    for q in (0.01,) + QUANTILES + (1,):
+        assert sketch.quantile(q) == pytest.approx(np.quantile(values, q), rel=accuracy)
+
+
+def test_summary_mean_and_variance():
+    """Running mean and variance equal the exact ones"""
+    values = np.random.default_rng(2).normal(40, 12, 1000)
+    summary = StreamingSummary()
+    for x in values:
+        summary.update(x)
+    assert summary.n == len(values)
+    assert summary.mean == pytest.approx(values.mean())
+    assert summary.variance() == pytest.approx(values.var(ddof=1))
+
+
+def test_stream_kpis_match_appointment_log(tmp_path):
+    """Streaming KPIs per priority and interval have the counts and means of the appointment log, and its quantiles
+    within the sketch accuracy - and do not need the log"""
+    model = stream_run(tmp_path)
+    log = model.g.appt_queuing_results
+    log = log[log['start_q'] > model.g.warm_duration].assign(interval=lambda d: ((d['start_q'] + d['q_time']) // model.g.stream_step) * model.g.stream_step)
+    exact = group_kpis(log, ['rep', 'priority', 'interval'])
+    stream = model.stream_kpis.interval_kpis()
+    assert len(exact) > 3
+    np.testing.assert_array_equal(stream['n'], exact['n'])
+    np.testing.assert_allclose(stream['mean'], exact['mean'])
+    for q in QUANTILES:
+        np.testing.assert_allclose(stream[f"q{q}"], exact[f"q{q}"], rtol=model.g.stream_accuracy, atol=1e-3)
+
+    headless = stream_run(tmp_path, raw_logs=False)
+    assert headless.g.appt_queuing_results.empty
+    pd.testing.assert_frame_equal(headless.stream_kpis.interval_kpis(), stream)
+    pd.testing.assert_frame_equal(headless.stream_kpis.headline_kpis(), model.stream_kpis.headline_kpis())
+
+
+def test_time_weighted_summary():
+    """Time-weighted mean, max and quantiles of a step function weigh each value by the time spent at it"""
+    summary = TimeWeightedSummary()
+    for value, duration in [(0, 2.0), (3, 1.0), (1, 1.0)]:
+        summary.update(value, duration)
+    assert summary.mean == 1.0 and summary.max == 3
+    assert [summary.quantile(q) for q in (0.5, 0.75, 0.95)] == [0, 1, 3]
+    assert np.isnan(TimeWeightedSummary().quantile(0.5))
+
+
+def test_time_weighted_kpis_keep_the_window():
+    """Only the part of each state within the final window counts, scaled per series"""
+    kpis = TimeWeightedKPIs(0, {'WL': (0, 1), 'utilisation': (1, 4)}, max_time=10, window_tail=5, quantiles=(0.5,))
+    kpis.update((8, 4), 0, 6) # 1 day in the window
+    kpis.update((2, 2), 6, 12) # 4 days in the window
+    row = kpis.headline_kpis().iloc[0]
+    assert row['WL_mean'] == pytest.approx((8 + 2 * 4) / 5)
+    assert row['WL_max'] == 8 and row['WL_q0.5'] == 2
+    assert row['utilisation_mean'] == pytest.approx((4 + 2 * 4) / 5 / 4)
+
+
+def test_time_weighted_kpis_match_the_audit(tmp_path):
+    """Time-weighted KPIs of a run are those of its audited state over the observation period"""
+    model = stream_run(tmp_path)
+    end = model.g.warm_duration + model.g.obs_duration
+    kpis = model.time_weighted.headline_kpis().iloc[0]
+    averages = model.audit_averages([model.g.warm_duration, end]).iloc[0]
+    times, values = model.audit.arrays()
+    durations = np.diff(np.append(times, end))
+    for name, column, scale in [('RTT_WL', 'priority 3 patients waiting', 1), ('utilisation', 'resources occupied', model.g.number_of_slots)]:
+        series = values[:, AUDIT_STATE.index(column)]
+        assert kpis[f"{name}_mean"] == pytest.approx(averages[column] / scale)
+        assert kpis[f"{name}_max"] == series.max() / scale
+        order = np.argsort(series, kind='stable')
+        for q in QUANTILES:
+            at_or_below = np.cumsum(durations[order]) >= q * durations.sum() * (1 - 1e-12)
+            assert kpis[f"{name}_q{q}"] == series[order][np.argmax(at_or_below)] / scale
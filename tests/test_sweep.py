@@ -0,0 +1,50 @@
+""" Tests of the parameter sweep runner (sweep)"""
+import numpy as np
+import pandas as pd
+
+from src import sweep
+from src.sweep import SWEEP_PARAMS, code_version, full_grid, latin_hypercube, point_key, resolve_point
+
+
+def test_cap_diff_resolves_to_integer_slots():
+    """cap_diff gives whole daily slots, with the same cache key as the same point given by in_res"""
+    params = resolve_point({'cap_diff': 2})
+    assert isinstance(params['in_res'], int)
+    settings, version = {'reps': 2, 'seed': 1, 'crn': True, 'window_tail': 365}, code_version()
+    for in_res in (params['in_res'], float(params['in_res'])):
+        same = resolve_point({'in_res': in_res})
+        assert same == params
+        assert point_key(same, settings, version) == point_key(params, settings, version)
+    assert set(params) == set(SWEEP_PARAMS)
+
+
+def test_designs():
+    """A full grid has every combination of the factors, and a Latin hypercube one point in each stratum of each range"""
+    grid = full_grid({'in_res': [3, 4], 'in_prob_pifu': [0, 0.2, 0.4]}, in_inter_arrival=2)
+    assert len(grid) == 6 and all(point['in_inter_arrival'] == 2 for point in grid)
+    assert {(point['in_res'], point['in_prob_pifu']) for point in grid} == {(r, p) for r in [3, 4] for p in [0, 0.2, 0.4]}
+
+    design = latin_hypercube({'in_prob_pifu': (0, 0.5), 'cap_diff': (-2, 2)}, 5, seed=1)
+    strata = np.floor(np.array([point['in_prob_pifu'] for point in design]) / 0.1)
+    assert sorted(strata) == [0, 1, 2, 3, 4]
+    assert all(isinstance(point['cap_diff'], int) for point in design)
+
+
+def test_sweep_reads_cached_points(tmp_path, monkeypatch):
+    """A second sweep over the same points reads them from the cache instead of running them, and an extended sweep
+    runs only the new points"""
+    points = [{'in_res': 2, 'in_inter_arrival': 2}, {'in_res': 3, 'in_inter_arrival': 2}]
+    first = sweep.run_sweep(points, reps=1, cache_dir=str(tmp_path))
+    assert not first['cached'].any()
+
+    run = []
+    worker = sweep.sweep_point_worker
+    monkeypatch.setattr(sweep, 'sweep_point_worker', lambda params, *args: run.append(params['in_res']) or worker(params, *args))
+    second = sweep.run_sweep(points, reps=1, cache_dir=str(tmp_path))
+    assert second['cached'].all() and not run
+    pd.testing.assert_frame_equal(first.drop(columns='cached'), second.drop(columns='cached'))
+
+    extended = sweep.run_sweep(points + [{'in_res': 4, 'in_inter_arrival': 2}], reps=1, cache_dir=str(tmp_path))
+    assert run == [4]
+    assert list(extended.groupby('point')['cached'].all()) == [True, True, False]
+    assert sorted(sweep.load_sweep_cache(str(tmp_path))['in_res'].unique()) == [2, 3, 4]
@@ -0,0 +1,62 @@
+""" Tests of the trace channel (tracing) of a replication"""
+import numpy as np
+import pytest
+
+from src.rheum_Model import rheum_Model
+from src.tracing import TRACE_CODES, Tracer, read_trace, trace_codes
+
+SHORT = {'warm_duration': 150, 'obs_duration': 200} # short horizon [days]
+
+
+def traced_run(tmp_path, trace_level, engine='resource', **params):
+    """Seeded run of a small model with tracing on (records kept in the ring buffer)"""
+    model = rheum_Model(0, in_res=6, in_inter_arrival=1/2, savepath=f"{tmp_path}/", loglinesave=False, figures=False, crn_seed=3,
+                        capacity_engine=engine, trace_level=trace_level, params={**SHORT, **params})
+    model.run(chart=False)
+    return model
+
+
+def test_trace_levels_and_categories():
+    """Kinds are traced up to the level, and only in the categories given"""
+    assert trace_codes(1) == {TRACE_CODES['audit']}
+    assert TRACE_CODES['slot_blocked'] not in trace_codes(2)
+    assert TRACE_CODES['slot_blocked'] in trace_codes(3)
+    assert trace_codes(3, ['pifu']) == {TRACE_CODES['pifu_attended'], TRACE_CODES['pifu_dna']}
+
+    tracer = Tracer(level=2, categories=['tfu'])
+    for kind in ['audit', 'tfu_attended', 'pifu_attended', 'slot_blocked']:
+        tracer.emit(kind, 1.0)
+    assert [record[1] for record in tracer.records] == [TRACE_CODES['tfu_attended']]
+
+
+def test_run_traces_only_its_level(tmp_path):
+    """A run at level 2 traces audit and pathway events, not slot unavailability"""
+    kinds = set(traced_run(tmp_path, 2, unavail_on=True).tracer.to_frame()['kind'])
+    assert {'audit', 'first_attended', 'tfu_attended'} <= kinds
+    assert 'slot_blocked' not in kinds
+
+
+def test_file_sink_round_trip(tmp_path):
+    """Records written to a trace file in chunks read back in order"""
+    tracer = Tracer(level=3, sink='file', capacity=2, path=f"{tmp_path}/trace.bin")
+    records = [(float(i), TRACE_CODES['tfu_attended'], i, i + 1, 1, 2, i / 4) for i in range(5)]
+    for t, _, a, b, c, d, v in records:
+        tracer.emit('tfu_attended', t, a, b, c, d, v)
+    tracer.close()
+    assert read_trace(f"{tmp_path}/trace.bin") == records
+
+
+@pytest.mark.parametrize('params', [{'unavail_on': True, 'unavail_freq_slot': 7, 'unavail_slot': 2, 'unavail_nrslots': 3},
+                                    {'unavail_on': True, 'unavail_byshock': True, 'unavail_shock_tmin': 160,
+                                     'unavail_shock_period': 30, 'unavail_shock_nrslots': 2}])
+def test_slot_blocks_traced_by_both_engines(tmp_path, params):
+    """Both capacity engines trace the same slot blocks, when each block takes its slot and until when it holds it"""
+    resource = traced_run(tmp_path, 3, 'resource', **params).tracer.to_frame()
+    heap = traced_run(tmp_path, 3, 'heap', **params).tracer.to_frame()
+    assert resource.equals(heap)
+
+    blocked = resource[resource['kind'] == 'slot_blocked']
+    duration = params.get('unavail_shock_period') if params.get('unavail_byshock') else params['unavail_slot']
+    assert len(blocked) > 0
+    np.testing.assert_allclose(blocked['value'] - blocked['time'], duration)
+    assert (blocked['a'] >= 1).all() # the block's slot is counted as used